@@ -207,7 +207,8 @@ def main():
         if args_cli.real_time and sleep_time > 0:
             time.sleep(sleep_time)
 
-    # close the simulator
+    # close the runner and the simulator
+    ppo_runner.close()
     env.close()
 
 
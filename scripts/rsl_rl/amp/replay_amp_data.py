@@ -49,7 +49,6 @@ import gymnasium as gym
 import numpy as np
 import torch
 
-from isaaclab.utils.math import quat_rotate
 from isaaclab_rl.rsl_rl import RslRlVecEnvWrapper
 from isaaclab_tasks.utils import parse_env_cfg
 
@@ -81,6 +80,7 @@ def main():
 
     env_cfg.amp_num_preload_transitions = 1
     env_cfg.amp_replay_buffer_size = 2
+    env_cfg.amp_build_reset_table = True
 
     # create isaac environment
     env = gym.make(args_cli.task, cfg=env_cfg)
@@ -106,23 +106,12 @@ def main():
                     t = 0
                 else:
                     t += env_cfg.sim.dt * env_cfg.sim.render_interval
-                frames = env.unwrapped.amp_loader.get_full_frame_at_time_batch(np.array([traj_idx]), np.array([t]))
-                positions = env.unwrapped.amp_loader.get_root_pos_batch(frames)
-                orientations = env.unwrapped.amp_loader.get_root_rot_batch(frames)  # xyzw
-                # Func quat_rotate() and Isaacsim/IsaacLab all need wxyz
-                orientations = torch.cat((orientations[:, -1].unsqueeze(1), orientations[:, :-1]), dim=1)
-                lin_vel = quat_rotate(orientations, env.unwrapped.amp_loader.get_linear_vel_batch(frames))
-                ang_vel = quat_rotate(orientations, env.unwrapped.amp_loader.get_angular_vel_batch(frames))
-                velocities = torch.cat([lin_vel, ang_vel], dim=-1)
-                env.unwrapped.robot.write_root_pose_to_sim(
-                    torch.cat([positions, orientations], dim=-1), env_ids=env_ids
+                # States in simulator convention (wxyz, world-frame velocities, Isaac Sim joint order)
+                root_pose, root_velocity, joint_pos, joint_vel = env.unwrapped.amp_loader.get_reset_state_at_time_batch(
+                    np.array([traj_idx]), np.array([t])
                 )
-                env.unwrapped.robot.write_root_velocity_to_sim(velocities, env_ids=env_ids)
-                joint_pos = env.unwrapped.amp_loader.get_joint_pose_batch(frames)
-                joint_vel = env.unwrapped.amp_loader.get_joint_vel_batch(frames)
-                # Isaac Sim uses breadth-first joint ordering, while Isaac Gym uses depth-first joint ordering
-                joint_pos = env.unwrapped.amp_loader.reorder_from_isaacgym_to_isaacsim_tool(joint_pos)
-                joint_vel = env.unwrapped.amp_loader.reorder_from_isaacgym_to_isaacsim_tool(joint_vel)
+                env.unwrapped.robot.write_root_pose_to_sim(root_pose, env_ids=env_ids)
+                env.unwrapped.robot.write_root_velocity_to_sim(root_velocity, env_ids=env_ids)
                 joint_pos_limits = env.unwrapped.robot.data.soft_joint_pos_limits[env_ids]
                 joint_pos = joint_pos.clamp_(joint_pos_limits[..., 0], joint_pos_limits[..., 1])
                 joint_vel_limits = env.unwrapped.robot.data.soft_joint_vel_limits[env_ids]
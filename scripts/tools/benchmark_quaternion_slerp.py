@@ -0,0 +1,70 @@
+# Copyright (c) 2024-2025 Ziqi Fan
+# SPDX-License-Identifier: Apache-2.0
+
+"""Micro-benchmark of the batched quaternion slerp shared by the AMP motion loaders.
+
+Example:
+    python scripts/tools/benchmark_quaternion_slerp.py --device cuda:0
+"""
+
+import argparse
+import importlib.util
+import os
+import time
+import torch
+
+# amp_utils only needs torch, so it is loaded from its file. Importing it through the robot_lab package would register
+# the tasks, which needs the simulator.
+AMP_UTILS_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "../../source/robot_lab/robot_lab/third_party/rsl_rl_amp/utils/amp_utils.py",
+)
+amp_utils_spec = importlib.util.spec_from_file_location("amp_utils", AMP_UTILS_PATH)
+amp_utils = importlib.util.module_from_spec(amp_utils_spec)
+amp_utils_spec.loader.exec_module(amp_utils)
+quaternion_slerp = amp_utils.quaternion_slerp
+
+parser = argparse.ArgumentParser(description="Benchmark quaternion_slerp throughput.")
+parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+parser.add_argument("--sizes", type=int, nargs="+", default=[10**4, 10**5, 10**6, 10**7])
+parser.add_argument("--repeats", type=int, default=20, help="Timed calls per size and variant.")
+parser.add_argument("--compile", action="store_true", default=False, help="Also benchmark torch.compile.")
+args = parser.parse_args()
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def benchmark(fn, q0, q1, fraction, repeats):
+    """Returns the mean time in seconds of a call, after a warm-up call."""
+    fn(q0, q1, fraction)
+    synchronize(q0.device)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(q0, q1, fraction)
+    synchronize(q0.device)
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    device = torch.device(args.device)
+    variants = {"eager": quaternion_slerp, "script": torch.jit.script(quaternion_slerp)}
+    if args.compile:
+        variants["compile"] = torch.compile(quaternion_slerp)
+
+    print(f"{'quaternions':>12} " + " ".join(f"{name + ' [Mq/s]':>16}" for name in variants))
+    for size in args.sizes:
+        q0 = torch.nn.functional.normalize(torch.randn(size, 4, device=device), dim=-1)
+        # Mix of small and large rotations, to cover both the nlerp and slerp paths.
+        q1 = torch.nn.functional.normalize(
+            q0 + torch.randn(size, 1, device=device).pow(3) * torch.randn_like(q0), dim=-1
+        )
+        fraction = torch.rand(size, 1, device=device)
+        throughputs = [size / benchmark(fn, q0, q1, fraction, args.repeats) / 1e6 for fn in variants.values()]
+        print(f"{size:>12} " + " ".join(f"{throughput:>16.1f}" for throughput in throughputs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# Copyright (c) 2024-2025 Ziqi Fan
+# SPDX-License-Identifier: Apache-2.0
+
+"""Packs JSON AMP motion files into npz shards that can be streamed during training.
+
+Example:
+    python scripts/tools/build_amp_motion_shards.py --motion_files "motions/*.txt" --output_dir shards --clips_per_shard 64
+"""
+
+import argparse
+import glob
+import importlib.util
+import os
+
+# motion_ingest only needs NumPy, so it is loaded from its file. Importing it through the robot_lab package would
+# register the tasks, which needs the simulator.
+MOTION_INGEST_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "../../source/robot_lab/robot_lab/third_party/rsl_rl_amp/datasets/motion_ingest.py",
+)
+motion_ingest_spec = importlib.util.spec_from_file_location("motion_ingest", MOTION_INGEST_PATH)
+motion_ingest = importlib.util.module_from_spec(motion_ingest_spec)
+motion_ingest_spec.loader.exec_module(motion_ingest)
+
+parser = argparse.ArgumentParser(description="Pack AMP motion files into npz shards.")
+parser.add_argument("--motion_files", type=str, required=True, help="Glob pattern of the motion files.")
+parser.add_argument("--output_dir", type=str, required=True, help="Directory to write the shards to.")
+parser.add_argument("--clips_per_shard", type=int, default=64, help="Number of motion files per shard.")
+args = parser.parse_args()
+
+
+def main():
+    motion_files = sorted(glob.glob(args.motion_files))
+    if not motion_files:
+        raise ValueError(f"No motion files match {args.motion_files}.")
+    os.makedirs(args.output_dir, exist_ok=True)
+    for shard_idx, start in enumerate(range(0, len(motion_files), args.clips_per_shard)):
+        shard_path = os.path.join(args.output_dir, f"shard_{shard_idx:05d}.npz")
+        motion_ingest.write_npz_shard(shard_path, motion_files[start : start + args.clips_per_shard])
+        print(f"Wrote {shard_path}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,8 @@ from isaaclab.envs import DirectRLEnv
 from isaaclab.sim.spawners.from_files import GroundPlaneCfg, spawn_ground_plane
 from isaaclab.utils.math import quat_rotate
 
+from robot_lab.third_party.rsl_rl_amp.datasets.frame_index import NearestFrameIndex
+
 from .g1_amp_env_cfg import G1AmpEnvCfg
 from .motions import MotionLoader
 
@@ -290,6 +292,35 @@ class G1AmpEnv(DirectRLEnv):
         )
         return amp_observation.view(-1, self.amp_observation_size)
 
+    def build_motion_frame_index(self, leaf_size: int = 32) -> NearestFrameIndex:
+        """Build a nearest-frame index over the single-frame AMP observations of every motion frame.
+
+        Args:
+            leaf_size: Maximum number of frames per leaf of the index.
+
+        Returns:
+            The index. Its frame ``i`` is the motion frame at time ``i * dt``.
+        """
+        num_frames = self._motion_loader.num_frames
+        (
+            dof_positions,
+            dof_velocities,
+            body_positions,
+            body_rotations,
+            body_linear_velocities,
+            body_angular_velocities,
+        ) = self._motion_loader.sample(num_samples=num_frames, times=np.arange(num_frames) * self._motion_loader.dt)
+        amp_observation = compute_obs(
+            dof_positions[:, self.motion_dof_indexes],
+            dof_velocities[:, self.motion_dof_indexes],
+            body_positions[:, self.motion_ref_body_index],
+            body_rotations[:, self.motion_ref_body_index],
+            body_linear_velocities[:, self.motion_ref_body_index],
+            body_angular_velocities[:, self.motion_ref_body_index],
+            body_positions[:, self.motion_key_body_indexes],
+        )
+        return NearestFrameIndex(amp_observation, leaf_size=leaf_size)
+
 
 @torch.jit.script
 def quaternion_to_tangent_and_normal(q: torch.Tensor) -> torch.Tensor:
@@ -8,6 +8,8 @@ import os
 import torch
 from typing import Optional
 
+from robot_lab.third_party.rsl_rl_amp.utils.amp_utils import quaternion_slerp
+
 
 class MotionLoader:
     """
@@ -128,35 +130,7 @@ class MotionLoader:
         if q0.ndim >= 3:
             blend = blend.unsqueeze(-1)
 
-        qw, qx, qy, qz = 0, 1, 2, 3  # wxyz
-        cos_half_theta = (
-            q0[..., qw] * q1[..., qw]
-            + q0[..., qx] * q1[..., qx]
-            + q0[..., qy] * q1[..., qy]
-            + q0[..., qz] * q1[..., qz]
-        )
-
-        neg_mask = cos_half_theta < 0
-        q1 = q1.clone()
-        q1[neg_mask] = -q1[neg_mask]
-        cos_half_theta = torch.abs(cos_half_theta)
-        cos_half_theta = torch.unsqueeze(cos_half_theta, dim=-1)
-
-        half_theta = torch.acos(cos_half_theta)
-        sin_half_theta = torch.sqrt(1.0 - cos_half_theta * cos_half_theta)
-
-        ratio_a = torch.sin((1 - blend) * half_theta) / sin_half_theta
-        ratio_b = torch.sin(blend * half_theta) / sin_half_theta
-
-        new_q_x = ratio_a * q0[..., qx : qx + 1] + ratio_b * q1[..., qx : qx + 1]
-        new_q_y = ratio_a * q0[..., qy : qy + 1] + ratio_b * q1[..., qy : qy + 1]
-        new_q_z = ratio_a * q0[..., qz : qz + 1] + ratio_b * q1[..., qz : qz + 1]
-        new_q_w = ratio_a * q0[..., qw : qw + 1] + ratio_b * q1[..., qw : qw + 1]
-
-        new_q = torch.cat([new_q_w, new_q_x, new_q_y, new_q_z], dim=len(new_q_w.shape) - 1)
-        new_q = torch.where(torch.abs(sin_half_theta) < 0.001, 0.5 * q0 + 0.5 * q1, new_q)
-        new_q = torch.where(torch.abs(cos_half_theta) >= 1, q0, new_q)
-        return new_q
+        return quaternion_slerp(q0, q1, blend)
 
     def _compute_frame_blend(self, times: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
         """Compute the indexes of the first and second values, as well as the blending time
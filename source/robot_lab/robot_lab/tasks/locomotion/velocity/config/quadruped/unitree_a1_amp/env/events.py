@@ -22,28 +22,32 @@ def reset_amp(
     # extract the used quantities (to enable type-hinting)
     asset: RigidObject | Articulation = env.scene[asset_cfg.name]
 
-    frames = env.unwrapped.amp_loader.get_full_frame_batch(len(env_ids))
+    amp_loader = env.unwrapped.amp_loader
+    if amp_loader.reset_table is not None:
+        # States precomputed in simulator convention (wxyz, world-frame velocities, Isaac Sim joint order)
+        root_pose, root_velocity, joint_pos, joint_vel = amp_loader.get_reset_state_batch(len(env_ids))
+    else:
+        frames = amp_loader.get_full_frame_batch(len(env_ids))
+        root_orn = amp_loader.get_feature_batch(frames, "root_rot")  # xyzw
+        # Func quat_rotate() and Isaacsim/IsaacLab all need wxyz
+        root_orn = torch.cat((root_orn[:, -1].unsqueeze(1), root_orn[:, :-1]), dim=1)
+        root_pose = torch.cat([amp_loader.get_feature_batch(frames, "root_pos"), root_orn], dim=-1)
+        # base velocities
+        lin_vel = quat_rotate(root_orn, amp_loader.get_feature_batch(frames, "linear_vel"))
+        ang_vel = quat_rotate(root_orn, amp_loader.get_feature_batch(frames, "angular_vel"))
+        root_velocity = torch.cat([lin_vel, ang_vel], dim=-1)
+        # Isaac Sim uses breadth-first joint ordering, while Isaac Gym uses depth-first joint ordering
+        joint_pos = amp_loader.reorder_from_isaacgym_to_isaacsim_tool(amp_loader.get_feature_batch(frames, "joint_pos"))
+        joint_vel = amp_loader.reorder_from_isaacgym_to_isaacsim_tool(amp_loader.get_feature_batch(frames, "joint_vel"))
 
     # Step1: reset_root_state
     # base position
-    root_pos = env.unwrapped.amp_loader.get_root_pos_batch(frames)
-    root_pos[:, :2] = root_pos[:, :2] + env.scene.env_origins[env_ids, :2]
-    root_orn = env.unwrapped.amp_loader.get_root_rot_batch(frames)  # xyzw
-    # Func quat_rotate() and Isaacsim/IsaacLab all need wxyz
-    root_orn = torch.cat((root_orn[:, -1].unsqueeze(1), root_orn[:, :-1]), dim=1)
-    # base velocities
-    lin_vel = quat_rotate(root_orn, env.unwrapped.amp_loader.get_linear_vel_batch(frames))
-    ang_vel = quat_rotate(root_orn, env.unwrapped.amp_loader.get_angular_vel_batch(frames))
+    root_pose[:, :2] = root_pose[:, :2] + env.scene.env_origins[env_ids, :2]
     # set into the physics simulation
-    asset.write_root_pose_to_sim(torch.cat([root_pos, root_orn], dim=-1), env_ids=env_ids)
-    asset.write_root_velocity_to_sim(torch.cat([lin_vel, ang_vel], dim=-1), env_ids=env_ids)
+    asset.write_root_pose_to_sim(root_pose, env_ids=env_ids)
+    asset.write_root_velocity_to_sim(root_velocity, env_ids=env_ids)
 
     # Step2: reset_joints
-    joint_pos = env.unwrapped.amp_loader.get_joint_pose_batch(frames)
-    joint_vel = env.unwrapped.amp_loader.get_joint_vel_batch(frames)
-    # Isaac Sim uses breadth-first joint ordering, while Isaac Gym uses depth-first joint ordering
-    joint_pos = env.unwrapped.amp_loader.reorder_from_isaacgym_to_isaacsim_tool(joint_pos)
-    joint_vel = env.unwrapped.amp_loader.reorder_from_isaacgym_to_isaacsim_tool(joint_vel)
     # clamp joint pos to limits
     joint_pos_limits = asset.data.soft_joint_pos_limits[env_ids]
     joint_pos = joint_pos.clamp_(joint_pos_limits[..., 0], joint_pos_limits[..., 1])
@@ -40,6 +40,17 @@ class ManagerBasedRLAmpEnv(ManagerBasedRLEnv, gym.Env):
                 device=self.device,
                 motion_files=self.cfg.amp_motion_files,
                 time_between_frames=self.cfg.sim.dt * self.cfg.sim.render_interval,
+                motion_cache_dir=self.cfg.amp_motion_cache_dir,
+                storage_dtype=self.cfg.amp_storage_dtype,
+                num_ingest_workers=self.cfg.amp_num_ingest_workers,
+                clip_cache_bytes=self.cfg.amp_clip_cache_bytes,
+                shared_library_dir=self.cfg.amp_shared_library_dir,
+                build_reset_table=self.cfg.amp_build_reset_table,
+                # Lazy mirroring only applies to sampled AMP transitions, reset states are drawn from stored clips.
+                mirror_motions="stored" if self.cfg.amp_mirror_motions == "stored" else None,
+                # Reset states only read these columns of the library.
+                feature_groups=AMPLoader.RESET_STATE_GROUPS if self.cfg.amp_build_reset_table else None,
+                reset_only=True,
             )
 
         self.num_actions = self.action_manager.total_action_dim
@@ -145,3 +156,10 @@ class ManagerBasedRLAmpEnv(ManagerBasedRLEnv, gym.Env):
 
         # return observations, rewards, resets and extras
         return self.obs_buf, self.reward_buf, self.reset_terminated, self.reset_time_outs, self.extras
+
+    def close(self):
+        # release the shared motion library of the reference state loader
+        # note: also called on deletion, possibly before the loader was created
+        if getattr(self, "amp_loader", None) is not None:
+            self.amp_loader.close()
+        super().close()
@@ -125,5 +125,52 @@ class UnitreeA1AmpRoughEnvCfg(LocomotionVelocityRoughEnvCfg):
         self.base_name = self.base_link_name
         self.reference_state_initialization = True
         self.amp_motion_files = glob.glob(f"{AMP_UTILS_DIR}/motion_files/mocap_motions_a1/*")
+        # Directory of the content-hashed cache of parsed motion files, which lets later runs skip JSON parsing. Set it
+        # to enable the cache, e.g. to os.path.expanduser("~/.cache/robot_lab/amp_motions"). Needed by
+        # amp_clip_cache_bytes. Disabled if None.
+        self.amp_motion_cache_dir = None
+        self.amp_storage_dtype = "float32"
+        self.amp_num_ingest_workers = 0
+        self.amp_clip_cache_bytes = None
+        # Directory, e.g. on /dev/shm, through which the processes of a node share one copy of the motion library in
+        # host memory. A GPU still gets its own copy per process. The last process to close removes the library, and
+        # shared_library.purge removes libraries left by crashed runs. Disabled if None.
+        self.amp_shared_library_dir = None
+        # Draw reset states from a table of every library frame converted once to simulator convention, see
+        # AMPLoader.get_reset_state_batch. Unlike the default reset, states between frames blend the world-frame
+        # velocities linearly, instead of rotating the blended body-frame velocities by the blended root rotation.
+        self.amp_build_reset_table = False
+        # Left/right mirror augmentation of the expert clips: None, "stored" or "lazy".
+        self.amp_mirror_motions = None
+        # Feature groups of the motion frames kept by the discriminator's expert loader, see AMPLoader.FRAME_SCHEMA.
+        self.amp_feature_groups = ("root_pos", "joint_pos", "foot_pos", "linear_vel", "angular_vel", "joint_vel")
+        # Stream expert clips from the tar or npz shards of this directory instead of loading amp_motion_files. Needs
+        # amp_mirror_motions and amp_feature_groups unset, and compact preloading and precomputed observations off.
+        self.amp_motion_shard_dir = None
+        self.amp_stream_reservoir_clips = 256
+        self.amp_stream_refresh_clips = 32
+        self.amp_stream_num_workers = 4
         self.amp_num_preload_transitions = 2000000
+        # Store preloaded transitions as frame indices and blends instead of full frames, which needs far less memory.
+        self.amp_compact_preload_transitions = False
+        self.amp_precompute_observations = False
         self.amp_replay_buffer_size = 1000000
+        # "pair" stores policy transitions as contiguous (state, next state) pairs, in amp_replay_buffer_dtype, with
+        # amp_replay_buffer_host_size more pairs in host memory. "stream" stores each observation once and feeds the
+        # discriminator windows of amp_history_length observations, which other layouts do not support.
+        self.amp_replay_buffer_layout = "separate"
+        self.amp_replay_buffer_dtype = "float32"
+        self.amp_replay_buffer_host_size = 0
+        self.amp_history_length = 1
+        # Keep the replay buffer across resumes, in a memory-mapped amp_replay_buffer directory next to the checkpoints.
+        self.amp_save_replay_buffer = False
+        # Number of AMP minibatches built ahead of time on worker threads, 0 to build them in the update loop.
+        self.amp_prefetch_batches = 0
+        # "coupled" steps the discriminator once per PPO minibatch with the policy optimizer. "decoupled" gives it its
+        # own Adam optimizer (at the PPO learning rate if amp_discr_learning_rate is None), and takes amp_discr_steps
+        # steps on batches of amp_discr_batch_size transitions every amp_discr_update_interval iterations.
+        self.amp_discr_schedule = "coupled"
+        self.amp_discr_learning_rate = None
+        self.amp_discr_batch_size = 4096
+        self.amp_discr_steps = 20
+        self.amp_discr_update_interval = 1
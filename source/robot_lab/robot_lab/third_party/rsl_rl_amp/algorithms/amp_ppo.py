@@ -28,6 +28,7 @@
 #
 # Copyright (c) 2021 ETH Zurich, Nikita Rudin
 
+import itertools
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -37,7 +38,12 @@ from rsl_rl.modules import ActorCritic
 from rsl_rl.modules.rnd import RandomNetworkDistillation
 from rsl_rl.storage import RolloutStorage
 from rsl_rl.utils import string_to_callable
-from robot_lab.third_party.rsl_rl_amp.storage.replay_buffer import ReplayBuffer
+from robot_lab.third_party.rsl_rl_amp.storage.replay_buffer import (
+    FrameStreamReplayBuffer,
+    PairReplayBuffer,
+    ReplayBuffer,
+)
+from robot_lab.third_party.rsl_rl_amp.utils.prefetch import Prefetcher
 
 
 class AMPPPO:
@@ -54,6 +60,16 @@ class AMPPPO:
         amp_normalizer,
         min_std=None,
         amp_replay_buffer_size=100000,
+        amp_replay_buffer_layout="separate",
+        amp_replay_buffer_dtype=torch.float32,
+        amp_replay_buffer_host_size=0,
+        amp_history_length=1,
+        amp_prefetch_batches=0,
+        amp_discr_schedule="coupled",
+        amp_discr_learning_rate=None,
+        amp_discr_batch_size=4096,
+        amp_discr_steps=20,
+        amp_discr_update_interval=1,
         num_learning_epochs=1,
         num_mini_batches=1,
         clip_param=0.2,
@@ -116,21 +132,70 @@ class AMPPPO:
         self.discriminator = discriminator
         self.discriminator.to(self.device)
         self.amp_transition = RolloutStorage.Transition()
-        self.amp_storage = ReplayBuffer(discriminator.input_dim // 2, amp_replay_buffer_size, device)
+        # "separate" stores states and next states in two float32 tensors. "pair" stores them contiguously as pairs,
+        # optionally in a reduced precision dtype and with an overflow tier of amp_replay_buffer_host_size pairs in
+        # host memory. "stream" stores the observation stream of each environment once and samples windows of
+        # amp_history_length observations from it, it is the only layout that supports a history length above one.
+        if amp_history_length > 1 and amp_replay_buffer_layout != "stream":
+            raise ValueError(
+                f"AMP history length {amp_history_length} needs the stream replay buffer layout, got"
+                f" {amp_replay_buffer_layout}."
+            )
+        self.amp_history_length = amp_history_length
+        self.amp_frame_dim = discriminator.input_dim // (2 * amp_history_length)
+        self.amp_replay_buffer_size = amp_replay_buffer_size
+        if amp_replay_buffer_layout == "separate":
+            self.amp_storage = ReplayBuffer(self.amp_frame_dim, amp_replay_buffer_size, device)
+        elif amp_replay_buffer_layout == "pair":
+            self.amp_storage = PairReplayBuffer(
+                self.amp_frame_dim,
+                amp_replay_buffer_size,
+                device,
+                dtype=amp_replay_buffer_dtype,
+                host_buffer_size=amp_replay_buffer_host_size,
+            )
+        elif amp_replay_buffer_layout == "stream":
+            self.amp_storage = None  # initialized in init_storage, once the number of environments is known
+        else:
+            raise ValueError(f"Unknown AMP replay buffer layout {amp_replay_buffer_layout}.")
+        self.amp_replay_buffer_layout = amp_replay_buffer_layout
         self.amp_data = amp_data
         self.amp_normalizer = amp_normalizer
+        # Number of AMP minibatches built ahead of time on worker threads, 0 to build them in the update loop.
+        self.amp_prefetch_batches = amp_prefetch_batches
+        self.amp_prefetch_stats = {}
 
         # PPO components
         self.actor_critic = actor_critic
         self.actor_critic.to(self.device)
         self.storage = None  # initialized later
 
+        # "coupled" steps the discriminator once per PPO minibatch, on a batch of the same size, with the policy
+        # optimizer. "decoupled" gives it its own optimizer, and takes amp_discr_steps steps on batches of
+        # amp_discr_batch_size transitions after the PPO epochs of every amp_discr_update_interval-th update.
+        if amp_discr_schedule not in ("coupled", "decoupled"):
+            raise ValueError(f"Unknown discriminator schedule {amp_discr_schedule}, expected 'coupled' or 'decoupled'.")
+        self.amp_discr_schedule = amp_discr_schedule
+        self.amp_discr_batch_size = amp_discr_batch_size
+        self.amp_discr_steps = amp_discr_steps
+        self.amp_discr_update_interval = amp_discr_update_interval
+        self.update_count = 0
+        # Means of the discriminator losses and predictions of the last discriminator update.
+        self.amp_discr_stats = (0.0, 0.0, 0.0, 0.0)
+
         # Optimizer for policy and discriminator.
-        params = [
-            {"params": self.actor_critic.parameters(), "name": "actor_critic"},
+        discriminator_params = [
             {"params": self.discriminator.trunk.parameters(), "weight_decay": 10e-4, "name": "amp_trunk"},
             {"params": self.discriminator.amp_linear.parameters(), "weight_decay": 10e-2, "name": "amp_head"},
         ]
+        params = [{"params": self.actor_critic.parameters(), "name": "actor_critic"}]
+        if self.amp_discr_schedule == "coupled":
+            params += discriminator_params
+            self.discriminator_optimizer = None
+        else:
+            self.discriminator_optimizer = optim.Adam(
+                discriminator_params, lr=learning_rate if amp_discr_learning_rate is None else amp_discr_learning_rate
+            )
         self.optimizer = optim.Adam(params, lr=learning_rate)
         # self.optimizer = optim.Adam(self.actor_critic.parameters(), lr=learning_rate)
         self.transition = RolloutStorage.Transition()
@@ -162,6 +227,14 @@ class AMPPPO:
             rnd_state_shape,
             self.device,
         )
+        if self.amp_replay_buffer_layout == "stream":
+            self.amp_storage = FrameStreamReplayBuffer(
+                self.amp_frame_dim,
+                num_envs,
+                self.amp_replay_buffer_size,
+                self.device,
+                history_length=self.amp_history_length,
+            )
 
     def test_mode(self):
         self.actor_critic.test()
@@ -184,6 +257,13 @@ class AMPPPO:
         self.amp_transition.observations = amp_obs
         return self.transition.actions
 
+    def get_amp_transition(self, amp_obs, next_amp_obs):
+        """Returns the discriminator inputs (s, s_next) of the current step, windows of past observations for the
+        stream layout and the observations themselves otherwise."""
+        if self.amp_replay_buffer_layout == "stream":
+            return self.amp_storage.get_latest_transition(amp_obs, next_amp_obs)
+        return amp_obs, next_amp_obs
+
     def process_env_step(self, rewards, dones, infos, amp_obs):
         # Record the rewards and dones
         # Note: we clone here because later on we bootstrap the rewards based on timeouts
@@ -208,7 +288,10 @@ class AMPPPO:
                 self.transition.values * infos["time_outs"].unsqueeze(1).to(self.device), 1
             )
 
-        self.amp_storage.insert(self.amp_transition.observations, amp_obs)
+        if self.amp_replay_buffer_layout == "stream":
+            self.amp_storage.insert(self.amp_transition.observations, amp_obs, dones)
+        else:
+            self.amp_storage.insert(self.amp_transition.observations, amp_obs)
         # Record the transition
         self.storage.add_transitions(self.transition)
         self.transition.clear()
@@ -220,6 +303,100 @@ class AMPPPO:
         last_values = self.actor_critic.evaluate(last_critic_obs).detach()
         self.storage.compute_returns(last_values, self.gamma, self.lam)
 
+    def amp_generators(self, num_mini_batch, mini_batch_size):
+        """Returns the generators of policy and expert AMP minibatches, prefetched on worker threads if enabled."""
+        amp_policy_generator = self.amp_storage.feed_forward_generator(num_mini_batch, mini_batch_size)
+        amp_expert_generator = self.amp_data.feed_forward_generator(
+            num_mini_batch, mini_batch_size, history_length=self.amp_history_length
+        )
+        if self.amp_prefetch_batches > 0:
+            amp_policy_generator = Prefetcher(amp_policy_generator, self.amp_prefetch_batches)
+            amp_expert_generator = Prefetcher(amp_expert_generator, self.amp_prefetch_batches)
+        return amp_policy_generator, amp_expert_generator
+
+    def close_amp_generators(self, amp_policy_generator, amp_expert_generator):
+        if self.amp_prefetch_batches > 0:
+            amp_policy_generator.close()
+            amp_expert_generator.close()
+            self.amp_prefetch_stats = {"policy": amp_policy_generator.stats, "expert": amp_expert_generator.stats}
+
+    def compute_discriminator_loss(self, sample_amp_policy, sample_amp_expert):
+        """Returns the discriminator loss and gradient penalty of a minibatch, the predictions of the discriminator
+        and the unnormalized policy and expert states."""
+        if self.amp_replay_buffer_layout == "pair":
+            # Pairs of shape (N, 2, obs_dim) are normalized as one tensor and flattened into the input.
+            policy_pairs = sample_amp_policy
+            policy_state_unnorm = policy_pairs[:, 0].clone()
+        else:
+            policy_state, policy_next_state = sample_amp_policy
+            policy_state_unnorm = torch.clone(policy_state)
+        expert_state, expert_next_state = sample_amp_expert
+        expert_state_unnorm = torch.clone(expert_state)
+
+        if self.amp_normalizer is not None:
+            with torch.no_grad():
+                if self.amp_replay_buffer_layout == "pair":
+                    policy_pairs = self.amp_normalizer.normalize_torch(policy_pairs, self.device)
+                else:
+                    policy_state = self.amp_normalizer.normalize_torch(policy_state, self.device)
+                    policy_next_state = self.amp_normalizer.normalize_torch(policy_next_state, self.device)
+                expert_state = self.amp_normalizer.normalize_torch(expert_state, self.device)
+                expert_next_state = self.amp_normalizer.normalize_torch(expert_next_state, self.device)
+        if self.amp_replay_buffer_layout == "pair":
+            policy_d = self.discriminator(policy_pairs.flatten(1))
+        else:
+            policy_d = self.discriminator(torch.cat([policy_state, policy_next_state], dim=-1))
+        expert_d = self.discriminator(torch.cat([expert_state, expert_next_state], dim=-1))
+        expert_loss = torch.nn.MSELoss()(expert_d, torch.ones(expert_d.size(), device=self.device))
+        policy_loss = torch.nn.MSELoss()(policy_d, -1 * torch.ones(policy_d.size(), device=self.device))
+        amp_loss = 0.5 * (expert_loss + policy_loss)
+        grad_pen_loss = self.discriminator.compute_grad_pen(expert_state, expert_next_state, lambda_=10)
+        return amp_loss, grad_pen_loss, policy_d, expert_d, policy_state_unnorm, expert_state_unnorm
+
+    def update_amp_normalizer(self, policy_state_unnorm, expert_state_unnorm):
+        if self.amp_normalizer is not None:
+            # Windows are split into their observations.
+            self.amp_normalizer.update(policy_state_unnorm.reshape(-1, self.amp_frame_dim).cpu().numpy())
+            self.amp_normalizer.update(expert_state_unnorm.reshape(-1, self.amp_frame_dim).cpu().numpy())
+
+    def update_discriminator(self):
+        """Takes amp_discr_steps steps of the discriminator optimizer, on batches of amp_discr_batch_size policy and
+        expert transitions.
+
+        Returns:
+            The mean AMP loss, gradient penalty, policy prediction and expert prediction.
+        """
+        mean_amp_loss = 0
+        mean_grad_pen_loss = 0
+        mean_policy_pred = 0
+        mean_expert_pred = 0
+        amp_policy_generator, amp_expert_generator = self.amp_generators(
+            self.amp_discr_steps, self.amp_discr_batch_size
+        )
+        try:
+            for sample_amp_policy, sample_amp_expert in zip(amp_policy_generator, amp_expert_generator):
+                amp_loss, grad_pen_loss, policy_d, expert_d, policy_state_unnorm, expert_state_unnorm = (
+                    self.compute_discriminator_loss(sample_amp_policy, sample_amp_expert)
+                )
+                self.discriminator_optimizer.zero_grad()
+                (amp_loss + grad_pen_loss).backward()
+                self.discriminator_optimizer.step()
+                self.update_amp_normalizer(policy_state_unnorm, expert_state_unnorm)
+
+                mean_amp_loss += amp_loss.item()
+                mean_grad_pen_loss += grad_pen_loss.item()
+                mean_policy_pred += policy_d.mean().item()
+                mean_expert_pred += expert_d.mean().item()
+        finally:
+            self.close_amp_generators(amp_policy_generator, amp_expert_generator)
+
+        return (
+            mean_amp_loss / self.amp_discr_steps,
+            mean_grad_pen_loss / self.amp_discr_steps,
+            mean_policy_pred / self.amp_discr_steps,
+            mean_expert_pred / self.amp_discr_steps,
+        )
+
     def update(self):  # noqa: C901
         mean_value_loss = 0
         mean_surrogate_loss = 0
@@ -245,219 +422,205 @@ class AMPPPO:
         else:
             generator = self.storage.mini_batch_generator(self.num_mini_batches, self.num_learning_epochs)
 
-        amp_policy_generator = self.amp_storage.feed_forward_generator(
-            self.num_learning_epochs * self.num_mini_batches,
-            self.storage.num_envs * self.storage.num_transitions_per_env // self.num_mini_batches,
-        )
-        amp_expert_generator = self.amp_data.feed_forward_generator(
-            self.num_learning_epochs * self.num_mini_batches,
-            self.storage.num_envs * self.storage.num_transitions_per_env // self.num_mini_batches,
-        )
-
-        # iterate over batches
-        for (
-            (
-                obs_batch,
-                critic_obs_batch,
-                actions_batch,
-                target_values_batch,
-                advantages_batch,
-                returns_batch,
-                old_actions_log_prob_batch,
-                old_mu_batch,
-                old_sigma_batch,
-                hid_states_batch,
-                masks_batch,
-                rnd_state_batch,
-            ),
-            sample_amp_policy,
-            sample_amp_expert,
-        ) in zip(generator, amp_policy_generator, amp_expert_generator):
-            # number of augmentations per sample
-            # we start with 1 and increase it if we use symmetry augmentation
-            num_aug = 1
-            # original batch size
-            original_batch_size = obs_batch.shape[0]
-
-            # Perform symmetric augmentation
-            if self.symmetry and self.symmetry["use_data_augmentation"]:
-                # augmentation using symmetry
-                data_augmentation_func = self.symmetry["data_augmentation_func"]
-                # returned shape: [batch_size * num_aug, ...]
-                obs_batch, actions_batch = data_augmentation_func(
-                    obs=obs_batch, actions=actions_batch, env=self.symmetry["_env"], is_critic=False
-                )
-                critic_obs_batch, _ = data_augmentation_func(
-                    obs=critic_obs_batch, actions=None, env=self.symmetry["_env"], is_critic=True
-                )
-                # compute number of augmentations per sample
-                num_aug = int(obs_batch.shape[0] / original_batch_size)
-                # repeat the rest of the batch
-                # -- actor
-                old_actions_log_prob_batch = old_actions_log_prob_batch.repeat(num_aug, 1)
-                # -- critic
-                target_values_batch = target_values_batch.repeat(num_aug, 1)
-                advantages_batch = advantages_batch.repeat(num_aug, 1)
-                returns_batch = returns_batch.repeat(num_aug, 1)
-
-            # Recompute actions log prob and entropy for current batch of transitions
-            # Note: we need to do this because we updated the actor_critic with the new parameters
-            # -- actor
-            self.actor_critic.act(obs_batch, masks=masks_batch, hidden_states=hid_states_batch[0])
-            actions_log_prob_batch = self.actor_critic.get_actions_log_prob(actions_batch)
-            # -- critic
-            value_batch = self.actor_critic.evaluate(
-                critic_obs_batch, masks=masks_batch, hidden_states=hid_states_batch[1]
-            )
-            # -- entropy
-            # we only keep the entropy of the first augmentation (the original one)
-            mu_batch = self.actor_critic.action_mean[:original_batch_size]
-            sigma_batch = self.actor_critic.action_std[:original_batch_size]
-            entropy_batch = self.actor_critic.entropy[:original_batch_size]
-
-            # KL
-            if self.desired_kl is not None and self.schedule == "adaptive":
-                with torch.inference_mode():
-                    kl = torch.sum(
-                        torch.log(sigma_batch / old_sigma_batch + 1.0e-5)
-                        + (torch.square(old_sigma_batch) + torch.square(old_mu_batch - mu_batch))
-                        / (2.0 * torch.square(sigma_batch))
-                        - 0.5,
-                        axis=-1,
-                    )
-                    kl_mean = torch.mean(kl)
-
-                    if kl_mean > self.desired_kl * 2.0:
-                        self.learning_rate = max(1e-5, self.learning_rate / 1.5)
-                    elif kl_mean < self.desired_kl / 2.0 and kl_mean > 0.0:
-                        self.learning_rate = min(1e-2, self.learning_rate * 1.5)
-
-                    for param_group in self.optimizer.param_groups:
-                        param_group["lr"] = self.learning_rate
-
-            # Surrogate loss
-            ratio = torch.exp(actions_log_prob_batch - torch.squeeze(old_actions_log_prob_batch))
-            surrogate = -torch.squeeze(advantages_batch) * ratio
-            surrogate_clipped = -torch.squeeze(advantages_batch) * torch.clamp(
-                ratio, 1.0 - self.clip_param, 1.0 + self.clip_param
-            )
-            surrogate_loss = torch.max(surrogate, surrogate_clipped).mean()
-
-            # Value function loss
-            if self.use_clipped_value_loss:
-                value_clipped = target_values_batch + (value_batch - target_values_batch).clamp(
-                    -self.clip_param, self.clip_param
-                )
-                value_losses = (value_batch - returns_batch).pow(2)
-                value_losses_clipped = (value_clipped - returns_batch).pow(2)
-                value_loss = torch.max(value_losses, value_losses_clipped).mean()
-            else:
-                value_loss = (returns_batch - value_batch).pow(2).mean()
-
-            # Discriminator loss.
-            policy_state, policy_next_state = sample_amp_policy
-            expert_state, expert_next_state = sample_amp_expert
-
-            policy_state_unnorm = torch.clone(policy_state)
-            expert_state_unnorm = torch.clone(expert_state)
-
-            if self.amp_normalizer is not None:
-                with torch.no_grad():
-                    policy_state = self.amp_normalizer.normalize_torch(policy_state, self.device)
-                    policy_next_state = self.amp_normalizer.normalize_torch(policy_next_state, self.device)
-                    expert_state = self.amp_normalizer.normalize_torch(expert_state, self.device)
-                    expert_next_state = self.amp_normalizer.normalize_torch(expert_next_state, self.device)
-            policy_d = self.discriminator(torch.cat([policy_state, policy_next_state], dim=-1))
-            expert_d = self.discriminator(torch.cat([expert_state, expert_next_state], dim=-1))
-            expert_loss = torch.nn.MSELoss()(expert_d, torch.ones(expert_d.size(), device=self.device))
-            policy_loss = torch.nn.MSELoss()(policy_d, -1 * torch.ones(policy_d.size(), device=self.device))
-            amp_loss = 0.5 * (expert_loss + policy_loss)
-            grad_pen_loss = self.discriminator.compute_grad_pen(expert_state, expert_next_state, lambda_=10)
-
-            # Compute total loss.
-            loss = (
-                surrogate_loss
-                + self.value_loss_coef * value_loss
-                - self.entropy_coef * entropy_batch.mean()
-                + amp_loss
-                + grad_pen_loss
+        if self.amp_discr_schedule == "coupled":
+            amp_policy_generator, amp_expert_generator = self.amp_generators(
+                self.num_learning_epochs * self.num_mini_batches,
+                self.storage.num_envs * self.storage.num_transitions_per_env // self.num_mini_batches,
             )
-
-            # Symmetry loss
-            if self.symmetry:
-                # obtain the symmetric actions
-                # if we did augmentation before then we don't need to augment again
-                if not self.symmetry["use_data_augmentation"]:
+        else:
+            # The discriminator is updated after the PPO epochs, by update_discriminator.
+            amp_policy_generator = amp_expert_generator = itertools.repeat(None)
+
+        # iterate over batches, closing the prefetch workers of the AMP generators even if an update fails
+        try:
+            for (
+                (
+                    obs_batch,
+                    critic_obs_batch,
+                    actions_batch,
+                    target_values_batch,
+                    advantages_batch,
+                    returns_batch,
+                    old_actions_log_prob_batch,
+                    old_mu_batch,
+                    old_sigma_batch,
+                    hid_states_batch,
+                    masks_batch,
+                    rnd_state_batch,
+                ),
+                sample_amp_policy,
+                sample_amp_expert,
+            ) in zip(generator, amp_policy_generator, amp_expert_generator):
+                # number of augmentations per sample
+                # we start with 1 and increase it if we use symmetry augmentation
+                num_aug = 1
+                # original batch size
+                original_batch_size = obs_batch.shape[0]
+
+                # Perform symmetric augmentation
+                if self.symmetry and self.symmetry["use_data_augmentation"]:
+                    # augmentation using symmetry
                     data_augmentation_func = self.symmetry["data_augmentation_func"]
-                    obs_batch, _ = data_augmentation_func(
-                        obs=obs_batch, actions=None, env=self.symmetry["_env"], is_critic=False
+                    # returned shape: [batch_size * num_aug, ...]
+                    obs_batch, actions_batch = data_augmentation_func(
+                        obs=obs_batch, actions=actions_batch, env=self.symmetry["_env"], is_critic=False
+                    )
+                    critic_obs_batch, _ = data_augmentation_func(
+                        obs=critic_obs_batch, actions=None, env=self.symmetry["_env"], is_critic=True
                     )
                     # compute number of augmentations per sample
                     num_aug = int(obs_batch.shape[0] / original_batch_size)
-
-                # actions predicted by the actor for symmetrically-augmented observations
-                mean_actions_batch = self.actor_critic.act_inference(obs_batch.detach().clone())
-
-                # compute the symmetrically augmented actions
-                # note: we are assuming the first augmentation is the original one.
-                #   We do not use the action_batch from earlier since that action was sampled from the distribution.
-                #   However, the symmetry loss is computed using the mean of the distribution.
-                action_mean_orig = mean_actions_batch[:original_batch_size]
-                _, actions_mean_symm_batch = data_augmentation_func(
-                    obs=None, actions=action_mean_orig, env=self.symmetry["_env"], is_critic=False
+                    # repeat the rest of the batch
+                    # -- actor
+                    old_actions_log_prob_batch = old_actions_log_prob_batch.repeat(num_aug, 1)
+                    # -- critic
+                    target_values_batch = target_values_batch.repeat(num_aug, 1)
+                    advantages_batch = advantages_batch.repeat(num_aug, 1)
+                    returns_batch = returns_batch.repeat(num_aug, 1)
+
+                # Recompute actions log prob and entropy for current batch of transitions
+                # Note: we need to do this because we updated the actor_critic with the new parameters
+                # -- actor
+                self.actor_critic.act(obs_batch, masks=masks_batch, hidden_states=hid_states_batch[0])
+                actions_log_prob_batch = self.actor_critic.get_actions_log_prob(actions_batch)
+                # -- critic
+                value_batch = self.actor_critic.evaluate(
+                    critic_obs_batch, masks=masks_batch, hidden_states=hid_states_batch[1]
                 )
-
-                # compute the loss (we skip the first augmentation as it is the original one)
-                mse_loss = torch.nn.MSELoss()
-                symmetry_loss = mse_loss(
-                    mean_actions_batch[original_batch_size:], actions_mean_symm_batch.detach()[original_batch_size:]
+                # -- entropy
+                # we only keep the entropy of the first augmentation (the original one)
+                mu_batch = self.actor_critic.action_mean[:original_batch_size]
+                sigma_batch = self.actor_critic.action_std[:original_batch_size]
+                entropy_batch = self.actor_critic.entropy[:original_batch_size]
+
+                # KL
+                if self.desired_kl is not None and self.schedule == "adaptive":
+                    with torch.inference_mode():
+                        kl = torch.sum(
+                            torch.log(sigma_batch / old_sigma_batch + 1.0e-5)
+                            + (torch.square(old_sigma_batch) + torch.square(old_mu_batch - mu_batch))
+                            / (2.0 * torch.square(sigma_batch))
+                            - 0.5,
+                            axis=-1,
+                        )
+                        kl_mean = torch.mean(kl)
+
+                        if kl_mean > self.desired_kl * 2.0:
+                            self.learning_rate = max(1e-5, self.learning_rate / 1.5)
+                        elif kl_mean < self.desired_kl / 2.0 and kl_mean > 0.0:
+                            self.learning_rate = min(1e-2, self.learning_rate * 1.5)
+
+                        for param_group in self.optimizer.param_groups:
+                            param_group["lr"] = self.learning_rate
+
+                # Surrogate loss
+                ratio = torch.exp(actions_log_prob_batch - torch.squeeze(old_actions_log_prob_batch))
+                surrogate = -torch.squeeze(advantages_batch) * ratio
+                surrogate_clipped = -torch.squeeze(advantages_batch) * torch.clamp(
+                    ratio, 1.0 - self.clip_param, 1.0 + self.clip_param
                 )
-                # add the loss to the total loss
-                if self.symmetry["use_mirror_loss"]:
-                    loss += self.symmetry["mirror_loss_coeff"] * symmetry_loss
+                surrogate_loss = torch.max(surrogate, surrogate_clipped).mean()
+
+                # Value function loss
+                if self.use_clipped_value_loss:
+                    value_clipped = target_values_batch + (value_batch - target_values_batch).clamp(
+                        -self.clip_param, self.clip_param
+                    )
+                    value_losses = (value_batch - returns_batch).pow(2)
+                    value_losses_clipped = (value_clipped - returns_batch).pow(2)
+                    value_loss = torch.max(value_losses, value_losses_clipped).mean()
                 else:
-                    symmetry_loss = symmetry_loss.detach()
-
-            # Random Network Distillation loss
-            if self.rnd:
-                # predict the embedding and the target
-                predicted_embedding = self.rnd.predictor(rnd_state_batch)
-                target_embedding = self.rnd.target(rnd_state_batch)
-                # compute the loss as the mean squared error
-                mseloss = torch.nn.MSELoss()
-                rnd_loss = mseloss(predicted_embedding, target_embedding.detach())
-
-            # Gradient step
-            # -- For PPO
-            self.optimizer.zero_grad()
-            loss.backward()
-            nn.utils.clip_grad_norm_(self.actor_critic.parameters(), self.max_grad_norm)
-            self.optimizer.step()
-            # -- For RND
-            if self.rnd_optimizer:
-                self.rnd_optimizer.zero_grad()
-                rnd_loss.backward()
-                self.rnd_optimizer.step()
-
-            self.actor_critic.std.data = self.actor_critic.std.data.clamp(min=self.min_std)
-            if self.amp_normalizer is not None:
-                self.amp_normalizer.update(policy_state_unnorm.cpu().numpy())
-                self.amp_normalizer.update(expert_state_unnorm.cpu().numpy())
-
-            # Store the losses
-            mean_value_loss += value_loss.item()
-            mean_surrogate_loss += surrogate_loss.item()
-            mean_entropy += entropy_batch.mean().item()
-            # -- RND loss
-            if mean_rnd_loss is not None:
-                mean_rnd_loss += rnd_loss.item()
-            # -- Symmetry loss
-            if mean_symmetry_loss is not None:
-                mean_symmetry_loss += symmetry_loss.item()
-            mean_amp_loss += amp_loss.item()
-            mean_grad_pen_loss += grad_pen_loss.item()
-            mean_policy_pred += policy_d.mean().item()
-            mean_expert_pred += expert_d.mean().item()
+                    value_loss = (returns_batch - value_batch).pow(2).mean()
+
+                # Discriminator loss.
+                if self.amp_discr_schedule == "coupled":
+                    amp_loss, grad_pen_loss, policy_d, expert_d, policy_state_unnorm, expert_state_unnorm = (
+                        self.compute_discriminator_loss(sample_amp_policy, sample_amp_expert)
+                    )
+
+                # Compute total loss.
+                loss = surrogate_loss + self.value_loss_coef * value_loss - self.entropy_coef * entropy_batch.mean()
+                if self.amp_discr_schedule == "coupled":
+                    loss = loss + amp_loss + grad_pen_loss
+
+                # Symmetry loss
+                if self.symmetry:
+                    # obtain the symmetric actions
+                    # if we did augmentation before then we don't need to augment again
+                    if not self.symmetry["use_data_augmentation"]:
+                        data_augmentation_func = self.symmetry["data_augmentation_func"]
+                        obs_batch, _ = data_augmentation_func(
+                            obs=obs_batch, actions=None, env=self.symmetry["_env"], is_critic=False
+                        )
+                        # compute number of augmentations per sample
+                        num_aug = int(obs_batch.shape[0] / original_batch_size)
+
+                    # actions predicted by the actor for symmetrically-augmented observations
+                    mean_actions_batch = self.actor_critic.act_inference(obs_batch.detach().clone())
+
+                    # compute the symmetrically augmented actions
+                    # note: we are assuming the first augmentation is the original one.
+                    #   We do not use the action_batch from earlier since that action was sampled from the distribution.
+                    #   However, the symmetry loss is computed using the mean of the distribution.
+                    action_mean_orig = mean_actions_batch[:original_batch_size]
+                    _, actions_mean_symm_batch = data_augmentation_func(
+                        obs=None, actions=action_mean_orig, env=self.symmetry["_env"], is_critic=False
+                    )
+
+                    # compute the loss (we skip the first augmentation as it is the original one)
+                    mse_loss = torch.nn.MSELoss()
+                    symmetry_loss = mse_loss(
+                        mean_actions_batch[original_batch_size:], actions_mean_symm_batch.detach()[original_batch_size:]
+                    )
+                    # add the loss to the total loss
+                    if self.symmetry["use_mirror_loss"]:
+                        loss += self.symmetry["mirror_loss_coeff"] * symmetry_loss
+                    else:
+                        symmetry_loss = symmetry_loss.detach()
+
+                # Random Network Distillation loss
+                if self.rnd:
+                    # predict the embedding and the target
+                    predicted_embedding = self.rnd.predictor(rnd_state_batch)
+                    target_embedding = self.rnd.target(rnd_state_batch)
+                    # compute the loss as the mean squared error
+                    mseloss = torch.nn.MSELoss()
+                    rnd_loss = mseloss(predicted_embedding, target_embedding.detach())
+
+                # Gradient step
+                # -- For PPO
+                self.optimizer.zero_grad()
+                loss.backward()
+                nn.utils.clip_grad_norm_(self.actor_critic.parameters(), self.max_grad_norm)
+                self.optimizer.step()
+                # -- For RND
+                if self.rnd_optimizer:
+                    self.rnd_optimizer.zero_grad()
+                    rnd_loss.backward()
+                    self.rnd_optimizer.step()
+
+                self.actor_critic.std.data = self.actor_critic.std.data.clamp(min=self.min_std)
+                if self.amp_discr_schedule == "coupled":
+                    self.update_amp_normalizer(policy_state_unnorm, expert_state_unnorm)
+
+                # Store the losses
+                mean_value_loss += value_loss.item()
+                mean_surrogate_loss += surrogate_loss.item()
+                mean_entropy += entropy_batch.mean().item()
+                # -- RND loss
+                if mean_rnd_loss is not None:
+                    mean_rnd_loss += rnd_loss.item()
+                # -- Symmetry loss
+                if mean_symmetry_loss is not None:
+                    mean_symmetry_loss += symmetry_loss.item()
+                if self.amp_discr_schedule == "coupled":
+                    mean_amp_loss += amp_loss.item()
+                    mean_grad_pen_loss += grad_pen_loss.item()
+                    mean_policy_pred += policy_d.mean().item()
+                    mean_expert_pred += expert_d.mean().item()
+        finally:
+            if self.amp_discr_schedule == "coupled":
+                self.close_amp_generators(amp_policy_generator, amp_expert_generator)
 
         # -- For PPO
         num_updates = self.num_learning_epochs * self.num_mini_batches
@@ -469,10 +632,15 @@ class AMPPPO:
         # -- For Symmetry
         if mean_symmetry_loss is not None:
             mean_symmetry_loss /= num_updates
-        mean_amp_loss /= num_updates
-        mean_grad_pen_loss /= num_updates
-        mean_policy_pred /= num_updates
-        mean_expert_pred /= num_updates
+        # -- For the discriminator, whose losses are kept from its last update on the updates it skips
+        if self.amp_discr_schedule == "coupled":
+            self.amp_discr_stats = tuple(
+                value / num_updates for value in (mean_amp_loss, mean_grad_pen_loss, mean_policy_pred, mean_expert_pred)
+            )
+        elif self.update_count % self.amp_discr_update_interval == 0:
+            self.amp_discr_stats = self.update_discriminator()
+        self.update_count += 1
+        mean_amp_loss, mean_grad_pen_loss, mean_policy_pred, mean_expert_pred = self.amp_discr_stats
         # -- Clear the storage
         self.storage.clear()
 
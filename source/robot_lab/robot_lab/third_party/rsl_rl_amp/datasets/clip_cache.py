@@ -0,0 +1,57 @@
+"""Byte-budgeted LRU cache of motion clips that are paged in on demand."""
+
+from collections import OrderedDict
+
+
+class ClipCache:
+    """Keeps the most recently used clips in memory, up to a budget in bytes.
+
+    Clips are loaded with ``load_clip(clip_idx)``, which returns a tensor. A clip larger than the whole budget is
+    returned without being cached.
+    """
+
+    def __init__(self, load_clip, num_clips, max_bytes):
+        self.load_clip = load_clip
+        self.num_clips = num_clips
+        self.max_bytes = max_bytes
+        self.clips = OrderedDict()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return self.num_clips
+
+    def __getitem__(self, clip_idx):
+        clip = self.clips.get(clip_idx)
+        if clip is not None:
+            self.hits += 1
+            self.clips.move_to_end(clip_idx)
+            return clip
+
+        self.misses += 1
+        clip = self.load_clip(clip_idx)
+        clip_bytes = clip.numel() * clip.element_size()
+        if clip_bytes > self.max_bytes:
+            return clip
+        while self.cached_bytes + clip_bytes > self.max_bytes:
+            _, evicted = self.clips.popitem(last=False)
+            self.cached_bytes -= evicted.numel() * evicted.element_size()
+            self.evictions += 1
+        self.clips[clip_idx] = clip
+        self.cached_bytes += clip_bytes
+        return clip
+
+    @property
+    def stats(self):
+        """Dict with the number of hits, misses and evictions, the hit rate and the cached clips and bytes."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "cached_clips": len(self.clips),
+            "cached_bytes": self.cached_bytes,
+        }
@@ -0,0 +1,213 @@
+"""Exact nearest-frame search over motion frames."""
+
+import math
+import numpy as np
+import torch
+
+# Upper bound on the number of frame coordinates gathered at once when scanning leaves.
+_MAX_SCAN_ELEMENTS = 2**26
+# Upper bound on the number of (query, frame) distances computed at once by the brute-force search.
+_MAX_BRUTE_FORCE_ELEMENTS = 2**24
+
+
+class NearestFrameIndex:
+    """KD-tree over motion frames that answers batched nearest-neighbor queries.
+
+    Frames are rotated onto their principal axes, which preserves distances. The tree is built on the CPU as a
+    complete binary tree of median splits along the axis of largest spread, with leaves of at most ``leaf_size``
+    frames. Queries run on the index device, for the whole batch at once:
+
+    1. Each query descends to its home leaf, whose nearest frame bounds the search radius.
+    2. The tree is walked level by level, keeping the (query, node) pairs whose bounding box is within the radius.
+    3. The remaining leaves of each query are scanned closest box first, shrinking the radius as closer frames are
+       found.
+
+    Boxes only span the ``bound_dims`` leading principal axes, which keeps them cheap and still a lower bound, as
+    motion frames vary mostly along a few axes. Results are exact up to float32 rounding of near ties.
+
+    The tree only pays off on large libraries whose frames it can prune. Up to ``brute_force_max_frames`` frames, and
+    whenever the walk keeps more than ``max_candidate_fraction`` of all (query, frame) pairs, queries are answered by a
+    chunked brute-force search, a matrix product against all frames.
+    """
+
+    def __init__(
+        self,
+        frames,
+        leaf_size=32,
+        bound_dims=8,
+        leaves_per_visit=4,
+        brute_force_max_frames=16384,
+        max_candidate_fraction=0.05,
+        device=None,
+    ):
+        """
+        frames: Frames to index, with shape (num_frames, dim). Distances are Euclidean, so features should be
+            scaled consistently, e.g. by an AMP normalizer.
+        leaf_size: Maximum number of frames per leaf.
+        bound_dims: Number of principal axes spanned by the bounding boxes of the nodes.
+        leaves_per_visit: Number of leaves scanned per query between two updates of its search radius.
+        brute_force_max_frames: Number of frames up to which queries always use the brute-force search.
+        max_candidate_fraction: Fraction of the (query, frame) pairs above which a tree walk is abandoned for the
+            brute-force search.
+        device: Device of the queries. Defaults to the device of the frames.
+        """
+        self.device = frames.device if device is None else device
+        points = frames.detach().double().cpu().numpy()
+        self.num_frames, self.dim = points.shape
+        mean = points.mean(axis=0)
+        _, _, basis = np.linalg.svd(points - mean, full_matrices=False)
+        # Complete the basis to a rotation when there are fewer frames than dimensions.
+        basis = np.linalg.qr(np.concatenate([basis, np.eye(self.dim)]).T)[0].T
+        points = (points - mean) @ basis.T
+        self.mean = torch.tensor(mean, dtype=torch.float32, device=self.device)
+        self.basis = torch.tensor(basis, dtype=torch.float32, device=self.device)
+        self.bound_dims = min(bound_dims, self.dim)
+        self.leaves_per_visit = leaves_per_visit
+        self.brute_force_max_frames = brute_force_max_frames
+        self.max_candidate_fraction = max_candidate_fraction
+
+        # Nodes are stored level by level: the children of node n are 2n + 1 and 2n + 2.
+        self.depth = max(0, math.ceil(math.log2(self.num_frames / leaf_size)))
+        num_nodes = 2 ** (self.depth + 1) - 1
+        split_dims = np.zeros(num_nodes, dtype=np.int64)
+        split_values = np.zeros(num_nodes)
+        lower = np.zeros((num_nodes, self.bound_dims))
+        upper = np.zeros((num_nodes, self.bound_dims))
+        nodes = [np.arange(self.num_frames)]
+        for level in range(self.depth + 1):
+            first_node = 2**level - 1
+            for node, idxs in enumerate(nodes, start=first_node):
+                lower[node] = points[idxs, : self.bound_dims].min(axis=0)
+                upper[node] = points[idxs, : self.bound_dims].max(axis=0)
+            if level == self.depth:
+                break
+            children = []
+            for node, idxs in enumerate(nodes, start=first_node):
+                values = points[idxs]
+                split_dims[node] = np.argmax(values.max(axis=0) - values.min(axis=0))
+                half = len(idxs) // 2
+                order = np.argpartition(values[:, split_dims[node]], half)
+                split_values[node] = values[order[half], split_dims[node]]
+                children += [idxs[order[:half]], idxs[order[half:]]]
+            nodes = children
+
+        self.split_dims = torch.tensor(split_dims, device=self.device)
+        self.split_values = torch.tensor(split_values, dtype=torch.float32, device=self.device)
+        self.node_lower = torch.tensor(lower, dtype=torch.float32, device=self.device)
+        self.node_upper = torch.tensor(upper, dtype=torch.float32, device=self.device)
+        # Leaves are padded to the same size with slots that repeat the last frame at an infinite norm.
+        leaf_frame_idxs = np.full((len(nodes), max(len(idxs) for idxs in nodes)), -1, dtype=np.int64)
+        for leaf, idxs in enumerate(nodes):
+            leaf_frame_idxs[leaf, : len(idxs)] = idxs
+        self.leaf_frame_idxs = torch.tensor(leaf_frame_idxs, device=self.device)
+        self.frames = torch.tensor(points, dtype=torch.float32, device=self.device)
+        # Frames with their halved negated squared norm appended, so that the brute-force search scores the queries,
+        # with a one appended, with a single matrix product: x.q - |x|^2 / 2 is largest for the nearest frame.
+        self.scoring_frames = torch.cat([self.frames, -0.5 * self.frames.square().sum(dim=-1, keepdim=True)], dim=1)
+        self.leaf_frames = self.frames[self.leaf_frame_idxs]
+        self.leaf_frame_norms = torch.where(self.leaf_frame_idxs >= 0, self.leaf_frames.square().sum(dim=-1), torch.inf)
+
+    def __len__(self):
+        return self.num_frames
+
+    @property
+    def num_leaves(self):
+        return len(self.leaf_frame_idxs)
+
+    def query(self, states):
+        """Returns the distance to and the index of the nearest frame of each state.
+
+        Args:
+            states: Query states, with shape (N, dim).
+
+        Returns:
+            A tuple (distances, frame_idxs) of tensors with shape (N,).
+        """
+        states = (states.to(self.device, torch.float32) - self.mean) @ self.basis.T
+        if self.num_frames <= self.brute_force_max_frames:
+            return self._brute_force(states)
+        query_idxs = torch.arange(len(states), device=self.device)
+        max_candidates = self.max_candidate_fraction * len(states) * self.num_frames
+        first_leaf = 2**self.depth - 1
+
+        # The nearest frame of the home leaf bounds the search radius.
+        nodes = torch.zeros(len(states), dtype=torch.long, device=self.device)
+        for _ in range(self.depth):
+            go_right = states[query_idxs, self.split_dims[nodes]] >= self.split_values[nodes]
+            nodes = 2 * nodes + 1 + go_right
+        home_leaves = nodes - first_leaf
+        best_distances, best_frame_idxs = self._scan_leaves(states, query_idxs, home_leaves)
+
+        # Walk down the tree, keeping the nodes whose box may hold a closer frame.
+        pair_query_idxs, pair_nodes = query_idxs, torch.zeros_like(query_idxs)
+        pair_bounds = torch.zeros_like(best_distances)
+        for _ in range(self.depth):
+            pair_query_idxs = pair_query_idxs.repeat_interleave(2)
+            pair_nodes = (2 * pair_nodes.unsqueeze(-1) + torch.tensor([1, 2], device=self.device)).flatten()
+            pair_states = states[pair_query_idxs, : self.bound_dims]
+            closest = torch.maximum(
+                torch.minimum(pair_states, self.node_upper[pair_nodes]), self.node_lower[pair_nodes]
+            )
+            pair_bounds = (pair_states - closest).square().sum(dim=-1)
+            keep = pair_bounds < best_distances[pair_query_idxs]
+            pair_query_idxs, pair_nodes, pair_bounds = pair_query_idxs[keep], pair_nodes[keep], pair_bounds[keep]
+            if len(pair_query_idxs) * self.leaf_frame_idxs.shape[1] > max_candidates:
+                # The boxes do not prune enough frames for the walk and scans to beat a brute-force search.
+                return self._brute_force(states)
+        keep = pair_nodes - first_leaf != home_leaves[pair_query_idxs]
+        pair_query_idxs, pair_leaves, pair_bounds = (
+            pair_query_idxs[keep],
+            pair_nodes[keep] - first_leaf,
+            pair_bounds[keep],
+        )
+
+        # Scan the remaining leaves of each query in order of their bounds, a few at a time, so that the radius
+        # shrinks before the farther leaves are reached.
+        order = pair_bounds.argsort()
+        order = order[pair_query_idxs[order].argsort(stable=True)]
+        pair_query_idxs, pair_leaves, pair_bounds = pair_query_idxs[order], pair_leaves[order], pair_bounds[order]
+        pair_ranks = torch.arange(len(order), device=self.device) - torch.searchsorted(pair_query_idxs, pair_query_idxs)
+        for rank in range(0, int(pair_ranks.max()) + 1 if len(order) > 0 else 0, self.leaves_per_visit):
+            visit = (pair_ranks >= rank) & (pair_ranks < rank + self.leaves_per_visit)
+            visit &= pair_bounds < best_distances[pair_query_idxs]
+            if not visit.any():
+                break
+            visit_query_idxs = pair_query_idxs[visit]
+            distances, frame_idxs = self._scan_leaves(states, visit_query_idxs, pair_leaves[visit])
+            nearest_distances = best_distances.scatter_reduce(0, visit_query_idxs, distances, reduce="amin")
+            closer = distances < best_distances[visit_query_idxs]
+            closer &= distances == nearest_distances[visit_query_idxs]
+            best_frame_idxs[visit_query_idxs[closer]] = frame_idxs[closer]
+            best_distances = nearest_distances
+        # The expanded distances lose precision to cancellation, the reported ones are computed directly.
+        return (self.frames[best_frame_idxs] - states).norm(dim=-1), best_frame_idxs
+
+    def _brute_force(self, states):
+        """Returns the distance to and the index of the nearest frame of each rotated state, by comparing it with
+        all frames, a chunk of queries at a time."""
+        chunk_size = max(1, _MAX_BRUTE_FORCE_ELEMENTS // self.num_frames)
+        frame_idxs = []
+        for chunk_states in states.split(chunk_size):
+            scores = torch.cat([chunk_states, torch.ones_like(chunk_states[:, :1])], dim=1) @ self.scoring_frames.T
+            frame_idxs.append(scores.max(dim=-1).indices)
+        frame_idxs = torch.cat(frame_idxs) if frame_idxs else states.new_zeros(0, dtype=torch.long)
+        return (self.frames[frame_idxs] - states).norm(dim=-1), frame_idxs
+
+    def _scan_leaves(self, states, query_idxs, leaves):
+        """Returns the squared distance to and the index of the nearest frame of each (query, leaf) pair.
+
+        Distances are expanded as |x|^2 - 2 x.q + |q|^2, so that scanning a leaf is a batched matrix product.
+        """
+        chunk_size = max(1, _MAX_SCAN_ELEMENTS // (self.leaf_frames.shape[1] * self.dim))
+        distances, frame_idxs = [], []
+        for chunk_query_idxs, chunk_leaves in zip(query_idxs.split(chunk_size), leaves.split(chunk_size)):
+            chunk_states = states[chunk_query_idxs]
+            chunk_distances, slots = (
+                self.leaf_frame_norms[chunk_leaves]
+                - 2.0 * torch.bmm(self.leaf_frames[chunk_leaves], chunk_states.unsqueeze(-1)).squeeze(-1)
+            ).min(dim=-1)
+            distances.append(chunk_distances + chunk_states.square().sum(dim=-1))
+            frame_idxs.append(self.leaf_frame_idxs[chunk_leaves, slots])
+        if not distances:
+            return states.new_zeros(0), query_idxs.new_zeros(0)
+        return torch.cat(distances), torch.cat(frame_idxs)
@@ -0,0 +1,74 @@
+"""Declarative column layout of motion frames."""
+
+import numpy as np
+
+
+class FrameSchema:
+    """Named feature groups of a motion frame, each a contiguous block of columns, in column order.
+
+    A schema describes the layout of the motion files of a robot, e.g. :attr:`AMPLoader.FRAME_SCHEMA` for the A1.
+    :meth:`select` returns the schema of the frames a loader stores, which keep only the requested groups,
+    contiguous and in the original order, and remember the source columns they are read from.
+    """
+
+    def __init__(self, groups, source_columns=None):
+        """
+        groups: Sequence of (name, size) pairs in column order.
+        source_columns: Columns of the source frames that the columns of the schema are read from. Defaults to the
+            leading columns.
+        """
+        self.groups = tuple((name, int(size)) for name, size in groups)
+        self.group_names = tuple(name for name, _ in self.groups)
+        if len(set(self.group_names)) != len(self.group_names):
+            raise ValueError(f"Duplicate feature groups in {self.group_names}.")
+        self.slices = {}
+        start = 0
+        for name, size in self.groups:
+            self.slices[name] = slice(start, start + size)
+            start += size
+        self.frame_dim = start
+        self.source_columns = np.arange(self.frame_dim) if source_columns is None else np.asarray(source_columns)
+        if len(self.source_columns) != self.frame_dim:
+            raise ValueError(f"Expected {self.frame_dim} source columns, got {len(self.source_columns)}.")
+
+    def __contains__(self, name):
+        return name in self.slices
+
+    def __repr__(self):
+        return f"FrameSchema({list(self.groups)})"
+
+    def size(self, name):
+        """Returns the number of columns of a feature group."""
+        return self.slice(name).stop - self.slice(name).start
+
+    def slice(self, name):
+        """Returns the columns of a feature group as a slice."""
+        if name not in self.slices:
+            raise ValueError(f"Feature group {name} is not in {self.group_names}.")
+        return self.slices[name]
+
+    def span(self, first, last):
+        """Returns the columns from the start of group ``first`` to the end of group ``last`` as a slice."""
+        return slice(self.slice(first).start, self.slice(last).stop)
+
+    def columns(self, names):
+        """Returns the columns of the given feature groups, in the given order."""
+        return np.concatenate([np.arange(self.frame_dim)[self.slice(name)] for name in names]).astype(np.int64)
+
+    def select(self, names=None):
+        """Returns the schema of the given feature groups, in the order of this schema. Keeps all groups if None."""
+        names = self.group_names if names is None else tuple(names)
+        for name in names:
+            self.slice(name)
+        groups = [(name, size) for name, size in self.groups if name in names]
+        columns = self.columns([name for name, _ in groups])
+        return FrameSchema(groups, self.source_columns[columns])
+
+    def source_positions(self, source_columns):
+        """Returns the columns of this schema that hold the given source columns."""
+        positions = np.full(int(max(self.source_columns.max(), np.max(source_columns))) + 1, -1, dtype=np.int64)
+        positions[self.source_columns] = np.arange(self.frame_dim)
+        positions = positions[np.asarray(source_columns)]
+        if (positions < 0).any():
+            raise ValueError("Some source columns are not part of the schema.")
+        return positions
@@ -0,0 +1,81 @@
+"""On-disk cache of parsed AMP motion files.
+
+Each motion file is keyed by a hash of its content. The normalized frames are stored as a ``.npy`` array that
+can be memory-mapped on load, next to a small JSON file with the clip metadata.
+"""
+
+import hashlib
+import json
+import numpy as np
+import os
+
+# Bump when the cached frame layout or the ingest normalization changes.
+CACHE_VERSION = 1
+
+
+def content_key(raw_bytes):
+    """Returns the cache key of a motion file.
+
+    Args:
+      raw_bytes: Content of the motion file.
+
+    Returns:
+      A hex digest identifying the content and the cache version.
+    """
+    digest = hashlib.sha256(raw_bytes)
+    digest.update(f"v{CACHE_VERSION}".encode())
+    return digest.hexdigest()
+
+
+def _paths(cache_dir, key):
+    return os.path.join(cache_dir, f"{key}.npy"), os.path.join(cache_dir, f"{key}.json")
+
+
+def load(cache_dir, key):
+    """Loads a cached motion clip.
+
+    Args:
+      cache_dir: Directory holding the cache.
+      key: Cache key returned by :func:`content_key`.
+
+    Returns:
+      A tuple (frames, metadata) with the frames memory-mapped read-only, or None on a cache miss.
+    """
+    frames_path, meta_path = _paths(cache_dir, key)
+    if not (os.path.isfile(meta_path) and os.path.isfile(frames_path)):
+        return None
+    with open(meta_path) as f:
+        metadata = json.load(f)
+    frames = np.load(frames_path, mmap_mode="r")
+    if frames.shape[0] != metadata["num_frames"]:
+        return None
+    return frames, metadata
+
+
+def save(cache_dir, key, frames, weight, frame_duration):
+    """Stores a normalized motion clip in the cache.
+
+    Files are written under a temporary name and renamed, so concurrent readers never see partial entries.
+
+    Args:
+      cache_dir: Directory holding the cache.
+      key: Cache key returned by :func:`content_key`.
+      frames: Normalized frames of the clip, shape (num_frames, frame_dim).
+      weight: Sampling weight of the clip.
+      frame_duration: Time in seconds between two frames.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    frames_path, meta_path = _paths(cache_dir, key)
+    metadata = {
+        "weight": float(weight),
+        "frame_duration": float(frame_duration),
+        "num_frames": int(frames.shape[0]),
+        "traj_len": (frames.shape[0] - 1) * float(frame_duration),
+    }
+    tmp_suffix = f".{os.getpid()}.tmp"
+    with open(frames_path + tmp_suffix, "wb") as f:
+        np.save(f, np.ascontiguousarray(frames, dtype=np.float32))
+    os.replace(frames_path + tmp_suffix, frames_path)
+    with open(meta_path + tmp_suffix, "w") as f:
+        json.dump(metadata, f)
+    os.replace(meta_path + tmp_suffix, meta_path)
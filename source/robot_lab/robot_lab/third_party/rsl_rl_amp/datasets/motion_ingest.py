@@ -0,0 +1,121 @@
+"""Parsing and normalization of JSON motion files, shared by AMPLoader, its ingest worker processes and offline tools.
+
+The module only imports the standard library and NumPy. Ingest workers and tools import it as the top-level module
+``motion_ingest`` from this directory, see :func:`standalone_module`, because importing the robot_lab package
+registers the tasks and UI extensions, which needs the running simulator.
+"""
+
+import contextlib
+import importlib.util
+import json
+import numpy as np
+import os
+import sys
+import time
+from collections import defaultdict
+from multiprocessing import resource_tracker, shared_memory
+
+# Columns of the xyzw root quaternion in a motion frame, see AMPLoader.ROOT_ROT_START_IDX.
+ROOT_ROT_START_IDX = 3
+ROOT_ROT_END_IDX = 7
+
+# Name of the module when imported by standalone_module.
+STANDALONE_NAME = "motion_ingest"
+
+
+@contextlib.contextmanager
+def timed_stage(timings, stage):
+    """Adds the wall time spent in the context to ``timings[stage]``."""
+    start = time.perf_counter()
+    yield
+    timings[stage] += time.perf_counter() - start
+
+
+def parse_motion_file(raw_motion):
+    """Returns the raw frames, weight and frame duration of the content of a JSON motion file."""
+    motion_json = json.loads(raw_motion)
+    motion_data = np.array(motion_json["Frames"])
+    return motion_data, float(motion_json["MotionWeight"]), float(motion_json["FrameDuration"])
+
+
+def normalize_motion_data(motion_data):
+    """Normalizes and standardizes the root quaternions of all frames of a clip at once, to unit length and w >= 0.
+
+    Raises:
+      ValueError: If any root quaternion has length near zero.
+    """
+    root_rot = motion_data[:, ROOT_ROT_START_IDX:ROOT_ROT_END_IDX]
+    root_rot_norm = np.linalg.norm(root_rot, axis=-1, keepdims=True)
+    if np.any(np.isclose(root_rot_norm, 0.0)):
+        raise ValueError("Root quaternions of motion frames may not be zero.")
+    root_rot = root_rot / root_rot_norm
+    motion_data[:, ROOT_ROT_START_IDX:ROOT_ROT_END_IDX] = np.where(root_rot[:, -1:] < 0, -root_rot, root_rot)
+    return motion_data
+
+
+def load_motion_file(motion_file, timings=None):
+    """Returns the normalized frames, weight and frame duration of a motion file, without the motion cache.
+
+    Time spent in each stage is added to ``timings`` if given.
+    """
+    timings = defaultdict(float) if timings is None else timings
+    with timed_stage(timings, "read"):
+        with open(motion_file, "rb") as f:
+            raw_motion = f.read()
+    with timed_stage(timings, "parse"):
+        motion_data, motion_weight, frame_duration = parse_motion_file(raw_motion)
+    with timed_stage(timings, "normalize"):
+        motion_data = normalize_motion_data(motion_data)
+    return motion_data, motion_weight, frame_duration
+
+
+def write_npz_shard(path, motion_files):
+    """Packs JSON motion files into an npz shard, see motion_stream.
+
+    The shard holds the normalized frames of all clips concatenated in ``frames``, along with the per-clip
+    ``num_frames``, ``weights``, ``frame_durations`` and ``names``. Legs keep the order of the motion files.
+    """
+    clips = [load_motion_file(motion_file) for motion_file in motion_files]
+    np.savez(
+        path,
+        frames=np.concatenate([motion_data for motion_data, _, _ in clips]).astype(np.float32),
+        num_frames=np.array([motion_data.shape[0] for motion_data, _, _ in clips]),
+        weights=np.array([motion_weight for _, motion_weight, _ in clips]),
+        frame_durations=np.array([frame_duration for _, _, frame_duration in clips]),
+        names=np.array([os.path.basename(motion_file).split(".")[0] for motion_file in motion_files]),
+    )
+
+
+def ingest_motion_file_to_shared_memory(motion_file):
+    """Process pool worker that loads a motion file and hands its frames back in a shared memory block.
+
+    The caller attaches to the block by name and is responsible for unlinking it.
+
+    Returns:
+        A tuple (shm_name, shape, dtype, weight, frame_duration, timings).
+    """
+    timings = defaultdict(float)
+    motion_data, motion_weight, frame_duration = load_motion_file(motion_file, timings)
+    shm = shared_memory.SharedMemory(create=True, size=max(motion_data.nbytes, 1))
+    np.ndarray(motion_data.shape, dtype=motion_data.dtype, buffer=shm.buf)[:] = motion_data
+    # Ownership moves to the caller, which registers the block again on attach and unlinks it.
+    resource_tracker.unregister(shm._name, "shared_memory")
+    shm.close()
+    return shm.name, motion_data.shape, motion_data.dtype.str, motion_weight, frame_duration, dict(timings)
+
+
+def standalone_module():
+    """Returns this module imported from its file as the top-level module ``motion_ingest``.
+
+    Functions of the returned module are pickled by that name, so processes that add this directory to sys.path,
+    e.g. with ``site.addsitedir``, can call them without importing the robot_lab package.
+    """
+    module = sys.modules.get(STANDALONE_NAME)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(STANDALONE_NAME, __file__)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[STANDALONE_NAME] = module
+        spec.loader.exec_module(module)
+    elif os.path.realpath(getattr(module, "__file__", "")) != os.path.realpath(__file__):
+        raise ImportError(f"The top-level module {STANDALONE_NAME} is already imported from another file.")
+    return module
@@ -1,10 +1,24 @@
+import contextlib
 import glob
-import json
+import multiprocessing
 import numpy as np
+import os
+import site
+import sys
 import torch
-
-from pybullet_utils import transformations
-from robot_lab.third_party.rsl_rl_amp.datasets import motion_util, pose3d
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from robot_lab.third_party.rsl_rl_amp.datasets import (
+    clip_cache,
+    frame_index,
+    frame_schema,
+    motion_cache,
+    motion_ingest,
+    shared_library,
+)
+from robot_lab.third_party.rsl_rl_amp.datasets.motion_ingest import timed_stage
 from robot_lab.third_party.rsl_rl_amp.utils import amp_utils
 
 
@@ -44,6 +58,38 @@ class AMPLoader:
     TAR_TOE_VEL_LOCAL_START_IDX = JOINT_VEL_END_IDX
     TAR_TOE_VEL_LOCAL_END_IDX = TAR_TOE_VEL_LOCAL_START_IDX + TAR_TOE_VEL_LOCAL_SIZE
 
+    # Column layout of the motion files, as named feature groups.
+    FRAME_SCHEMA = frame_schema.FrameSchema(
+        [
+            ("root_pos", POS_SIZE),
+            ("root_rot", ROT_SIZE),
+            ("joint_pos", JOINT_POS_SIZE),
+            ("foot_pos", TAR_TOE_POS_LOCAL_SIZE),
+            ("linear_vel", LINEAR_VEL_SIZE),
+            ("angular_vel", ANGULAR_VEL_SIZE),
+            ("joint_vel", JOINT_VEL_SIZE),
+            ("foot_vel", TAR_TOE_VEL_LOCAL_SIZE),
+        ]
+    )
+    # Feature groups stored when a task declares none. Foot velocities are not read by the loader.
+    DEFAULT_FEATURE_GROUPS = ("root_pos", "root_rot", "joint_pos", "foot_pos", "linear_vel", "angular_vel", "joint_vel")
+    # Feature groups read by AMP observations: every column from joint_pos to joint_vel, then the root height.
+    AMP_OBSERVATION_GROUPS = ("root_pos", "joint_pos", "foot_pos", "linear_vel", "angular_vel", "joint_vel")
+    # Feature groups read by reset states.
+    RESET_STATE_GROUPS = ("root_pos", "root_rot", "joint_pos", "linear_vel", "angular_vel", "joint_vel")
+
+    # Sizes of the reset state components: root pose (pos, wxyz quat), root velocity (world-frame linear and
+    # angular) and joint positions and velocities in Isaac Sim order.
+    RESET_STATE_SIZES = (POS_SIZE + ROT_SIZE, LINEAR_VEL_SIZE + ANGULAR_VEL_SIZE, JOINT_POS_SIZE, JOINT_VEL_SIZE)
+
+    # Per-trajectory NumPy arrays published to a shared motion library along with the packed tensors.
+    SHARED_METADATA_NAMES = (
+        "trajectory_weights",
+        "trajectory_frame_durations",
+        "trajectory_lens",
+        "trajectory_num_frames",
+    )
+
     def __init__(
         self,
         device,
@@ -52,58 +98,190 @@ class AMPLoader:
         preload_transitions=False,
         num_preload_transitions=1000000,
         motion_files=glob.glob("datasets/motion_files2/*"),
+        motion_cache_dir=None,
+        seed=None,
+        compact_preload=False,
+        storage_dtype=torch.float32,
+        reorder_from_pybullet=False,
+        num_ingest_workers=0,
+        clip_cache_bytes=None,
+        precompute_amp_observations=False,
+        shared_library_dir=None,
+        build_reset_table=False,
+        mirror_motions=None,
+        frame_schema=None,
+        feature_groups=None,
+        reset_only=False,
     ):
         """Expert dataset provides AMP observations from Dog mocap dataset.
 
         time_between_frames: Amount of time in seconds between transition.
+        motion_cache_dir: Directory of the binary motion cache. Parsed and normalized motion files are stored
+            there keyed by content hash, so later loads skip JSON parsing. Disabled if None.
+        seed: Seed of the generator used for batch sampling. Defaults to the initial seed of torch.
+        compact_preload: Store preloaded transitions as packed frame indices and blends instead of full frames,
+            and reconstruct them when sampled.
+        storage_dtype: Dtype of the stored trajectories and preloaded frames, e.g. float16 or bfloat16 (or its
+            name). Frames are upcast to float32 when gathered.
+        reorder_from_pybullet: Reorder legs of the motion files from PyBullet to IsaacGym order at ingest.
+        num_ingest_workers: Number of worker processes that parse motion files in parallel. Files are parsed on
+            the main thread if 0.
+        clip_cache_bytes: Enables lazy loading if not None. Only clip metadata is loaded up front, and frames are
+            paged in on demand from the memory-mapped motion cache into an LRU cache of this many bytes. Requires
+            motion_cache_dir.
+        precompute_amp_observations: Resample every clip once onto the time_between_frames grid and store its
+            AMP observations, so that expert transitions are sampled by gathering consecutive rows of that table
+            instead of interpolating. Takes precedence over preloaded transitions in feed_forward_generator.
+        shared_library_dir: Directory, e.g. on /dev/shm, through which processes on the same node share the motion
+            library. The first process builds and publishes the packed library and its preloaded or precomputed
+            transitions. The others, with the same motion files and options, map them copy-on-write instead of
+            building their own. The preload drawn by the publishing process is shared. Only host memory is shared: on
+            a GPU device, every process still holds its own copy of the library. The library files are removed when
+            the last process using them calls close, and shared_library.purge removes those left by crashed
+            processes. Disabled if None.
+        build_reset_table: Convert every frame of the library once into a float32 reset state in simulator
+            convention, so that reference state initialization is a gather. See get_reset_state_batch.
+        mirror_motions: Left/right mirror augmentation of the clips. "stored" appends a mirrored copy of every clip
+            to the library at ingest, with the weight of its source clip. "lazy" stores no copy and mirrors a random
+            half of every batch of AMP transitions when sampled. Disabled if None.
+        frame_schema: FrameSchema of the motion files. Defaults to the A1 layout of FRAME_SCHEMA. Other layouts must
+            start with root_pos and root_rot, and cannot be reordered from PyBullet or mirrored.
+        feature_groups: Feature groups to store, which must cover the groups read by the enabled features, see
+            AMP_OBSERVATION_GROUPS and RESET_STATE_GROUPS. Only these columns are kept, contiguous and in file order.
+            Defaults to DEFAULT_FEATURE_GROUPS.
+        reset_only: The loader only provides reset states, so feature_groups need not cover AMP observations, and
+            lazy mirroring, which only applies to AMP transitions, is rejected.
         """
         self.device = device
         self.time_between_frames = time_between_frames
+        self.motion_cache_dir = motion_cache_dir
+        self.motion_files = list(motion_files)
+        self.storage_dtype = getattr(torch, storage_dtype) if isinstance(storage_dtype, str) else storage_dtype
+        self.reorder_from_pybullet = reorder_from_pybullet
+        self.lazy_load = clip_cache_bytes is not None
+        if self.lazy_load and motion_cache_dir is None:
+            raise ValueError("Lazy clip loading requires motion_cache_dir.")
+        # Accumulated wall time in seconds of each motion ingest stage.
+        self.ingest_timings = defaultdict(float)
+        self.generator = torch.Generator(device=device)
+        self.generator.manual_seed(torch.initial_seed() if seed is None else seed)
 
+        self.preload_transitions = preload_transitions
+        self.compact_preload = compact_preload
+        self.num_preloaded_transitions = num_preload_transitions if preload_transitions else 0
+        self.precompute_amp_observations = precompute_amp_observations
+        self.build_reset_table = build_reset_table
+        if self.lazy_load and build_reset_table:
+            raise ValueError("Lazy clip loading cannot be combined with a reset table.")
+        if mirror_motions not in (None, "stored", "lazy"):
+            raise ValueError(f"Unknown mirror_motions {mirror_motions}, expected None, 'stored' or 'lazy'.")
+        if self.lazy_load and mirror_motions == "stored":
+            raise ValueError("Lazy clip loading cannot be combined with stored mirrored clips.")
+        self.mirror_motions = mirror_motions
+        self.file_schema = AMPLoader.FRAME_SCHEMA if frame_schema is None else frame_schema
+        if self.file_schema.span("root_pos", "root_rot") != slice(
+            AMPLoader.ROOT_POS_START_IDX, AMPLoader.ROOT_ROT_END_IDX
+        ):
+            raise ValueError("Motion frames must start with the root_pos and root_rot feature groups.")
+        if (reorder_from_pybullet or mirror_motions is not None) and (
+            self.file_schema.groups != AMPLoader.FRAME_SCHEMA.groups
+        ):
+            raise ValueError("Reordering from PyBullet and mirroring require the A1 frame layout of FRAME_SCHEMA.")
+        self.frame_schema = self.file_schema.select(
+            AMPLoader.DEFAULT_FEATURE_GROUPS if feature_groups is None else feature_groups
+        )
+        if reset_only and mirror_motions == "lazy":
+            raise ValueError(
+                "Lazy mirroring only applies to AMP transitions, which a reset-only loader does not sample."
+            )
+        self.reset_only = reset_only
+        required_groups = set(AMPLoader.RESET_STATE_GROUPS if reset_only else AMPLoader.AMP_OBSERVATION_GROUPS)
+        if build_reset_table:
+            required_groups.update(AMPLoader.RESET_STATE_GROUPS)
+        if precompute_amp_observations:
+            required_groups.update(AMPLoader.AMP_OBSERVATION_GROUPS)
+        missing_groups = [name for name in sorted(required_groups) if name not in self.frame_schema]
+        if missing_groups:
+            raise ValueError(f"The loader and its enabled features also need the feature groups {missing_groups}.")
+        self.trajectory_names = [motion_file.split(".")[0] for motion_file in self.motion_files]
+        if mirror_motions == "stored":
+            # Mirrored clips follow the source clips, in the same order.
+            self.trajectory_names += [f"{name}_mirrored" for name in self.trajectory_names]
+        self.trajectory_idxs = list(range(len(self.trajectory_names)))
+
+        self.shared_library_dir = shared_library_dir
+        self.shared_library_key = None
+        self.shared_library_handle = None
+        if shared_library_dir is None:
+            self.build_library(num_ingest_workers, clip_cache_bytes)
+            return
+        if self.lazy_load:
+            raise ValueError("Lazy clip loading cannot be combined with a shared motion library.")
+        # The first process to get the lock builds and publishes the library, the others map the published one.
+        self.shared_library_key = library_key = shared_library.library_key(
+            self.motion_files,
+            time_between_frames=time_between_frames,
+            storage_dtype=self.storage_dtype,
+            reorder_from_pybullet=reorder_from_pybullet,
+            num_preloaded_transitions=self.num_preloaded_transitions,
+            compact_preload=compact_preload,
+            precompute_amp_observations=precompute_amp_observations,
+            build_reset_table=build_reset_table,
+            mirror_motions=mirror_motions,
+            frame_groups=self.frame_schema.groups,
+            source_columns=self.frame_schema.source_columns.tolist(),
+        )
+        with shared_library.lock(shared_library_dir, library_key):
+            shared_tensors = shared_library.attach(shared_library_dir, library_key)
+            if shared_tensors is None:
+                self.build_library(num_ingest_workers, clip_cache_bytes)
+                shared_library.publish(shared_library_dir, library_key, self.get_shared_tensors())
+                shared_tensors = shared_library.attach(shared_library_dir, library_key)
+            # The library is held until close, so that the process releasing it last removes its files.
+            self.shared_library_handle = shared_library.hold(shared_library_dir, library_key)
+        print(f"Attached shared motion library {library_key} from {shared_library_dir}.")
+        self.attach_shared_tensors(shared_tensors)
+
+    def close(self):
+        """Releases the shared motion library, whose files are removed once no process holds it."""
+        if self.shared_library_handle is not None:
+            shared_library.release(self.shared_library_dir, self.shared_library_key, self.shared_library_handle)
+            self.shared_library_handle = None
+
+    def build_library(self, num_ingest_workers=0, clip_cache_bytes=None):
+        """Ingests the motion files into the packed library and computes preloaded or precomputed transitions."""
         # Values to store for each trajectory.
-        self.trajectories = []
-        self.trajectories_full = []
-        self.trajectory_names = []
-        self.trajectory_idxs = []
         self.trajectory_lens = []  # Traj length in seconds.
         self.trajectory_weights = []
         self.trajectory_frame_durations = []
         self.trajectory_num_frames = []
 
-        for i, motion_file in enumerate(motion_files):
-            self.trajectory_names.append(motion_file.split(".")[0])
-            with open(motion_file) as f:
-                motion_json = json.load(f)
-                motion_data = np.array(motion_json["Frames"])
-                # motion_data = self.reorder_from_pybullet_to_isaac(motion_data)
-
-                # Normalize and standardize quaternions.
-                for f_i in range(motion_data.shape[0]):
-                    root_rot = AMPLoader.get_root_rot(motion_data[f_i])
-                    root_rot = pose3d.QuaternionNormalize(root_rot)
-                    root_rot = motion_util.standardize_quaternion(root_rot)
-                    motion_data[f_i, AMPLoader.POS_SIZE : (AMPLoader.POS_SIZE + AMPLoader.ROT_SIZE)] = root_rot
-
-                # Remove first 7 observation dimensions (root_pos and root_orn).
-                self.trajectories.append(
-                    torch.tensor(
-                        motion_data[:, AMPLoader.ROOT_ROT_END_IDX : AMPLoader.JOINT_VEL_END_IDX],
-                        dtype=torch.float32,
-                        device=device,
-                    )
-                )
-                self.trajectories_full.append(
-                    torch.tensor(motion_data[:, : AMPLoader.JOINT_VEL_END_IDX], dtype=torch.float32, device=device)
-                )
-                self.trajectory_idxs.append(i)
-                self.trajectory_weights.append(float(motion_json["MotionWeight"]))
-                frame_duration = float(motion_json["FrameDuration"])
-                self.trajectory_frame_durations.append(frame_duration)
-                traj_len = (motion_data.shape[0] - 1) * frame_duration
-                self.trajectory_lens.append(traj_len)
-                self.trajectory_num_frames.append(float(motion_data.shape[0]))
+        if self.lazy_load:
+            # Only the metadata is kept, frames are paged in from the motion cache when sampled.
+            motion_metadata = [self.load_motion_metadata(motion_file) for motion_file in self.motion_files]
+            self.trajectory_cache_keys = [cache_key for cache_key, *_ in motion_metadata]
+            motion_metadata = [metadata for _, *metadata in motion_metadata]
+        else:
+            loaded_motions = self.load_motion_files(self.motion_files, num_ingest_workers)
+            motion_frames = [motion_data for motion_data, _, _ in loaded_motions]
+            motion_metadata = [
+                (motion_data.shape[0], motion_weight, frame_duration)
+                for motion_data, motion_weight, frame_duration in loaded_motions
+            ]
+            del loaded_motions
+        for motion_file, (num_frames, motion_weight, frame_duration) in zip(self.motion_files, motion_metadata):
+            self.trajectory_weights.append(motion_weight)
+            self.trajectory_frame_durations.append(frame_duration)
+            traj_len = (num_frames - 1) * frame_duration
+            self.trajectory_lens.append(traj_len)
+            self.trajectory_num_frames.append(float(num_frames))
 
             print(f"Loaded {traj_len}s. motion from {motion_file}.")
+        if self.mirror_motions == "stored":
+            self.trajectory_weights *= 2
+            self.trajectory_frame_durations *= 2
+            self.trajectory_lens *= 2
+            self.trajectory_num_frames *= 2
 
         # Trajectory weights are used to sample some trajectories more than others.
         self.trajectory_weights = np.array(self.trajectory_weights) / np.sum(self.trajectory_weights)
@@ -111,19 +289,338 @@ class AMPLoader:
         self.trajectory_lens = np.array(self.trajectory_lens)
         self.trajectory_num_frames = np.array(self.trajectory_num_frames)
 
+        # Pack all trajectories into one contiguous library so batch lookups are a single gather. The library is
+        # the only copy of the motion data: per-trajectory and AMP-observation tensors are views into it.
+        frame_offsets = np.concatenate([[0], np.cumsum(self.trajectory_num_frames)]).astype(np.int64)
+        if self.lazy_load:
+            self.clip_cache = clip_cache.ClipCache(self.page_in_clip, self.num_motions, clip_cache_bytes)
+            self.all_trajectories_full = None
+        else:
+            with timed_stage(self.ingest_timings, "pack"):
+                self.all_trajectories_full = torch.empty(
+                    frame_offsets[-1], self.frame_schema.frame_dim, dtype=self.storage_dtype, device=self.device
+                )
+                for start, end, motion_data in zip(frame_offsets[:-1], frame_offsets[1:], motion_frames):
+                    self.all_trajectories_full[start:end] = torch.tensor(
+                        motion_data[:, self.frame_schema.source_columns], dtype=self.storage_dtype
+                    )
+            if self.mirror_motions == "stored":
+                with timed_stage(self.ingest_timings, "mirror"):
+                    # All clips are mirrored at once by one column gather and sign flip of the packed frames.
+                    num_source_frames = frame_offsets[len(motion_frames)]
+                    columns, signs = self.stored_mirror_columns_and_signs()
+                    self.all_trajectories_full[num_source_frames:] = self.all_trajectories_full[
+                        :num_source_frames, columns
+                    ] * signs.to(self.storage_dtype)
+            del motion_frames
+        print(
+            f"Ingested {int(frame_offsets[-1])} frames from {self.num_motions} motion files: "
+            + ", ".join(f"{stage} {duration:.3f}s" for stage, duration in self.ingest_timings.items())
+        )
+        self.index_library()
+
+        self.reset_table = None
+        if self.build_reset_table:
+            self.reset_table = self.full_frames_to_reset_states(self.upcast_full_frames(self.all_trajectories_full))
+
+        if self.precompute_amp_observations:
+            self.build_amp_observation_table()
+
         # Preload transitions.
-        self.preload_transitions = preload_transitions
         if self.preload_transitions:
-            print(f"Preloading {num_preload_transitions} transitions")
-            traj_idxs = self.weighted_traj_idx_sample_batch(num_preload_transitions)
+            print(f"Preloading {self.num_preloaded_transitions} transitions")
+            traj_idxs = self.weighted_traj_idx_sample_batch(self.num_preloaded_transitions)
             times = self.traj_time_sample_batch(traj_idxs)
-            self.preloaded_s = self.get_full_frame_at_time_batch(traj_idxs, times)
-            self.preloaded_s_next = self.get_full_frame_at_time_batch(traj_idxs, times + self.time_between_frames)
-
-            print(self.get_joint_pose_batch(self.preloaded_s).mean(dim=0))
+            if self.compact_preload:
+                # Only the lower packed frame index and blend of s (row 0) and s_next (row 1) are stored.
+                idx_low, _, blend = self.get_packed_frame_idx_batch(
+                    traj_idxs.repeat(2), torch.cat([times, times + self.time_between_frames])
+                )
+                self.preloaded_idx_low = idx_low.to(torch.int32).view(2, -1)
+                self.preloaded_blend = blend.view(2, -1)
+            else:
+                self.preloaded_s = self.get_full_frame_at_time_batch(traj_idxs, times).to(self.storage_dtype)
+                self.preloaded_s_next = self.get_full_frame_at_time_batch(
+                    traj_idxs, times + self.time_between_frames
+                ).to(self.storage_dtype)
+                print(self.get_feature_batch(self.preloaded_s, "joint_pos").mean(dim=0))
             print("Finished preloading")
 
-        self.all_trajectories_full = torch.vstack(self.trajectories_full)
+    def index_library(self):
+        """Sets up the per-trajectory views and the sampling tensors of the packed library."""
+        # In lazy mode, packed indices address the concatenation of the clips without it being materialized.
+        frame_offsets = np.concatenate([[0], np.cumsum(self.trajectory_num_frames)]).astype(np.int64)
+        # Columns of a full frame that form an AMP observation: joint pos to joint vel, then root height. None if the
+        # stored feature groups do not cover an observation.
+        self.amp_frame_columns = None
+        self.amp_observation_columns = None
+        if all(name in self.frame_schema for name in AMPLoader.AMP_OBSERVATION_GROUPS):
+            self.amp_frame_columns = self.frame_schema.span("joint_pos", "joint_vel")
+            self.amp_observation_columns = torch.cat(
+                [
+                    torch.arange(self.amp_frame_columns.start, self.amp_frame_columns.stop, device=self.device),
+                    torch.tensor([self.frame_schema.slice("root_pos").start + 2], device=self.device),
+                ]
+            )
+        if self.lazy_load:
+            self.all_trajectories = None
+            self.trajectories_full = self.clip_cache
+        else:
+            self.all_trajectories = (
+                None if self.amp_frame_columns is None else self.all_trajectories_full[:, self.amp_frame_columns]
+            )
+            self.trajectories_full = [
+                self.all_trajectories_full[start:end] for start, end in zip(frame_offsets[:-1], frame_offsets[1:])
+            ]
+            # Remove the root_pos and root_orn observation dimensions.
+            self.trajectories = (
+                None
+                if self.amp_frame_columns is None
+                else [trajectory[:, self.amp_frame_columns] for trajectory in self.trajectories_full]
+            )
+        self.trajectory_frame_offsets = torch.tensor(frame_offsets[:-1], dtype=torch.long, device=self.device)
+        # Columns of the motion cache that are paged in, in library order.
+        self.clip_store_columns = (
+            AMPLoader.pybullet_to_isaac_columns(self.file_schema.frame_dim)
+            if self.reorder_from_pybullet
+            else np.arange(self.file_schema.frame_dim)
+        )[self.frame_schema.source_columns]
+        self.packed_trajectory_lens = torch.tensor(self.trajectory_lens, dtype=torch.float64, device=self.device)
+        self.packed_trajectory_num_frames = torch.tensor(
+            self.trajectory_num_frames, dtype=torch.float64, device=self.device
+        )
+        self.packed_trajectory_frame_durations = torch.tensor(
+            self.trajectory_frame_durations, dtype=torch.float64, device=self.device
+        )
+        self.trajectory_weights_cdf = torch.cumsum(
+            torch.tensor(self.trajectory_weights, dtype=torch.float64, device=self.device), dim=0
+        )
+        if self.amp_observation_columns is not None and self.file_schema.groups == AMPLoader.FRAME_SCHEMA.groups:
+            # An AMP observation is mirrored by permuting and negating its own columns.
+            mirror_columns, mirror_signs = self.stored_mirror_columns_and_signs()
+            observation_positions = torch.zeros(self.frame_schema.frame_dim, dtype=torch.long, device=self.device)
+            observation_positions[self.amp_observation_columns] = torch.arange(
+                len(self.amp_observation_columns), device=self.device
+            )
+            self.amp_observation_mirror_columns = observation_positions[mirror_columns[self.amp_observation_columns]]
+            self.amp_observation_mirror_signs = mirror_signs[self.amp_observation_columns]
+
+    def get_shared_tensors(self):
+        """Returns the tensors that define the library and its preloaded or precomputed transitions."""
+        names = list(AMPLoader.SHARED_METADATA_NAMES) + ["all_trajectories_full"]
+        if self.preload_transitions:
+            names += (
+                ["preloaded_idx_low", "preloaded_blend"]
+                if self.compact_preload
+                else ["preloaded_s", "preloaded_s_next"]
+            )
+        if self.precompute_amp_observations:
+            names += ["amp_observation_table", "amp_observation_row_offsets", "amp_observation_num_transitions"]
+        if self.build_reset_table:
+            names += ["reset_table"]
+        return {name: torch.as_tensor(getattr(self, name)) for name in names}
+
+    def attach_shared_tensors(self, shared_tensors):
+        """Uses the tensors of a shared motion library in place of building the library."""
+        self.reset_table = None
+        for name, tensor in shared_tensors.items():
+            if name in AMPLoader.SHARED_METADATA_NAMES:
+                setattr(self, name, tensor.numpy())
+            else:
+                # No copy on the CPU, so the pages stay shared with the other processes. A GPU gets its own copy.
+                setattr(self, name, tensor.to(self.device))
+        self.index_library()
+
+    def build_amp_observation_table(self):
+        """Stores the AMP observations of every clip at multiples of time_between_frames.
+
+        Each clip gets the grid times 0, dt, ..., up to the last time at which a transition can start, plus one more
+        row for the last s_next. Transition k of a clip is then the pair of table rows (k, k + 1). Clips shorter than
+        frame_duration + dt still get one transition, whose frames are clamped to the last frame of the clip.
+        """
+        print("Precomputing AMP observations")
+        dt = self.time_between_frames
+        # Same range of start times as traj_time_sample_batch, at least one transition per clip.
+        max_start_times = self.packed_trajectory_lens - self.packed_trajectory_frame_durations - dt
+        self.amp_observation_num_transitions = torch.floor(max_start_times / dt).clamp_(min=0.0) + 1.0
+        num_rows = self.amp_observation_num_transitions.long() + 1
+        self.amp_observation_row_offsets = torch.cumsum(num_rows, dim=0) - num_rows
+        traj_idxs = torch.repeat_interleave(torch.arange(self.num_motions, device=self.device), num_rows)
+        steps = torch.arange(len(traj_idxs), device=self.device) - self.amp_observation_row_offsets[traj_idxs]
+        idx_low, idx_high, blend = self.get_packed_frame_idx_batch(traj_idxs, steps * dt)
+        # Keep the grid times past the end of short clips from reading the first frames of the next clip.
+        last_frame_idxs = (
+            self.trajectory_frame_offsets[traj_idxs] + self.packed_trajectory_num_frames[traj_idxs].long() - 1
+        )
+        idx_low, idx_high = torch.minimum(idx_low, last_frame_idxs), torch.minimum(idx_high, last_frame_idxs)
+        self.amp_observation_table = self.get_amp_observation_at_packed_idx_batch(idx_low, idx_high, blend).to(
+            self.storage_dtype
+        )
+
+    def get_precomputed_amp_transition_batch(self, size):
+        """Samples AMP transitions (s, s_next) from the precomputed observation table."""
+        traj_idxs = self.weighted_traj_idx_sample_batch(size)
+        u = torch.rand(size, dtype=torch.float64, device=self.device, generator=self.generator)
+        rows = (
+            self.amp_observation_row_offsets[traj_idxs] + (u * self.amp_observation_num_transitions[traj_idxs]).long()
+        )
+        return self.amp_observation_table[rows].float(), self.amp_observation_table[rows + 1].float()
+
+    def load_motion_files(self, motion_files, num_workers=0):
+        """Returns the normalized frames, weight and frame duration of each motion file, in input order.
+
+        With workers, the files missing from the motion cache are parsed in a process pool and their frames are
+        returned through shared memory. The workers only import motion_ingest, not the robot_lab package.
+        """
+        if num_workers <= 0:
+            return [self.load_motion_file(motion_file) for motion_file in motion_files]
+
+        # Cached clips are loaded here, the others are parsed by the workers and cached once they are returned.
+        cache_keys = [None] * len(motion_files)
+        loaded_motions = [None] * len(motion_files)
+        if self.motion_cache_dir is not None:
+            for i, motion_file in enumerate(motion_files):
+                cache_keys[i], loaded_motions[i] = self.load_cached_motion_file(motion_file)
+        missing_idxs = [i for i, loaded_motion in enumerate(loaded_motions) if loaded_motion is None]
+        if missing_idxs:
+            with timed_stage(self.ingest_timings, "pool"):
+                # Workers are forked from a fresh server process rather than from this one, which may hold simulator
+                # threads and CUDA state. They import the standalone motion_ingest module from its directory.
+                ingest = motion_ingest.standalone_module()
+                with ProcessPoolExecutor(
+                    num_workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=site.addsitedir,
+                    initargs=(os.path.dirname(ingest.__file__),),
+                ) as executor:
+                    # The workers are started by the first submissions.
+                    with _entry_script_hidden():
+                        results = executor.map(
+                            ingest.ingest_motion_file_to_shared_memory, [motion_files[i] for i in missing_idxs]
+                        )
+                    for i, (shm_name, shape, dtype, motion_weight, frame_duration, timings) in zip(
+                        missing_idxs, results
+                    ):
+                        shm = shared_memory.SharedMemory(name=shm_name)
+                        motion_data = np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+                        shm.close()
+                        shm.unlink()
+                        for stage, duration in timings.items():
+                            self.ingest_timings[stage] += duration
+                        if self.motion_cache_dir is not None:
+                            with timed_stage(self.ingest_timings, "cache"):
+                                motion_cache.save(
+                                    self.motion_cache_dir, cache_keys[i], motion_data, motion_weight, frame_duration
+                                )
+                        loaded_motions[i] = (motion_data, motion_weight, frame_duration)
+        if self.reorder_from_pybullet:
+            with timed_stage(self.ingest_timings, "reorder"):
+                loaded_motions = [
+                    (motion_data[:, AMPLoader.pybullet_to_isaac_columns(motion_data.shape[1])], *metadata)
+                    for motion_data, *metadata in loaded_motions
+                ]
+        return loaded_motions
+
+    def load_cached_motion_file(self, motion_file):
+        """Returns the cache key of a motion file and its cached frames, weight and frame duration, or None on a
+        cache miss."""
+        with timed_stage(self.ingest_timings, "read"):
+            with open(motion_file, "rb") as f:
+                cache_key = motion_cache.content_key(f.read())
+        with timed_stage(self.ingest_timings, "cache"):
+            cached = motion_cache.load(self.motion_cache_dir, cache_key)
+        if cached is None:
+            return cache_key, None
+        motion_data, metadata = cached
+        return cache_key, (motion_data, metadata["weight"], metadata["frame_duration"])
+
+    def load_motion_file(self, motion_file):
+        """Returns the normalized frames, weight and frame duration of a motion file."""
+        return AMPLoader.ingest_motion_file(
+            motion_file, self.motion_cache_dir, self.reorder_from_pybullet, self.ingest_timings
+        )
+
+    def load_motion_metadata(self, motion_file):
+        """Returns the cache key, number of frames, weight and frame duration of a motion file.
+
+        The motion file is ingested into the motion cache first if it is not cached yet. No frames are read.
+        """
+        cache_key, cached = self.load_cached_motion_file(motion_file)
+        if cached is None:
+            self.load_motion_file(motion_file)
+            _, cached = self.load_cached_motion_file(motion_file)
+        motion_data, motion_weight, frame_duration = cached
+        return cache_key, motion_data.shape[0], motion_weight, frame_duration
+
+    def page_in_clip(self, traj_idx):
+        """Reads the frames of a trajectory from the memory-mapped motion cache into the storage dtype."""
+        frames, _ = motion_cache.load(self.motion_cache_dir, self.trajectory_cache_keys[traj_idx])
+        return torch.tensor(frames[:, self.clip_store_columns], dtype=self.storage_dtype, device=self.device)
+
+    def gather_packed_frames(self, packed_idxs, columns=None):
+        """Returns the stored frames at the given packed-library indices, optionally restricted to columns.
+
+        In lazy mode, the frames are gathered clip by clip through the clip cache.
+        """
+        if not self.lazy_load:
+            if columns is None:
+                return self.all_trajectories_full[packed_idxs]
+            return self.all_trajectories_full[packed_idxs.unsqueeze(-1), columns]
+
+        num_columns = self.frame_schema.frame_dim if columns is None else len(columns)
+        frames = torch.empty(*packed_idxs.shape, num_columns, dtype=self.storage_dtype, device=self.device)
+        traj_idxs = torch.searchsorted(self.trajectory_frame_offsets, packed_idxs, right=True) - 1
+        unique_traj_idxs, inverse = torch.unique(traj_idxs, return_inverse=True)
+        for i, traj_idx in enumerate(unique_traj_idxs.tolist()):
+            mask = inverse == i
+            clip_idxs = packed_idxs[mask] - self.trajectory_frame_offsets[traj_idx]
+            clip = self.clip_cache[traj_idx]
+            frames[mask] = clip[clip_idxs] if columns is None else clip[clip_idxs.unsqueeze(-1), columns]
+        return frames
+
+    @staticmethod
+    def ingest_motion_file(motion_file, motion_cache_dir=None, reorder_from_pybullet=False, timings=None):
+        """Returns the normalized frames, weight and frame duration of a motion file.
+
+        Frames are read from the binary motion cache when it is enabled and holds the file content. Time spent
+        in each stage is added to ``timings`` if given.
+        """
+        timings = defaultdict(float) if timings is None else timings
+        with timed_stage(timings, "read"):
+            with open(motion_file, "rb") as f:
+                raw_motion = f.read()
+        motion_data = None
+        if motion_cache_dir is not None:
+            with timed_stage(timings, "cache"):
+                cache_key = motion_cache.content_key(raw_motion)
+                cached = motion_cache.load(motion_cache_dir, cache_key)
+            if cached is not None:
+                motion_data, metadata = cached
+                motion_weight, frame_duration = metadata["weight"], metadata["frame_duration"]
+
+        if motion_data is None:
+            with timed_stage(timings, "parse"):
+                motion_data, motion_weight, frame_duration = AMPLoader.parse_motion_file(raw_motion)
+            with timed_stage(timings, "normalize"):
+                motion_data = AMPLoader.normalize_motion_data(motion_data)
+            if motion_cache_dir is not None:
+                with timed_stage(timings, "cache"):
+                    motion_cache.save(motion_cache_dir, cache_key, motion_data, motion_weight, frame_duration)
+
+        if reorder_from_pybullet:
+            with timed_stage(timings, "reorder"):
+                motion_data = motion_data[:, AMPLoader.pybullet_to_isaac_columns(motion_data.shape[1])]
+        return motion_data, motion_weight, frame_duration
+
+    @staticmethod
+    def parse_motion_file(raw_motion):
+        """Returns the raw frames, weight and frame duration of the content of a JSON motion file."""
+        return motion_ingest.parse_motion_file(raw_motion)
+
+    @staticmethod
+    def normalize_motion_data(motion_data):
+        """Normalizes and standardizes the root quaternions of all frames of a clip at once."""
+        return motion_ingest.normalize_motion_data(motion_data)
 
     def reorder_from_isaacgym_to_isaacsim_tool(self, joint_tensor):
         # Convert to a 4x3 tensor
@@ -149,120 +646,232 @@ class AMPLoader:
         Rearranges leg and joint order from PyBullet [FR, FL, RR, RL] to
         IsaacGym order [FL, FR, RL, RR].
         """
-        root_pos = AMPLoader.get_root_pos_batch(motion_data)
-        root_rot = AMPLoader.get_root_rot_batch(motion_data)
-
-        jp_fr, jp_fl, jp_rr, jp_rl = np.split(AMPLoader.get_joint_pose_batch(motion_data), 4, axis=1)
-        joint_pos = np.hstack([jp_fl, jp_fr, jp_rl, jp_rr])
-
-        fp_fr, fp_fl, fp_rr, fp_rl = np.split(AMPLoader.get_tar_toe_pos_local_batch(motion_data), 4, axis=1)
-        foot_pos = np.hstack([fp_fl, fp_fr, fp_rl, fp_rr])
+        return motion_data[:, AMPLoader.pybullet_to_isaac_columns(motion_data.shape[1])]
 
-        lin_vel = AMPLoader.get_linear_vel_batch(motion_data)
-        ang_vel = AMPLoader.get_angular_vel_batch(motion_data)
+    @staticmethod
+    def pybullet_to_isaac_columns(frame_dim):
+        """Returns the column permutation of a frame that swaps legs from PyBullet to IsaacGym order."""
+        columns = np.arange(frame_dim)
+        for start_idx, end_idx in [
+            (AMPLoader.JOINT_POSE_START_IDX, AMPLoader.JOINT_POSE_END_IDX),
+            (AMPLoader.TAR_TOE_POS_LOCAL_START_IDX, AMPLoader.TAR_TOE_POS_LOCAL_END_IDX),
+            (AMPLoader.JOINT_VEL_START_IDX, AMPLoader.JOINT_VEL_END_IDX),
+            (AMPLoader.TAR_TOE_VEL_LOCAL_START_IDX, AMPLoader.TAR_TOE_VEL_LOCAL_END_IDX),
+        ]:
+            # [FR, FL, RR, RL] -> [FL, FR, RL, RR]
+            columns[start_idx:end_idx] = columns[start_idx:end_idx].reshape(4, -1)[[1, 0, 3, 2]].flatten()
+        return columns
 
-        jv_fr, jv_fl, jv_rr, jv_rl = np.split(AMPLoader.get_joint_vel_batch(motion_data), 4, axis=1)
-        joint_vel = np.hstack([jv_fl, jv_fr, jv_rl, jv_rr])
+    @staticmethod
+    def mirror_columns_and_signs(frame_dim):
+        """Returns the column permutation and signs that mirror a frame across the sagittal plane of the robot.
 
-        fv_fr, fv_fl, fv_rr, fv_rl = np.split(AMPLoader.get_tar_toe_vel_local_batch(motion_data), 4, axis=1)
-        foot_vel = np.hstack([fv_fl, fv_fr, fv_rl, fv_rr])
+        The mirrored frame is ``frame[:, columns] * signs``. Left and right legs are swapped, [FL, FR, RL, RR] ->
+        [FR, FL, RR, RL], which is the same swap in PyBullet order. Hip abduction angles and velocities, lateral
+        positions and linear velocities, and the roll and yaw rates change sign. The xyzw root quaternion is
+        reflected to (-x, y, -z, w), which keeps it standardized. Mirroring twice is the identity.
+        """
+        columns = np.arange(AMPLoader.TAR_TOE_VEL_LOCAL_END_IDX)
+        signs = np.ones(AMPLoader.TAR_TOE_VEL_LOCAL_END_IDX, dtype=np.float32)
+        signs[AMPLoader.ROOT_POS_START_IDX + 1] = -1.0
+        signs[[AMPLoader.ROOT_ROT_START_IDX, AMPLoader.ROOT_ROT_START_IDX + 2]] = -1.0
+        signs[AMPLoader.LINEAR_VEL_START_IDX + 1] = -1.0
+        signs[[AMPLoader.ANGULAR_VEL_START_IDX, AMPLoader.ANGULAR_VEL_START_IDX + 2]] = -1.0
+        for start_idx, end_idx, leg_signs in [
+            # Per leg: hip abduction, hip pitch, knee.
+            (AMPLoader.JOINT_POSE_START_IDX, AMPLoader.JOINT_POSE_END_IDX, [-1.0, 1.0, 1.0]),
+            # Per leg: x, y, z.
+            (AMPLoader.TAR_TOE_POS_LOCAL_START_IDX, AMPLoader.TAR_TOE_POS_LOCAL_END_IDX, [1.0, -1.0, 1.0]),
+            (AMPLoader.JOINT_VEL_START_IDX, AMPLoader.JOINT_VEL_END_IDX, [-1.0, 1.0, 1.0]),
+            (AMPLoader.TAR_TOE_VEL_LOCAL_START_IDX, AMPLoader.TAR_TOE_VEL_LOCAL_END_IDX, [1.0, -1.0, 1.0]),
+        ]:
+            columns[start_idx:end_idx] = columns[start_idx:end_idx].reshape(4, -1)[[1, 0, 3, 2]].flatten()
+            signs[start_idx:end_idx] = np.tile(leg_signs, 4)
+        # Every block is permuted within itself, so a frame cut to its leading columns stays consistent.
+        return columns[:frame_dim], signs[:frame_dim]
+
+    def stored_mirror_columns_and_signs(self):
+        """Returns mirror_columns_and_signs for the stored columns of the library, as tensors on the device."""
+        columns, signs = AMPLoader.mirror_columns_and_signs(self.file_schema.frame_dim)
+        source_columns = self.frame_schema.source_columns
+        return (
+            torch.tensor(self.frame_schema.source_positions(columns[source_columns]), device=self.device),
+            torch.tensor(signs[source_columns], device=self.device),
+        )
 
-        return np.hstack([root_pos, root_rot, joint_pos, foot_pos, lin_vel, ang_vel, joint_vel, foot_vel])
+    def mirror_amp_observation_batch(self, amp_observations):
+        """Returns the left/right mirror of a batch of AMP observations, or of windows of them stacked along the last
+        dimension."""
+        frames = amp_observations.reshape(*amp_observations.shape[:-1], -1, len(self.amp_observation_mirror_columns))
+        mirrored = frames[..., self.amp_observation_mirror_columns] * self.amp_observation_mirror_signs
+        return mirrored.reshape(amp_observations.shape)
 
     def weighted_traj_idx_sample(self):
         """Get traj idx via weighted sampling."""
         return np.random.choice(self.trajectory_idxs, p=self.trajectory_weights)
 
     def weighted_traj_idx_sample_batch(self, size):
-        """Batch sample traj idxs."""
-        return np.random.choice(self.trajectory_idxs, size=size, p=self.trajectory_weights, replace=True)
+        """Batch sample traj idxs on the loader device by inverse transform sampling of the weights."""
+        u = torch.rand(size, dtype=torch.float64, device=self.device, generator=self.generator)
+        traj_idxs = torch.searchsorted(self.trajectory_weights_cdf, u * self.trajectory_weights_cdf[-1], right=True)
+        return traj_idxs.clamp_(max=self.num_motions - 1)
 
     def traj_time_sample(self, traj_idx):
         """Sample random time for traj."""
         subst = self.time_between_frames + self.trajectory_frame_durations[traj_idx]
         return max(0, (self.trajectory_lens[traj_idx] * np.random.uniform() - subst))
 
-    def traj_time_sample_batch(self, traj_idxs):
-        """Sample random time for multiple trajectories."""
-        subst = self.time_between_frames + self.trajectory_frame_durations[traj_idxs]
-        time_samples = self.trajectory_lens[traj_idxs] * np.random.uniform(size=len(traj_idxs)) - subst
-        return np.maximum(np.zeros_like(time_samples), time_samples)
+    def traj_time_sample_batch(self, traj_idxs, num_steps=1):
+        """Sample random time for multiple trajectories, leaving room for num_steps transitions after it."""
+        traj_idxs = torch.as_tensor(traj_idxs, dtype=torch.long, device=self.device)
+        subst = num_steps * self.time_between_frames + self.packed_trajectory_frame_durations[traj_idxs]
+        u = torch.rand(len(traj_idxs), dtype=torch.float64, device=self.device, generator=self.generator)
+        time_samples = self.packed_trajectory_lens[traj_idxs] * u - subst
+        return time_samples.clamp_(min=0.0)
 
     def slerp(self, val0, val1, blend):
         return (1.0 - blend) * val0 + blend * val1
 
     def get_trajectory(self, traj_idx):
         """Returns trajectory of AMP observations."""
-        return self.trajectories_full[traj_idx]
+        return self.trajectories_full[traj_idx].float()
 
     def get_frame_at_time(self, traj_idx, time):
         """Returns frame for the given trajectory at the specified time."""
         p = float(time) / self.trajectory_lens[traj_idx]
-        n = self.trajectories[traj_idx].shape[0]
+        trajectory = self.trajectories_full[traj_idx]
+        n = trajectory.shape[0]
         idx_low, idx_high = int(np.floor(p * n)), int(np.ceil(p * n))
-        frame_start = self.trajectories[traj_idx][idx_low]
-        frame_end = self.trajectories[traj_idx][idx_high]
+        frame_start = trajectory[idx_low, self.amp_frame_columns].float()
+        frame_end = trajectory[idx_high, self.amp_frame_columns].float()
         blend = p * n - idx_low
         return self.slerp(frame_start, frame_end, blend)
 
+    def get_packed_frame_idx_batch(self, traj_idxs, times):
+        """Returns the packed-library indices of the frames around the given times and the blend between them."""
+        traj_idxs = torch.as_tensor(traj_idxs, dtype=torch.long, device=self.device)
+        times = torch.as_tensor(times, dtype=torch.float64, device=self.device)
+        p = times / self.packed_trajectory_lens[traj_idxs]
+        n = self.packed_trajectory_num_frames[traj_idxs]
+        idx_low, idx_high = torch.floor(p * n), torch.ceil(p * n)
+        blend = (p * n - idx_low).to(torch.float32).unsqueeze(-1)
+        offsets = self.trajectory_frame_offsets[traj_idxs]
+        return offsets + idx_low.long(), offsets + idx_high.long(), blend
+
+    def get_traj_time_at_packed_idx_batch(self, packed_idxs):
+        """Returns the trajectory indices and times of packed-library frames.
+
+        get_packed_frame_idx_batch maps these times back to the frames, up to rounding: a frame may come back as the
+        previous one with a blend of one.
+        """
+        packed_idxs = torch.as_tensor(packed_idxs, dtype=torch.long, device=self.device)
+        traj_idxs = torch.searchsorted(self.trajectory_frame_offsets, packed_idxs, right=True) - 1
+        frame_idxs = (packed_idxs - self.trajectory_frame_offsets[traj_idxs]).double()
+        times = frame_idxs * self.packed_trajectory_lens[traj_idxs] / self.packed_trajectory_num_frames[traj_idxs]
+        return traj_idxs, times
+
+    def build_nearest_frame_index(self, leaf_size=32, normalizer=None):
+        """Returns a NearestFrameIndex over the AMP observations of all library frames.
+
+        Index results are packed-library frame indices, see get_traj_time_at_packed_idx_batch. The observations are
+        normalized first if an AMP normalizer is given, in which case queries must be normalized too.
+        """
+        if self.lazy_load:
+            raise ValueError("A nearest-frame index requires the whole library in memory.")
+        self.check_amp_observations()
+        observations = self.all_trajectories_full[:, self.amp_observation_columns].float()
+        if normalizer is not None:
+            observations = normalizer.normalize_torch(observations, self.device)
+        return frame_index.NearestFrameIndex(observations, leaf_size=leaf_size, device=self.device)
+
+    def get_preloaded_frame_idx_batch(self, idxs):
+        """Returns packed frame indices and blends of compact preloaded transitions, with shape (2, N)."""
+        idx_low = self.preloaded_idx_low[:, idxs].long()
+        blend = self.preloaded_blend[:, idxs].unsqueeze(-1)
+        # The upper frame equals the lower one exactly when the blend is zero (floor == ceil).
+        idx_high = idx_low + (blend.squeeze(-1) > 0)
+        return idx_low, idx_high, blend
+
     def get_frame_at_time_batch(self, traj_idxs, times):
         """Returns frame for the given trajectory at the specified time."""
-        p = times / self.trajectory_lens[traj_idxs]
-        n = self.trajectory_num_frames[traj_idxs]
-        idx_low, idx_high = np.floor(p * n).astype(np.int64), np.ceil(p * n).astype(np.int64)
-        all_frame_starts = torch.zeros(len(traj_idxs), self.observation_dim, device=self.device)
-        all_frame_ends = torch.zeros(len(traj_idxs), self.observation_dim, device=self.device)
-        for traj_idx in set(traj_idxs):
-            trajectory = self.trajectories[traj_idx]
-            traj_mask = traj_idxs == traj_idx
-            all_frame_starts[traj_mask] = trajectory[idx_low[traj_mask]]
-            all_frame_ends[traj_mask] = trajectory[idx_high[traj_mask]]
-        blend = torch.tensor(p * n - idx_low, device=self.device, dtype=torch.float32).unsqueeze(-1)
-        return self.slerp(all_frame_starts, all_frame_ends, blend)
+        idx_low, idx_high, blend = self.get_packed_frame_idx_batch(traj_idxs, times)
+        frame_starts, frame_ends = self.gather_packed_frames(torch.stack([idx_low, idx_high]))[
+            ..., self.amp_frame_columns
+        ].float()
+        return self.slerp(frame_starts, frame_ends, blend)
+
+    def get_amp_transition_at_time_batch(self, traj_idxs, times):
+        """Returns AMP observation transitions (s, s_next), including the root height, at the specified times."""
+        traj_idxs = torch.as_tensor(traj_idxs, dtype=torch.long, device=self.device)
+        times = torch.as_tensor(times, dtype=torch.float64, device=self.device)
+        idx_low, idx_high, blend = self.get_packed_frame_idx_batch(
+            traj_idxs.repeat(2), torch.cat([times, times + self.time_between_frames])
+        )
+        s, s_next = self.get_amp_observation_at_packed_idx_batch(idx_low, idx_high, blend).chunk(2)
+        return s, s_next
+
+    def get_amp_window_transition_at_time_batch(self, traj_idxs, times, history_length):
+        """Returns AMP transitions (s, s_next) of observation windows starting at the specified times.
+
+        s holds the AMP observations at times t, t + dt, ..., t + (history_length - 1) dt, oldest first, and s_next
+        the window one step later. Both are flattened to shape (N, history_length * observation_dim).
+        """
+        traj_idxs = torch.as_tensor(traj_idxs, dtype=torch.long, device=self.device)
+        times = torch.as_tensor(times, dtype=torch.float64, device=self.device)
+        steps = torch.arange(history_length + 1, dtype=torch.float64, device=self.device)
+        window_times = times.unsqueeze(1) + steps * self.time_between_frames
+        idx_low, idx_high, blend = self.get_packed_frame_idx_batch(
+            traj_idxs.unsqueeze(1).expand_as(window_times).flatten(), window_times.flatten()
+        )
+        observations = self.get_amp_observation_at_packed_idx_batch(idx_low, idx_high, blend)
+        observations = observations.view(len(times), history_length + 1, -1)
+        return observations[:, :-1].flatten(1), observations[:, 1:].flatten(1)
+
+    def get_amp_observation_at_packed_idx_batch(self, idx_low, idx_high, blend):
+        """Returns AMP observations, including the root height, blended between packed frame indices."""
+        frame_starts, frame_ends = self.gather_packed_frames(
+            torch.stack([idx_low, idx_high]), self.amp_observation_columns
+        ).float()
+        return self.slerp(frame_starts, frame_ends, blend)
 
     def get_full_frame_at_time(self, traj_idx, time):
         """Returns full frame for the given trajectory at the specified time."""
         p = float(time) / self.trajectory_lens[traj_idx]
-        n = self.trajectories_full[traj_idx].shape[0]
+        trajectory = self.trajectories_full[traj_idx]
+        n = trajectory.shape[0]
         idx_low, idx_high = int(np.floor(p * n)), int(np.ceil(p * n))
-        frame_start = self.trajectories_full[traj_idx][idx_low]
-        frame_end = self.trajectories_full[traj_idx][idx_high]
+        frame_start = trajectory[idx_low].float()
+        frame_end = trajectory[idx_high].float()
         blend = p * n - idx_low
         return self.blend_frame_pose(frame_start, frame_end, blend)
 
     def get_full_frame_at_time_batch(self, traj_idxs, times):
-        p = times / self.trajectory_lens[traj_idxs]
-        n = self.trajectory_num_frames[traj_idxs]
-        idx_low, idx_high = np.floor(p * n).astype(np.int64), np.ceil(p * n).astype(np.int64)
-        all_frame_pos_starts = torch.zeros(len(traj_idxs), AMPLoader.POS_SIZE, device=self.device)
-        all_frame_pos_ends = torch.zeros(len(traj_idxs), AMPLoader.POS_SIZE, device=self.device)
-        all_frame_rot_starts = torch.zeros(len(traj_idxs), AMPLoader.ROT_SIZE, device=self.device)
-        all_frame_rot_ends = torch.zeros(len(traj_idxs), AMPLoader.ROT_SIZE, device=self.device)
-        all_frame_amp_starts = torch.zeros(
-            len(traj_idxs), AMPLoader.JOINT_VEL_END_IDX - AMPLoader.JOINT_POSE_START_IDX, device=self.device
-        )
-        all_frame_amp_ends = torch.zeros(
-            len(traj_idxs), AMPLoader.JOINT_VEL_END_IDX - AMPLoader.JOINT_POSE_START_IDX, device=self.device
-        )
-        for traj_idx in set(traj_idxs):
-            trajectory = self.trajectories_full[traj_idx]
-            traj_mask = traj_idxs == traj_idx
-            all_frame_pos_starts[traj_mask] = AMPLoader.get_root_pos_batch(trajectory[idx_low[traj_mask]])
-            all_frame_pos_ends[traj_mask] = AMPLoader.get_root_pos_batch(trajectory[idx_high[traj_mask]])
-            all_frame_rot_starts[traj_mask] = AMPLoader.get_root_rot_batch(trajectory[idx_low[traj_mask]])
-            all_frame_rot_ends[traj_mask] = AMPLoader.get_root_rot_batch(trajectory[idx_high[traj_mask]])
-            all_frame_amp_starts[traj_mask] = trajectory[idx_low[traj_mask]][
-                :, AMPLoader.JOINT_POSE_START_IDX : AMPLoader.JOINT_VEL_END_IDX
-            ]
-            all_frame_amp_ends[traj_mask] = trajectory[idx_high[traj_mask]][
-                :, AMPLoader.JOINT_POSE_START_IDX : AMPLoader.JOINT_VEL_END_IDX
-            ]
-        blend = torch.tensor(p * n - idx_low, device=self.device, dtype=torch.float32).unsqueeze(-1)
-
-        pos_blend = self.slerp(all_frame_pos_starts, all_frame_pos_ends, blend)
-        rot_blend = amp_utils.quaternion_slerp(all_frame_rot_starts, all_frame_rot_ends, blend)
-        amp_blend = self.slerp(all_frame_amp_starts, all_frame_amp_ends, blend)
-        return torch.cat([pos_blend, rot_blend, amp_blend], dim=-1)
+        """Returns full frames for the given trajectories at the specified times."""
+        idx_low, idx_high, blend = self.get_packed_frame_idx_batch(traj_idxs, times)
+        return self.get_full_frame_at_packed_idx_batch(idx_low, idx_high, blend)
+
+    def get_full_frame_at_packed_idx_batch(self, idx_low, idx_high, blend):
+        """Returns full frames blended between packed frame indices."""
+        frame_starts, frame_ends = self.upcast_full_frames(self.gather_packed_frames(torch.stack([idx_low, idx_high])))
+        return self.blend_full_frame_batch(frame_starts, frame_ends, blend)
+
+    def upcast_full_frames(self, frames):
+        """Converts gathered full frames from the storage dtype to float32."""
+        frames = frames.float()
+        if self.storage_dtype != torch.float32 and "root_rot" in self.frame_schema:
+            # Restore unit root quaternions lost to rounding, so that slerp does not see |q0 . q1| > 1.
+            root_rot = self.get_feature_batch(frames, "root_rot")
+            root_rot /= torch.norm(root_rot, dim=-1, keepdim=True)
+        return frames
+
+    def blend_full_frame_batch(self, frame_starts, frame_ends, blend):
+        """Interpolates batches of full frames, using slerp for the root rotation."""
+        blended = self.slerp(frame_starts, frame_ends, blend)
+        if "root_rot" in self.frame_schema:
+            self.get_feature_batch(blended, "root_rot")[:] = amp_utils.quaternion_slerp(
+                self.get_feature_batch(frame_starts, "root_rot"), self.get_feature_batch(frame_ends, "root_rot"), blend
+            )
+        return blended
 
     def get_frame(self):
         """Returns random frame."""
@@ -278,92 +887,196 @@ class AMPLoader:
 
     def get_full_frame_batch(self, num_frames):
         if self.preload_transitions:
-            idxs = np.random.choice(self.preloaded_s.shape[0], size=num_frames)
-            return self.preloaded_s[idxs]
+            idxs = torch.randint(
+                self.num_preloaded_transitions, (num_frames,), device=self.device, generator=self.generator
+            )
+            if self.compact_preload:
+                idx_low, idx_high, blend = self.get_preloaded_frame_idx_batch(idxs)
+                return self.get_full_frame_at_packed_idx_batch(idx_low[0], idx_high[0], blend[0])
+            return self.upcast_full_frames(self.preloaded_s[idxs])
         else:
             traj_idxs = self.weighted_traj_idx_sample_batch(num_frames)
             times = self.traj_time_sample_batch(traj_idxs)
             return self.get_full_frame_at_time_batch(traj_idxs, times)
 
+    def full_frames_to_reset_states(self, frames):
+        """Converts full frames to reset states in simulator convention.
+
+        Reset states hold the root pose with a wxyz quaternion, the root velocities in the world frame and the joint
+        positions and velocities in Isaac Sim order, see RESET_STATE_SIZES.
+        """
+        root_rot = self.get_feature_batch(frames, "root_rot")
+        # Isaac Sim needs wxyz.
+        root_rot = root_rot[:, [3, 0, 1, 2]]
+        return torch.cat(
+            [
+                self.get_feature_batch(frames, "root_pos"),
+                root_rot,
+                amp_utils.quat_rotate(root_rot, self.get_feature_batch(frames, "linear_vel")),
+                amp_utils.quat_rotate(root_rot, self.get_feature_batch(frames, "angular_vel")),
+                # Isaac Sim uses breadth-first joint ordering, while Isaac Gym uses depth-first joint ordering.
+                self.reorder_from_isaacgym_to_isaacsim_tool(self.get_feature_batch(frames, "joint_pos")),
+                self.reorder_from_isaacgym_to_isaacsim_tool(self.get_feature_batch(frames, "joint_vel")),
+            ],
+            dim=-1,
+        )
+
+    def get_reset_state_at_packed_idx_batch(self, idx_low, idx_high, blend, interpolate=True):
+        """Returns reset states between packed frame indices, from the reset table.
+
+        Without interpolation, the nearest frame is returned. Otherwise the states are blended, with slerp for the
+        root rotation and linearly for the world-frame velocities. The root pose comes first, so the quaternion
+        occupies the same columns as in a full frame.
+        """
+        if not interpolate:
+            return self.reset_table[torch.where(blend.squeeze(-1) < 0.5, idx_low, idx_high)]
+        state_starts, state_ends = self.reset_table[torch.stack([idx_low, idx_high])]
+        states = self.slerp(state_starts, state_ends, blend)
+        states[:, AMPLoader.ROOT_ROT_START_IDX : AMPLoader.ROOT_ROT_END_IDX] = amp_utils.quaternion_slerp(
+            state_starts[:, AMPLoader.ROOT_ROT_START_IDX : AMPLoader.ROOT_ROT_END_IDX],
+            state_ends[:, AMPLoader.ROOT_ROT_START_IDX : AMPLoader.ROOT_ROT_END_IDX],
+            blend,
+        )
+        return states
+
+    def get_reset_state_at_time_batch(self, traj_idxs, times, interpolate=True):
+        """Returns reset states for the given trajectories at the specified times, split as get_reset_state_batch."""
+        idx_low, idx_high, blend = self.get_packed_frame_idx_batch(traj_idxs, times)
+        states = self.get_reset_state_at_packed_idx_batch(idx_low, idx_high, blend, interpolate)
+        return torch.split(states, AMPLoader.RESET_STATE_SIZES, dim=-1)
+
+    def get_reset_state_batch(self, num_states, interpolate=True):
+        """Returns random reset states, sampled like get_full_frame_batch. Requires build_reset_table.
+
+        Returns:
+            Tuple of the root poses (N, 7), root velocities (N, 6), joint positions (N, 12) and joint velocities
+            (N, 12), see full_frames_to_reset_states.
+        """
+        if self.preload_transitions and not self.compact_preload:
+            # Dense preloaded frames are already blended, they are converted when sampled.
+            states = self.full_frames_to_reset_states(self.get_full_frame_batch(num_states))
+        elif self.preload_transitions:
+            idxs = torch.randint(
+                self.num_preloaded_transitions, (num_states,), device=self.device, generator=self.generator
+            )
+            idx_low, idx_high, blend = self.get_preloaded_frame_idx_batch(idxs)
+            states = self.get_reset_state_at_packed_idx_batch(idx_low[0], idx_high[0], blend[0], interpolate)
+        else:
+            traj_idxs = self.weighted_traj_idx_sample_batch(num_states)
+            idx_low, idx_high, blend = self.get_packed_frame_idx_batch(
+                traj_idxs, self.traj_time_sample_batch(traj_idxs)
+            )
+            states = self.get_reset_state_at_packed_idx_batch(idx_low, idx_high, blend, interpolate)
+        return torch.split(states, AMPLoader.RESET_STATE_SIZES, dim=-1)
+
     def blend_frame_pose(self, frame0, frame1, blend):
         """Linearly interpolate between two frames, including orientation.
 
         Args:
-            frame0: First frame to be blended corresponds to (blend = 0).
-            frame1: Second frame to be blended corresponds to (blend = 1).
+            frame0: First frame to be blended corresponds to (blend = 0). Either a single frame or a batch of
+            frames of shape (N, D).
+            frame1: Second frame to be blended corresponds to (blend = 1), with the same shape as frame0.
             blend: Float between [0, 1], specifying the interpolation between
-            the two frames.
+            the two frames. For batches, a tensor of shape (N, 1) or (N,).
         Returns:
-            An interpolation of the two frames.
+            An interpolation of the two frames, with the root rotation standardized to w >= 0.
         """
-
-        root_pos0, root_pos1 = AMPLoader.get_root_pos(frame0), AMPLoader.get_root_pos(frame1)
-        root_rot0, root_rot1 = AMPLoader.get_root_rot(frame0), AMPLoader.get_root_rot(frame1)
-        joints0, joints1 = AMPLoader.get_joint_pose(frame0), AMPLoader.get_joint_pose(frame1)
-        tar_toe_pos_0, tar_toe_pos_1 = AMPLoader.get_tar_toe_pos_local(frame0), AMPLoader.get_tar_toe_pos_local(frame1)
-        linear_vel_0, linear_vel_1 = AMPLoader.get_linear_vel(frame0), AMPLoader.get_linear_vel(frame1)
-        angular_vel_0, angular_vel_1 = AMPLoader.get_angular_vel(frame0), AMPLoader.get_angular_vel(frame1)
-        joint_vel_0, joint_vel_1 = AMPLoader.get_joint_vel(frame0), AMPLoader.get_joint_vel(frame1)
-
-        blend_root_pos = self.slerp(root_pos0, root_pos1, blend)
-        blend_root_rot = transformations.quaternion_slerp(root_rot0.cpu().numpy(), root_rot1.cpu().numpy(), blend)
-        blend_root_rot = torch.tensor(
-            motion_util.standardize_quaternion(blend_root_rot), dtype=torch.float32, device=self.device
-        )
-        blend_joints = self.slerp(joints0, joints1, blend)
-        blend_tar_toe_pos = self.slerp(tar_toe_pos_0, tar_toe_pos_1, blend)
-        blend_linear_vel = self.slerp(linear_vel_0, linear_vel_1, blend)
-        blend_angular_vel = self.slerp(angular_vel_0, angular_vel_1, blend)
-        blend_joints_vel = self.slerp(joint_vel_0, joint_vel_1, blend)
-
-        return torch.cat(
-            [
-                blend_root_pos,
-                blend_root_rot,
-                blend_joints,
-                blend_tar_toe_pos,
-                blend_linear_vel,
-                blend_angular_vel,
-                blend_joints_vel,
-            ]
-        )
-
-    def feed_forward_generator(self, num_mini_batch, mini_batch_size):
-        """Generates a batch of AMP transitions."""
+        frames0, frames1 = torch.atleast_2d(frame0), torch.atleast_2d(frame1)
+        blend = torch.as_tensor(blend, dtype=frames0.dtype, device=frames0.device).reshape(-1, 1)
+        blended = self.blend_full_frame_batch(frames0, frames1, blend)
+        if "root_rot" in self.frame_schema:
+            root_rot = self.get_feature_batch(blended, "root_rot")
+            root_rot[:] = torch.where(root_rot[:, -1:] < 0, -root_rot, root_rot)
+        return blended if frame0.dim() > 1 else blended[0]
+
+    def feed_forward_generator(self, num_mini_batch, mini_batch_size, history_length=1):
+        """Generates a batch of AMP transitions.
+
+        With a history length above one, s and s_next are windows of observations, see
+        get_amp_window_transition_at_time_batch. They are always interpolated from the library, as preloaded and
+        precomputed transitions hold single observations.
+        """
+        self.check_amp_observations()
         for _ in range(num_mini_batch):
-            if self.preload_transitions:
-                idxs = np.random.choice(self.preloaded_s.shape[0], size=mini_batch_size)
-                s = self.preloaded_s[idxs, AMPLoader.JOINT_POSE_START_IDX : AMPLoader.JOINT_VEL_END_IDX]
-                s = torch.cat(
-                    [s, self.preloaded_s[idxs, AMPLoader.ROOT_POS_START_IDX + 2 : AMPLoader.ROOT_POS_START_IDX + 3]],
-                    dim=-1,
+            if history_length > 1:
+                traj_idxs = self.weighted_traj_idx_sample_batch(mini_batch_size)
+                times = self.traj_time_sample_batch(traj_idxs, num_steps=history_length)
+                s, s_next = self.get_amp_window_transition_at_time_batch(traj_idxs, times, history_length)
+            elif self.precompute_amp_observations:
+                s, s_next = self.get_precomputed_amp_transition_batch(mini_batch_size)
+            elif self.preload_transitions and self.compact_preload:
+                idxs = torch.randint(
+                    self.num_preloaded_transitions, (mini_batch_size,), device=self.device, generator=self.generator
                 )
-                s_next = self.preloaded_s_next[idxs, AMPLoader.JOINT_POSE_START_IDX : AMPLoader.JOINT_VEL_END_IDX]
-                s_next = torch.cat(
-                    [
-                        s_next,
-                        self.preloaded_s_next[
-                            idxs, AMPLoader.ROOT_POS_START_IDX + 2 : AMPLoader.ROOT_POS_START_IDX + 3
-                        ],
-                    ],
-                    dim=-1,
+                idx_low, idx_high, blend = self.get_preloaded_frame_idx_batch(idxs)
+                s, s_next = self.get_amp_observation_at_packed_idx_batch(
+                    idx_low.flatten(), idx_high.flatten(), blend.flatten(0, 1)
+                ).chunk(2)
+            elif self.preload_transitions:
+                idxs = torch.randint(
+                    self.num_preloaded_transitions, (mini_batch_size,), device=self.device, generator=self.generator
                 )
+                s = self.preloaded_s[idxs.unsqueeze(-1), self.amp_observation_columns].float()
+                s_next = self.preloaded_s_next[idxs.unsqueeze(-1), self.amp_observation_columns].float()
             else:
-                s, s_next = [], []
                 traj_idxs = self.weighted_traj_idx_sample_batch(mini_batch_size)
                 times = self.traj_time_sample_batch(traj_idxs)
-                for traj_idx, frame_time in zip(traj_idxs, times):
-                    s.append(self.get_frame_at_time(traj_idx, frame_time))
-                    s_next.append(self.get_frame_at_time(traj_idx, frame_time + self.time_between_frames))
-
-                s = torch.vstack(s)
-                s_next = torch.vstack(s_next)
+                s, s_next = self.get_amp_transition_at_time_batch(traj_idxs, times)
+            if self.mirror_motions == "lazy":
+                # Flip the observation columns of a random half of the transitions, s and s_next alike.
+                mirror = torch.rand(mini_batch_size, 1, device=self.device, generator=self.generator) < 0.5
+                s = torch.where(mirror, self.mirror_amp_observation_batch(s), s)
+                s_next = torch.where(mirror, self.mirror_amp_observation_batch(s_next), s_next)
             yield s, s_next
 
+    def validate_storage_dtype(self, num_samples=100000):
+        """Reports the interpolation error of the storage dtype against float32 storage.
+
+        The motion files are reloaded in float32 and both libraries are interpolated at the same sampled times.
+
+        Returns:
+            Dict with the maximum absolute error per stored feature group and over the whole frame.
+        """
+        reference = torch.vstack(
+            [
+                torch.tensor(
+                    self.load_motion_file(motion_file)[0][:, self.frame_schema.source_columns],
+                    dtype=torch.float32,
+                    device=self.device,
+                )
+                for motion_file in self.motion_files
+            ]
+        )
+        if self.mirror_motions == "stored":
+            columns, signs = self.stored_mirror_columns_and_signs()
+            reference = torch.cat([reference, reference[:, columns] * signs])
+        traj_idxs = self.weighted_traj_idx_sample_batch(num_samples)
+        times = self.traj_time_sample_batch(traj_idxs)
+        idx_low, idx_high, blend = self.get_packed_frame_idx_batch(traj_idxs, times)
+        frames = self.get_full_frame_at_packed_idx_batch(idx_low, idx_high, blend)
+        reference_frames = self.blend_full_frame_batch(reference[idx_low], reference[idx_high], blend)
+        error = torch.abs(frames - reference_frames)
+        errors = {name: self.get_feature_batch(error, name).max().item() for name in self.frame_schema.group_names}
+        errors["max"] = error.max().item()
+        return errors
+
+    def get_feature_batch(self, frames, name):
+        """Returns the columns of a feature group of stored frames, as a view."""
+        return frames[..., self.frame_schema.slice(name)]
+
+    def check_amp_observations(self):
+        """Raises a ValueError if the stored feature groups do not cover AMP observations."""
+        if self.amp_observation_columns is None:
+            raise ValueError(
+                f"AMP observations need the feature groups {list(AMPLoader.AMP_OBSERVATION_GROUPS)}, but this"
+                f" reset-only loader stores {list(self.frame_schema.group_names)}."
+            )
+
     @property
     def observation_dim(self):
         """Size of AMP observations."""
-        return self.trajectories[0].shape[1] + 1
+        self.check_amp_observations()
+        return len(self.amp_observation_columns)
 
     @property
     def num_motions(self):
@@ -432,3 +1145,23 @@ class AMPLoader:
     @staticmethod
     def get_tar_toe_vel_local_batch(poses):
         return poses[:, AMPLoader.TAR_TOE_VEL_LOCAL_START_IDX : AMPLoader.TAR_TOE_VEL_LOCAL_END_IDX]
+
+
+@contextlib.contextmanager
+def _entry_script_hidden():
+    """Hides the entry script from the worker processes started in the context.
+
+    Workers that are not forked from this process import the entry script of the parent again, and training scripts
+    launch the simulator when imported.
+    """
+    main_module = sys.modules["__main__"]
+    if not hasattr(main_module, "__file__"):
+        yield
+        return
+    main_file, main_spec = main_module.__file__, main_module.__spec__
+    del main_module.__file__
+    main_module.__spec__ = None
+    try:
+        yield
+    finally:
+        main_module.__file__, main_module.__spec__ = main_file, main_spec
@@ -0,0 +1,259 @@
+"""Expert motion source that streams clips from sharded archives.
+
+A shard is either a tar archive of JSON motion files, in the format read by :class:`AMPLoader`, or an ``.npz`` file
+written by :func:`write_npz_shard`. Shards are decoded on worker threads and their clips rotate through a fixed-size
+reservoir, so the corpus can be much larger than memory and training starts once the reservoir is filled.
+"""
+
+import collections
+import glob
+import numpy as np
+import os
+import queue
+import tarfile
+import threading
+import torch
+from concurrent.futures import ThreadPoolExecutor
+
+from robot_lab.third_party.rsl_rl_amp.datasets.motion_ingest import write_npz_shard  # noqa: F401
+from robot_lab.third_party.rsl_rl_amp.datasets.motion_loader import AMPLoader
+
+# Marks the end of the stream in the clip queue, once a corpus that fits in the reservoir has been read.
+_END = object()
+
+
+def find_shards(shard_dir):
+    """Returns the sorted paths of the tar and npz shards in a directory."""
+    patterns = ["*.tar", "*.tar.gz", "*.tgz", "*.npz"]
+    return sorted(path for pattern in patterns for path in glob.glob(os.path.join(shard_dir, pattern)))
+
+
+def read_shard(shard_path, reorder_from_pybullet=False):
+    """Decodes a shard.
+
+    Returns:
+        A list of tuples (name, frames, weight, frame_duration), one per clip, with the normalized frames cut to
+        the columns stored by :class:`AMPLoader`.
+    """
+    clips = []
+    if shard_path.endswith(".npz"):
+        with np.load(shard_path) as shard:
+            frame_offsets = np.concatenate([[0], np.cumsum(shard["num_frames"])])
+            names = shard["names"] if "names" in shard else np.arange(len(shard["num_frames"])).astype(str)
+            frames = shard["frames"]
+            for i, name in enumerate(names):
+                clips.append(
+                    (
+                        f"{shard_path}:{name}",
+                        frames[frame_offsets[i] : frame_offsets[i + 1]],
+                        float(shard["weights"][i]),
+                        float(shard["frame_durations"][i]),
+                    )
+                )
+    else:
+        with tarfile.open(shard_path) as shard:
+            for member in shard:
+                if not member.isfile():
+                    continue
+                motion_data, motion_weight, frame_duration = AMPLoader.parse_motion_file(
+                    shard.extractfile(member).read()
+                )
+                motion_data = AMPLoader.normalize_motion_data(motion_data)
+                clips.append((f"{shard_path}:{member.name}", motion_data, motion_weight, frame_duration))
+
+    if reorder_from_pybullet:
+        clips = [
+            (name, frames[:, AMPLoader.pybullet_to_isaac_columns(frames.shape[1])], motion_weight, frame_duration)
+            for name, frames, motion_weight, frame_duration in clips
+        ]
+    source_columns = AMPLoader.FRAME_SCHEMA.select(AMPLoader.DEFAULT_FEATURE_GROUPS).source_columns
+    return [
+        (name, np.ascontiguousarray(frames[:, source_columns]), motion_weight, frame_duration)
+        for name, frames, motion_weight, frame_duration in clips
+    ]
+
+
+class StreamingMotionLoader(AMPLoader):
+    """Expert dataset that samples AMP transitions from a rolling reservoir of streamed clips.
+
+    The clips of the reservoir are packed into the library of :class:`AMPLoader` and sampled by time, exactly as
+    an eager loader without preloaded transitions. Each call to :meth:`feed_forward_generator` first replaces up to
+    ``refresh_clips`` random clips of the reservoir with newly decoded ones. Shards are read in a new random order on
+    every pass. A corpus that fits in the reservoir is read once and then stays resident.
+    """
+
+    def __init__(
+        self,
+        device,
+        time_between_frames,
+        shard_dir,
+        reservoir_clips=256,
+        refresh_clips=32,
+        num_workers=4,
+        seed=None,
+        storage_dtype=torch.float32,
+        reorder_from_pybullet=False,
+    ):
+        """
+        device: Device of the packed reservoir.
+        time_between_frames: Amount of time in seconds between transition.
+        shard_dir: Directory of the tar and npz shards.
+        reservoir_clips: Number of clips kept in memory.
+        refresh_clips: Maximum number of clips replaced per refresh. Only clips that are already decoded are used,
+            so a refresh never waits for the workers.
+        num_workers: Number of threads that decode shards.
+        seed: Seed of the batch sampling, shard order and reservoir replacement. Defaults to the initial seed of
+            torch.
+        storage_dtype: Dtype of the stored clips (or its name). Frames are upcast to float32 when gathered.
+        reorder_from_pybullet: Reorder legs of the clips from PyBullet to IsaacGym order when decoded.
+        """
+        self.device = device
+        self.time_between_frames = time_between_frames
+        self.shard_paths = find_shards(shard_dir)
+        if not self.shard_paths:
+            raise ValueError(f"No motion shards found in {shard_dir}.")
+        self.storage_dtype = getattr(torch, storage_dtype) if isinstance(storage_dtype, str) else storage_dtype
+        self.reorder_from_pybullet = reorder_from_pybullet
+        self.reservoir_clips = reservoir_clips
+        self.refresh_clips = min(refresh_clips, reservoir_clips)
+        seed = torch.initial_seed() if seed is None else seed
+        self.generator = torch.Generator(device=device)
+        self.generator.manual_seed(seed)
+        self.rng = np.random.default_rng(seed)
+
+        # The sampling paths of AMPLoader that are not used by a streamed library.
+        self.motion_cache_dir = None
+        self.lazy_load = False
+        self.preload_transitions = False
+        self.compact_preload = False
+        self.num_preloaded_transitions = 0
+        self.precompute_amp_observations = False
+        self.build_reset_table = False
+        self.reset_table = None
+        self.mirror_motions = None
+        self.file_schema = AMPLoader.FRAME_SCHEMA
+        self.frame_schema = AMPLoader.FRAME_SCHEMA.select(AMPLoader.DEFAULT_FEATURE_GROUPS)
+
+        self.reservoir = []
+        self.num_received_clips = 0
+        self.num_refreshes = 0
+        self.stream_exhausted = False
+        # Decoded clips waiting for a refresh. Decoding stalls while the queue is full.
+        self.clip_queue = queue.Queue(maxsize=max(1, 2 * self.refresh_clips))
+        self.closed = threading.Event()
+        self.dispatcher = threading.Thread(
+            target=self._dispatch, args=(num_workers, np.random.default_rng(seed + 1)), daemon=True
+        )
+        self.dispatcher.start()
+
+        # Training starts as soon as the reservoir is full, or the whole corpus is in it.
+        while len(self.reservoir) < reservoir_clips:
+            clip = self.clip_queue.get()
+            if clip is _END:
+                self.stream_exhausted = True
+                break
+            if isinstance(clip, BaseException):
+                raise clip
+            self.reservoir.append(clip)
+            self.num_received_clips += 1
+        self.build_reservoir_library()
+        print(f"Streaming {len(self.reservoir)} motion clips from {len(self.shard_paths)} shards in {shard_dir}.")
+
+    def _dispatch(self, num_workers, rng):
+        """Decodes the shards in passes of random order, with at most a few shards in flight."""
+        try:
+            with ThreadPoolExecutor(num_workers) as executor:
+                num_pass_clips = 0
+                while not self.closed.is_set():
+                    pending = collections.deque()
+                    shard_paths = [self.shard_paths[i] for i in rng.permutation(len(self.shard_paths))]
+                    for shard_path in shard_paths:
+                        pending.append(executor.submit(read_shard, shard_path, self.reorder_from_pybullet))
+                        if len(pending) > num_workers:
+                            num_pass_clips += self._put_clips(pending.popleft().result())
+                    while pending:
+                        num_pass_clips += self._put_clips(pending.popleft().result())
+                    if num_pass_clips <= self.reservoir_clips:
+                        # The whole corpus is held by the reservoir, there is nothing left to stream.
+                        self._put(_END)
+                        return
+                    num_pass_clips = 0
+        except BaseException as e:
+            self._put(e)
+
+    def _put_clips(self, clips):
+        for clip in clips:
+            self._put(clip)
+        return len(clips)
+
+    def _put(self, item):
+        while not self.closed.is_set():
+            try:
+                self.clip_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def refresh(self):
+        """Replaces up to refresh_clips random clips of the reservoir with decoded ones and repacks the library.
+
+        Returns:
+            The number of replaced clips.
+        """
+        if self.stream_exhausted:
+            return 0
+        new_clips = []
+        while len(new_clips) < self.refresh_clips:
+            try:
+                clip = self.clip_queue.get_nowait()
+            except queue.Empty:
+                break
+            if clip is _END:
+                self.stream_exhausted = True
+                break
+            if isinstance(clip, BaseException):
+                raise clip
+            new_clips.append(clip)
+        if not new_clips:
+            return 0
+        for slot, clip in zip(self.rng.choice(len(self.reservoir), len(new_clips), replace=False), new_clips):
+            self.reservoir[slot] = clip
+        self.num_received_clips += len(new_clips)
+        self.num_refreshes += 1
+        self.build_reservoir_library()
+        return len(new_clips)
+
+    def build_reservoir_library(self):
+        """Packs the clips of the reservoir into the library sampled by AMPLoader."""
+        self.trajectory_names = [name for name, _, _, _ in self.reservoir]
+        self.trajectory_idxs = list(range(len(self.reservoir)))
+        self.trajectory_weights = np.array([motion_weight for _, _, motion_weight, _ in self.reservoir])
+        self.trajectory_weights = self.trajectory_weights / np.sum(self.trajectory_weights)
+        self.trajectory_frame_durations = np.array([frame_duration for _, _, _, frame_duration in self.reservoir])
+        self.trajectory_num_frames = np.array([float(frames.shape[0]) for _, frames, _, _ in self.reservoir])
+        self.trajectory_lens = (self.trajectory_num_frames - 1) * self.trajectory_frame_durations
+        self.all_trajectories_full = torch.tensor(
+            np.concatenate([frames for _, frames, _, _ in self.reservoir]), dtype=self.storage_dtype
+        ).to(self.device)
+        self.index_library()
+
+    def feed_forward_generator(self, num_mini_batch, mini_batch_size, history_length=1):
+        """Refreshes the reservoir, then generates batches of AMP transitions from it."""
+        self.refresh()
+        yield from super().feed_forward_generator(num_mini_batch, mini_batch_size, history_length)
+
+    def close(self):
+        """Stops decoding shards."""
+        self.closed.set()
+        self.dispatcher.join()
+
+    @property
+    def stats(self):
+        """Dict with the number of received clips and refreshes, the decoded clips waiting in the queue and whether
+        the stream is exhausted."""
+        return {
+            "received_clips": self.num_received_clips,
+            "refreshes": self.num_refreshes,
+            "queued_clips": self.clip_queue.qsize(),
+            "stream_exhausted": self.stream_exhausted,
+        }
@@ -42,6 +42,19 @@ def standardize_quaternion(q):
     return q
 
 
+def standardize_quaternion_batch(q):
+    """Returns quaternions where q.w >= 0 to remove redundancy due to q = -q.
+
+    Args:
+      q: Quaternions to be standardized, shape (N, 4).
+
+    Returns:
+      Quaternions with q.w >= 0.
+
+    """
+    return np.where(q[:, -1:] < 0, -q, q)
+
+
 def normalize_rotation_angle(theta):
     """Returns a rotation angle normalized between [-pi, pi].
 
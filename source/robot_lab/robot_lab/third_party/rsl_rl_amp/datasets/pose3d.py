@@ -101,6 +101,25 @@ def QuaternionNormalize(q):
     return q / q_norm
 
 
+def QuaternionNormalizeBatch(q):
+    """Normalizes a batch of quaternions to length 1.
+
+    Args:
+      q: Quaternions to be normalized, shape (N, 4).
+
+    Raises:
+      ValueError: If any input quaternion has length near zero.
+
+    Returns:
+      Quaternions with magnitude 1 in a numpy array of shape (N, 4) [x, y, z, w].
+
+    """
+    q_norm = np.linalg.norm(q, axis=-1, keepdims=True)
+    if np.any(np.isclose(q_norm, 0.0)):
+        raise ValueError("Quaternion may not be zero in QuaternionNormalizeBatch")
+    return q / q_norm
+
+
 def QuaternionFromAxisAngle(axis, angle):
     """Returns a quaternion that generates the given axis-angle rotation.
 
@@ -0,0 +1,178 @@
+"""Motion libraries shared between the training processes of one node.
+
+The first process publishes the tensors of its library as raw files under a key, in a directory that is
+preferably on a tmpfs such as /dev/shm. Other processes with the same key map these files instead of building their
+own copy, so that the node holds a single copy per distinct library in host memory. Tensors that a process moves to
+a GPU are copied, so device memory is not shared.
+
+Processes hold a library while they use it, see :func:`hold`. The last process to :func:`release` it removes its
+files. Libraries of processes that exited without releasing them are removed by :func:`purge`.
+"""
+
+import contextlib
+import fcntl
+import glob
+import hashlib
+import json
+import numpy as np
+import os
+import re
+import shutil
+import torch
+
+# Bump when the published layout changes.
+LIBRARY_VERSION = 1
+
+
+def library_key(motion_files, **options):
+    """Returns the key of a library built from the given motion files and loader options.
+
+    Args:
+      motion_files: Paths of the motion files, in loading order. Their content is hashed.
+      options: Loader options that change the published tensors.
+
+    Returns:
+      A hex digest identifying the library.
+    """
+    digest = hashlib.sha256(f"v{LIBRARY_VERSION}".encode())
+    for motion_file in motion_files:
+        with open(motion_file, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    digest.update(repr(sorted(options.items())).encode())
+    return digest.hexdigest()
+
+
+def _open_locked(library_dir, file_name, operation):
+    """Opens a lock file of a library directory and locks it with the flock operation.
+
+    Retries if the lock file was removed by :func:`release` while waiting for the lock, so that all processes lock the
+    same file. Raises BlockingIOError if the operation is non-blocking and the lock is held.
+    """
+    path = os.path.join(library_dir, file_name)
+    while True:
+        f = open(path, "a")
+        try:
+            fcntl.flock(f, operation)
+            if os.path.exists(path) and os.path.samestat(os.fstat(f.fileno()), os.stat(path)):
+                return f
+        except BaseException:
+            f.close()
+            raise
+        f.close()
+
+
+@contextlib.contextmanager
+def lock(library_dir, key):
+    """Holds an exclusive lock on a library key, across processes."""
+    os.makedirs(library_dir, exist_ok=True)
+    with _open_locked(library_dir, f"{key}.lock", fcntl.LOCK_EX):
+        yield
+
+
+def hold(library_dir, key):
+    """Marks a published library as in use by this process, until :func:`release`.
+
+    Holds are shared locks on a separate ``.hold`` file, so they do not block other processes building or attaching
+    the library under :func:`lock`.
+
+    Returns:
+      The handle to pass to :func:`release`.
+    """
+    return _open_locked(library_dir, f"{key}.hold", fcntl.LOCK_SH)
+
+
+def _remove(library_dir, key):
+    """Removes a library and its lock files if no process holds or builds it.
+
+    Returns:
+      Whether the library was removed.
+    """
+    try:
+        with _open_locked(library_dir, f"{key}.lock", fcntl.LOCK_EX | fcntl.LOCK_NB):
+            with _open_locked(library_dir, f"{key}.hold", fcntl.LOCK_EX | fcntl.LOCK_NB):
+                shutil.rmtree(os.path.join(library_dir, key), ignore_errors=True)
+                for path in glob.glob(os.path.join(library_dir, f"{key}.*.tmp")):
+                    shutil.rmtree(path, ignore_errors=True)
+                # The build lock goes last, processes that wait on it retry on the new file.
+                os.remove(os.path.join(library_dir, f"{key}.hold"))
+                os.remove(os.path.join(library_dir, f"{key}.lock"))
+    except BlockingIOError:
+        return False
+    return True
+
+
+def release(library_dir, key, handle):
+    """Releases a library held by this process, and removes its files if no other process holds it.
+
+    The mappings of the library stay valid after its files are removed.
+
+    Returns:
+      Whether the library was removed.
+    """
+    handle.close()
+    return _remove(library_dir, key)
+
+
+def purge(library_dir):
+    """Removes the libraries of a directory that no process holds, e.g. those left by processes that crashed.
+
+    Returns:
+      The keys of the removed libraries.
+    """
+    names = os.listdir(library_dir) if os.path.isdir(library_dir) else []
+    # Other files of the directory are left alone.
+    keys = sorted({name.split(".")[0] for name in names if re.fullmatch(r"[0-9a-f]{64}", name.split(".")[0])})
+    return [key for key in keys if _remove(library_dir, key)]
+
+
+def publish(library_dir, key, tensors):
+    """Publishes the tensors of a library.
+
+    The files are written to a temporary directory that is renamed, so processes never attach partial libraries.
+
+    Args:
+      library_dir: Directory holding the shared libraries.
+      key: Library key returned by :func:`library_key`.
+      tensors: Dict of tensors to publish, by name.
+    """
+    tmp_dir = os.path.join(library_dir, f"{key}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    index = {}
+    for name, tensor in tensors.items():
+        tensor = tensor.detach().cpu().contiguous()
+        index[name] = {"dtype": str(tensor.dtype).removeprefix("torch."), "shape": list(tensor.shape)}
+        tensor.reshape(-1).view(torch.uint8).numpy().tofile(os.path.join(tmp_dir, f"{name}.bin"))
+    with open(os.path.join(tmp_dir, "index.json"), "w") as f:
+        json.dump(index, f)
+    # Drop leftovers of an interrupted publish; callers hold the lock and found no published library.
+    shutil.rmtree(os.path.join(library_dir, key), ignore_errors=True)
+    os.replace(tmp_dir, os.path.join(library_dir, key))
+
+
+def attach(library_dir, key):
+    """Maps the tensors of a published library.
+
+    The files are mapped copy-on-write: pages are shared with the other processes, and writes stay private.
+
+    Args:
+      library_dir: Directory holding the shared libraries.
+      key: Library key returned by :func:`library_key`.
+
+    Returns:
+      A dict of CPU tensors by name, or None if the library is not published.
+    """
+    path = os.path.join(library_dir, key)
+    if not os.path.isfile(os.path.join(path, "index.json")):
+        return None
+    with open(os.path.join(path, "index.json")) as f:
+        index = json.load(f)
+    tensors = {}
+    for name, entry in index.items():
+        dtype = getattr(torch, entry["dtype"])
+        if np.prod(entry["shape"]) == 0:
+            tensors[name] = torch.empty(entry["shape"], dtype=dtype)
+            continue
+        data = np.memmap(os.path.join(path, f"{name}.bin"), dtype=np.uint8, mode="c")
+        tensors[name] = torch.from_numpy(data).view(dtype).view(entry["shape"])
+    return tensors
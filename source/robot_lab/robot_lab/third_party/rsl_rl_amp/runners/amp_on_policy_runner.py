@@ -17,6 +17,8 @@ from rsl_rl.modules import ActorCritic, ActorCriticRecurrent, EmpiricalNormaliza
 from robot_lab.third_party.rsl_rl_amp.algorithms import AMPPPO
 from robot_lab.third_party.rsl_rl_amp.algorithms.amp_discriminator import AMPDiscriminator
 from robot_lab.third_party.rsl_rl_amp.datasets.motion_loader import AMPLoader
+from robot_lab.third_party.rsl_rl_amp.datasets.motion_stream import StreamingMotionLoader
+from robot_lab.third_party.rsl_rl_amp.storage.replay_buffer_file import ReplayBufferFile
 from rsl_rl.utils import store_code_state
 from robot_lab.third_party.rsl_rl_amp.utils.amp_utils import Normalizer
 
@@ -44,16 +46,62 @@ class AmpOnPolicyRunner:
         ).to(self.device)
 
         self.alg_cfg["amp_replay_buffer_size"] = self.env.unwrapped.cfg.amp_replay_buffer_size
-        amp_data = AMPLoader(
-            device=self.device,
-            motion_files=self.env.unwrapped.cfg.amp_motion_files,
-            time_between_frames=self.env.unwrapped.cfg.sim.dt * self.env.unwrapped.cfg.sim.render_interval,
-            preload_transitions=True,
-            num_preload_transitions=self.env.unwrapped.cfg.amp_num_preload_transitions,
-        )
+        self.alg_cfg["amp_replay_buffer_layout"] = self.env.unwrapped.cfg.amp_replay_buffer_layout
+        self.alg_cfg["amp_replay_buffer_dtype"] = self.env.unwrapped.cfg.amp_replay_buffer_dtype
+        self.alg_cfg["amp_replay_buffer_host_size"] = self.env.unwrapped.cfg.amp_replay_buffer_host_size
+        self.alg_cfg["amp_history_length"] = self.env.unwrapped.cfg.amp_history_length
+        self.alg_cfg["amp_prefetch_batches"] = self.env.unwrapped.cfg.amp_prefetch_batches
+        self.alg_cfg["amp_discr_schedule"] = self.env.unwrapped.cfg.amp_discr_schedule
+        self.alg_cfg["amp_discr_learning_rate"] = self.env.unwrapped.cfg.amp_discr_learning_rate
+        self.alg_cfg["amp_discr_batch_size"] = self.env.unwrapped.cfg.amp_discr_batch_size
+        self.alg_cfg["amp_discr_steps"] = self.env.unwrapped.cfg.amp_discr_steps
+        self.alg_cfg["amp_discr_update_interval"] = self.env.unwrapped.cfg.amp_discr_update_interval
+        if self.env.unwrapped.cfg.amp_motion_shard_dir is not None:
+            # Options of the eager loader that a streamed library does not implement.
+            unsupported_options = {
+                "amp_mirror_motions": self.env.unwrapped.cfg.amp_mirror_motions is not None,
+                "amp_precompute_observations": self.env.unwrapped.cfg.amp_precompute_observations,
+                "amp_compact_preload_transitions": self.env.unwrapped.cfg.amp_compact_preload_transitions,
+                "amp_feature_groups": (
+                    self.env.unwrapped.cfg.amp_feature_groups is not None
+                    and tuple(self.env.unwrapped.cfg.amp_feature_groups) != AMPLoader.DEFAULT_FEATURE_GROUPS
+                ),
+            }
+            unsupported_options = [name for name, is_set in unsupported_options.items() if is_set]
+            if unsupported_options:
+                raise ValueError(
+                    f"Streaming motion shards from amp_motion_shard_dir does not support {unsupported_options}, disable"
+                    " them or load amp_motion_files instead."
+                )
+            amp_data = StreamingMotionLoader(
+                device=self.device,
+                time_between_frames=self.env.unwrapped.cfg.sim.dt * self.env.unwrapped.cfg.sim.render_interval,
+                shard_dir=self.env.unwrapped.cfg.amp_motion_shard_dir,
+                reservoir_clips=self.env.unwrapped.cfg.amp_stream_reservoir_clips,
+                refresh_clips=self.env.unwrapped.cfg.amp_stream_refresh_clips,
+                num_workers=self.env.unwrapped.cfg.amp_stream_num_workers,
+                storage_dtype=self.env.unwrapped.cfg.amp_storage_dtype,
+            )
+        else:
+            amp_data = AMPLoader(
+                device=self.device,
+                motion_files=self.env.unwrapped.cfg.amp_motion_files,
+                time_between_frames=self.env.unwrapped.cfg.sim.dt * self.env.unwrapped.cfg.sim.render_interval,
+                preload_transitions=True,
+                num_preload_transitions=self.env.unwrapped.cfg.amp_num_preload_transitions,
+                compact_preload=self.env.unwrapped.cfg.amp_compact_preload_transitions,
+                motion_cache_dir=self.env.unwrapped.cfg.amp_motion_cache_dir,
+                storage_dtype=self.env.unwrapped.cfg.amp_storage_dtype,
+                num_ingest_workers=self.env.unwrapped.cfg.amp_num_ingest_workers,
+                clip_cache_bytes=self.env.unwrapped.cfg.amp_clip_cache_bytes,
+                precompute_amp_observations=self.env.unwrapped.cfg.amp_precompute_observations,
+                shared_library_dir=self.env.unwrapped.cfg.amp_shared_library_dir,
+                mirror_motions=self.env.unwrapped.cfg.amp_mirror_motions,
+                feature_groups=self.env.unwrapped.cfg.amp_feature_groups,
+            )
         amp_normalizer = Normalizer(amp_data.observation_dim)
         discriminator = AMPDiscriminator(
-            amp_data.observation_dim * 2,
+            amp_data.observation_dim * 2 * self.env.unwrapped.cfg.amp_history_length,
             self.cfg["amp_reward_coef"],
             self.cfg["amp_discr_hidden_dims"],
             device,
@@ -92,6 +140,9 @@ class AmpOnPolicyRunner:
         # store training configuration
         self.num_steps_per_env = self.cfg["num_steps_per_env"]
         self.save_interval = self.cfg["save_interval"]
+        # Persist the AMP replay buffer in a side file next to the checkpoints, updated incrementally by each save.
+        self.save_amp_replay_buffer = self.env.unwrapped.cfg.amp_save_replay_buffer
+        self.amp_replay_buffer_file = None
         self.empirical_normalization = self.cfg["empirical_normalization"]
         if self.empirical_normalization:
             self.obs_normalizer = EmpiricalNormalization(shape=[num_obs], until=1.0e8).to(self.device)
@@ -201,8 +252,9 @@ class AmpOnPolicyRunner:
                     # Account for terminal states.
                     next_amp_obs_with_term = torch.clone(next_amp_obs)
                     next_amp_obs_with_term[reset_env_ids] = terminal_amp_states
+                    amp_state, amp_next_state = self.alg.get_amp_transition(amp_obs, next_amp_obs_with_term)
                     rewards = self.alg.discriminator.predict_amp_reward(
-                        amp_obs, next_amp_obs_with_term, rewards, normalizer=self.alg.amp_normalizer
+                        amp_state, amp_next_state, rewards, normalizer=self.alg.amp_normalizer
                     )[0]
                     amp_obs = torch.clone(next_amp_obs)
                     self.alg.process_env_step(rewards, dones, infos, next_amp_obs_with_term)
@@ -333,6 +385,9 @@ class AmpOnPolicyRunner:
         self.writer.add_scalar("Perf/total_fps", fps, locs["it"])
         self.writer.add_scalar("Perf/collection time", locs["collection_time"], locs["it"])
         self.writer.add_scalar("Perf/learning_time", locs["learn_time"], locs["it"])
+        for name, stats in self.alg.amp_prefetch_stats.items():
+            self.writer.add_scalar(f"Perf/amp_{name}_prefetch_stall_time", stats["stall_time"], locs["it"])
+            self.writer.add_scalar(f"Perf/amp_{name}_prefetch_queue_depth", stats["mean_queue_depth"], locs["it"])
 
         # -- Training
         if len(locs["rewbuffer"]) > 0:
@@ -415,6 +470,12 @@ class AmpOnPolicyRunner:
         print(log_string)
 
     def save(self, path: str, infos=None):
+        # -- Save AMP replay buffer if enabled, before the checkpoint that refers to it
+        if self.save_amp_replay_buffer:
+            amp_replay_buffer_path = os.path.join(os.path.dirname(path), "amp_replay_buffer")
+            if self.amp_replay_buffer_file is None or self.amp_replay_buffer_file.path != amp_replay_buffer_path:
+                self.amp_replay_buffer_file = ReplayBufferFile(amp_replay_buffer_path)
+            self.amp_replay_buffer_file.save(self.alg.amp_storage)
         # -- Save PPO model
         saved_dict = {
             "model_state_dict": self.alg.actor_critic.state_dict(),
@@ -424,6 +485,12 @@ class AmpOnPolicyRunner:
             "discriminator_state_dict": self.alg.discriminator.state_dict(),
             "amp_normalizer": self.alg.amp_normalizer,
         }
+        if self.save_amp_replay_buffer:
+            saved_dict["amp_replay_buffer_num_inserted"] = self.alg.amp_storage.num_inserted
+        # -- Save discriminator optimizer if decoupled from the policy one
+        if self.alg.discriminator_optimizer is not None:
+            saved_dict["discriminator_optimizer_state_dict"] = self.alg.discriminator_optimizer.state_dict()
+            saved_dict["amp_discr_update_count"] = self.alg.update_count
         # -- Save RND model if used
         if self.alg.rnd:
             saved_dict["rnd_state_dict"] = self.alg.rnd.state_dict()
@@ -456,10 +523,31 @@ class AmpOnPolicyRunner:
             # -- RND optimizer if used
             if self.alg.rnd:
                 self.alg.rnd_optimizer.load_state_dict(loaded_dict["rnd_optimizer_state_dict"])
+            # -- Discriminator optimizer if decoupled and saved
+            if self.alg.discriminator_optimizer is not None and "discriminator_optimizer_state_dict" in loaded_dict:
+                self.alg.discriminator_optimizer.load_state_dict(loaded_dict["discriminator_optimizer_state_dict"])
+                self.alg.update_count = loaded_dict["amp_discr_update_count"]
         # -- Load current learning iteration
         self.current_learning_iteration = loaded_dict["iter"]
         self.alg.discriminator.load_state_dict(loaded_dict["discriminator_state_dict"])
         self.alg.amp_normalizer = loaded_dict["amp_normalizer"]
+        # -- Load AMP replay buffer if saved with the checkpoint
+        if self.save_amp_replay_buffer and "amp_replay_buffer_num_inserted" in loaded_dict:
+            amp_replay_buffer_file = ReplayBufferFile(os.path.join(os.path.dirname(path), "amp_replay_buffer"))
+            if amp_replay_buffer_file.exists():
+                try:
+                    state = amp_replay_buffer_file.load(self.alg.amp_storage)
+                except ValueError as e:
+                    # Incomplete saves and buffers of another configuration are not restored.
+                    print(f"Could not load the AMP replay buffer ({e}), starting with an empty one.")
+                else:
+                    self.amp_replay_buffer_file = amp_replay_buffer_file
+                    if state["num_inserted"] != loaded_dict["amp_replay_buffer_num_inserted"]:
+                        print(
+                            f"The AMP replay buffer in {amp_replay_buffer_file.path} was saved with a later checkpoint."
+                        )
+            else:
+                print(f"No AMP replay buffer found in {amp_replay_buffer_file.path}, starting with an empty one.")
         return loaded_dict["infos"]
 
     def get_inference_policy(self, device=None):
@@ -473,6 +561,11 @@ class AmpOnPolicyRunner:
             policy = lambda x: self.alg.actor_critic.act_inference(self.obs_normalizer(x))  # noqa: E731
         return policy
 
+    def close(self):
+        """Closes the expert dataset, which stops the shard decoding of a streamed one and releases a shared
+        motion library."""
+        self.alg.amp_data.close()
+
     def train_mode(self):
         # -- PPO
         self.alg.actor_critic.train()
@@ -1 +1,2 @@
-from .replay_buffer import ReplayBuffer
+from .replay_buffer import FrameStreamReplayBuffer, PairReplayBuffer, ReplayBuffer
+from .replay_buffer_file import ReplayBufferFile
@@ -1,22 +1,26 @@
-import numpy as np
 import torch
 
 
 class ReplayBuffer:
     """Fixed-size buffer to store experience tuples."""
 
-    def __init__(self, obs_dim, buffer_size, device):
+    def __init__(self, obs_dim, buffer_size, device, generator=None):
         """Initialize a ReplayBuffer object.
         Arguments:
             buffer_size (int): maximum size of buffer
+            generator (torch.Generator): generator on the buffer device used to draw sample indices. The global
+                torch generator is used if None.
         """
-        self.states = torch.zeros(buffer_size, obs_dim).to(device)
-        self.next_states = torch.zeros(buffer_size, obs_dim).to(device)
+        self.states = torch.zeros(buffer_size, obs_dim, device=device)
+        self.next_states = torch.zeros(buffer_size, obs_dim, device=device)
         self.buffer_size = buffer_size
         self.device = device
+        self.generator = generator
 
         self.step = 0
         self.num_samples = 0
+        # Total number of inserted transitions, which tells a ReplayBufferFile the ring rows written since a save.
+        self.num_inserted = 0
 
     def insert(self, states, next_states):
         """Add new states to memory."""
@@ -35,8 +39,320 @@ class ReplayBuffer:
 
         self.num_samples = min(self.buffer_size, max(end_idx, self.num_samples))
         self.step = (self.step + num_states) % self.buffer_size
+        self.num_inserted += num_states
+
+    def ring_tensors(self):
+        """Returns the tensors of the ring by name, each with the ring index of its first row."""
+        return {"states": (self.states, 0), "next_states": (self.next_states, 0)}
+
+    def state_dict(self):
+        """Returns the ring position."""
+        return {"step": self.step, "num_samples": self.num_samples, "num_inserted": self.num_inserted}
+
+    def load_state_dict(self, state_dict):
+        self.step = state_dict["step"]
+        self.num_samples = state_dict["num_samples"]
+        self.num_inserted = state_dict["num_inserted"]
+
+    def sample_idxs(self, num_mini_batch, mini_batch_size):
+        """Draws the indices of all minibatches at once, uniformly with replacement, on the buffer device.
+
+        Returns:
+            A tensor of shape (num_mini_batch, mini_batch_size).
+        """
+        return torch.randint(
+            self.num_samples, (num_mini_batch, mini_batch_size), device=self.device, generator=self.generator
+        )
+
+    def feed_forward_generator(self, num_mini_batch, mini_batch_size):
+        """Yields minibatches of (states, next_states).
+
+        The minibatches of an update are gathered with one indexing operation and yielded as views into the result.
+        """
+        sample_idxs = self.sample_idxs(num_mini_batch, mini_batch_size)
+        states, next_states = self.states[sample_idxs], self.next_states[sample_idxs]
+        for i in range(num_mini_batch):
+            yield states[i], next_states[i]
+
+
+class PairReplayBuffer:
+    """Fixed-size buffer of (state, next_state) pairs, stored contiguously with shape (capacity, 2, obs_dim).
+
+    Sampled minibatches keep that layout, so that flattening them into discriminator inputs needs no copy. Pairs may
+    be stored in a reduced precision dtype, and are upcast to float32 when sampled.
+
+    The first buffer_size pairs of the ring live on the device. An optional overflow tier of host_buffer_size pairs
+    lives in host memory, pinned when the device is a GPU, for capacities that do not fit on the device. Inserted pairs
+    are copied to it asynchronously. Sampled pairs of the host tier are gathered on the host into a pinned staging
+    buffer and copied to the device asynchronously. CUDA events order the host accesses after these copies.
+    """
+
+    def __init__(self, obs_dim, buffer_size, device, dtype=torch.float32, host_buffer_size=0, generator=None):
+        """Initialize a PairReplayBuffer object.
+        Arguments:
+            buffer_size (int): number of pairs stored on the device
+            dtype (torch.dtype or str): dtype of the stored pairs, e.g. float16 or bfloat16
+            host_buffer_size (int): number of pairs stored in host memory after the device ones
+            generator (torch.Generator): generator on the buffer device used to draw sample indices. The global
+                torch generator is used if None.
+        """
+        self.dtype = getattr(torch, dtype) if isinstance(dtype, str) else dtype
+        self.pairs = torch.zeros(buffer_size, 2, obs_dim, dtype=self.dtype, device=device)
+        self.pin_memory = torch.device(device).type == "cuda"
+        self.host_pairs = torch.zeros(host_buffer_size, 2, obs_dim, dtype=self.dtype, pin_memory=self.pin_memory)
+        # Pinned buffer that sampled host pairs are gathered into, grown on demand.
+        self.host_staging = torch.zeros(0, 2, obs_dim, dtype=self.dtype, pin_memory=self.pin_memory)
+        # Events recorded after the last copy to the host tier and the last copy from the staging buffer.
+        self.host_write_event = None
+        self.host_staging_event = None
+        self.obs_dim = obs_dim
+        self.device_buffer_size = buffer_size
+        self.buffer_size = buffer_size + host_buffer_size
+        self.device = device
+        self.generator = generator
+
+        self.step = 0
+        self.num_samples = 0
+        self.num_inserted = 0
+
+    def insert(self, states, next_states):
+        """Add new states to memory."""
+        pairs = torch.stack([states, next_states], dim=1).to(self.dtype)
+        num_states = pairs.shape[0]
+        end_idx = self.step + num_states
+        if end_idx > self.buffer_size:
+            self._write(self.step, pairs[: self.buffer_size - self.step])
+            self._write(0, pairs[self.buffer_size - self.step :])
+        else:
+            self._write(self.step, pairs)
+
+        self.num_samples = min(self.buffer_size, max(end_idx, self.num_samples))
+        self.step = end_idx % self.buffer_size
+        self.num_inserted += num_states
+
+    def ring_tensors(self):
+        """Returns the tensors of the ring by name, each with the ring index of its first row."""
+        self.synchronize_host()
+        return {"pairs": (self.pairs, 0), "host_pairs": (self.host_pairs, self.device_buffer_size)}
+
+    def state_dict(self):
+        """Returns the ring position."""
+        return {"step": self.step, "num_samples": self.num_samples, "num_inserted": self.num_inserted}
+
+    def load_state_dict(self, state_dict):
+        self.step = state_dict["step"]
+        self.num_samples = state_dict["num_samples"]
+        self.num_inserted = state_dict["num_inserted"]
+
+    def _write(self, start_idx, pairs):
+        """Writes pairs at consecutive ring positions, which may span both tiers."""
+        num_device_pairs = max(0, min(len(pairs), self.device_buffer_size - start_idx))
+        self.pairs[start_idx : start_idx + num_device_pairs] = pairs[:num_device_pairs]
+        if num_device_pairs < len(pairs):
+            host_start_idx = start_idx + num_device_pairs - self.device_buffer_size
+            # Device to pinned host copies do not block, the event orders later host reads after them.
+            self.host_pairs[host_start_idx : host_start_idx + len(pairs) - num_device_pairs].copy_(
+                pairs[num_device_pairs:], non_blocking=True
+            )
+            self.host_write_event = self._record_event()
+
+    def _record_event(self):
+        """Returns an event recorded on the current CUDA stream, or None if the host tier is not pinned."""
+        if not self.pin_memory:
+            return None
+        event = torch.cuda.Event()
+        event.record()
+        return event
+
+    def synchronize_host(self):
+        """Waits for the pending asynchronous copies to and from host memory."""
+        for event in (self.host_write_event, self.host_staging_event):
+            if event is not None:
+                event.synchronize()
+        self.host_write_event = self.host_staging_event = None
+
+    def sample_idxs(self, num_mini_batch, mini_batch_size):
+        """Draws the indices of all minibatches at once, uniformly with replacement, on the buffer device.
+
+        Returns:
+            A tensor of shape (num_mini_batch, mini_batch_size).
+        """
+        return torch.randint(
+            self.num_samples, (num_mini_batch, mini_batch_size), device=self.device, generator=self.generator
+        )
+
+    def get_pairs(self, idxs):
+        """Returns the pairs at the given ring indices in float32 on the device, with shape idxs.shape + (2, obs_dim)."""
+        if self.num_samples <= self.device_buffer_size:
+            return self.pairs[idxs].float()
+        pairs = torch.empty(*idxs.shape, 2, self.obs_dim, dtype=self.dtype, device=self.device)
+        on_device = idxs < self.device_buffer_size
+        pairs[on_device] = self.pairs[idxs[on_device]]
+        host_idxs = (idxs[~on_device] - self.device_buffer_size).cpu()
+        # The host tier and the staging buffer are only accessed once their previous copies are done.
+        self.synchronize_host()
+        if len(host_idxs) > len(self.host_staging):
+            self.host_staging = torch.empty(
+                len(host_idxs), 2, self.obs_dim, dtype=self.dtype, pin_memory=self.pin_memory
+            )
+        staging = self.host_staging[: len(host_idxs)]
+        torch.index_select(self.host_pairs, 0, host_idxs, out=staging)
+        pairs[~on_device] = staging.to(self.device, non_blocking=True)
+        self.host_staging_event = self._record_event()
+        return pairs.float()
+
+    def feed_forward_generator(self, num_mini_batch, mini_batch_size):
+        """Yields minibatches of pairs with shape (mini_batch_size, 2, obs_dim).
+
+        The minibatches of an update are gathered at once and yielded as views into the result.
+        """
+        pairs = self.get_pairs(self.sample_idxs(num_mini_batch, mini_batch_size))
+        for i in range(num_mini_batch):
+            yield pairs[i]
+
+
+class FrameStreamReplayBuffer:
+    """Replay buffer that stores the AMP observation stream of each environment once, for multi-frame discriminators.
+
+    Row i of the ring holds the next AMP observations of all environments at one step, along with a marker of the
+    environments whose episode started at that row. A transition with history length H pairs the window of the H
+    frames ending at one frame, oldest first, with the window one step later. Windows are gathered from the stream by
+    index arithmetic when sampled, and are padded with the earliest available frame of the episode where they reach
+    past its start or the oldest stored row, so no frame is stored more than once.
+
+    The first transition of each episode starts from a reset observation that is not part of the stream, so it is
+    only seen by get_latest_transition and never sampled.
+    """
+
+    def __init__(self, frame_dim, num_envs, buffer_size, device, history_length=1, generator=None):
+        """Initialize a FrameStreamReplayBuffer object.
+        Arguments:
+            frame_dim (int): size of one AMP observation
+            buffer_size (int): maximum number of stored frames, rounded down to a multiple of num_envs
+            history_length (int): number of frames per window
+            generator (torch.Generator): generator on the buffer device used to draw sample indices. The global
+                torch generator is used if None.
+        """
+        self.num_rows = max(history_length + 1, buffer_size // num_envs)
+        self.frames = torch.zeros(self.num_rows, num_envs, frame_dim, device=device)
+        self.episode_starts = torch.zeros(self.num_rows, num_envs, dtype=torch.bool, device=device)
+        # Whether the previous step ended an episode, so that the current observations are reset observations.
+        self.last_dones = torch.ones(num_envs, dtype=torch.bool, device=device)
+        self.frame_dim = frame_dim
+        self.num_envs = num_envs
+        self.history_length = history_length
+        self.buffer_size = self.num_rows * num_envs
+        self.device = device
+        self.generator = generator
+
+        self.step = 0
+        self.num_steps = 0
+        self.num_inserted = 0
+
+    @property
+    def num_samples(self):
+        """Number of stored frames."""
+        return self.num_steps * self.num_envs
+
+    def insert(self, states, next_states, dones):
+        """Add the next observations of one step of all environments to the stream.
+
+        The observations before the step are part of the stream already, unless they are reset observations.
+        """
+        self.frames[self.step] = next_states
+        self.episode_starts[self.step] = self.last_dones
+        self.last_dones = dones.to(device=self.device, dtype=torch.bool)
+        self.num_steps = min(self.num_rows, self.num_steps + 1)
+        self.step = (self.step + 1) % self.num_rows
+        self.num_inserted += 1
+
+    def ring_tensors(self):
+        """Returns the tensors of the ring by name, each with the ring index of its first row."""
+        return {"frames": (self.frames, 0), "episode_starts": (self.episode_starts, 0)}
+
+    def state_dict(self):
+        """Returns the ring position."""
+        return {"step": self.step, "num_steps": self.num_steps, "num_inserted": self.num_inserted}
+
+    def load_state_dict(self, state_dict):
+        """Restores the ring position. The environments do not continue the saved stream, so the next inserted step
+        starts an episode in all of them."""
+        self.step = state_dict["step"]
+        self.num_steps = state_dict["num_steps"]
+        self.num_inserted = state_dict["num_inserted"]
+        self.last_dones = torch.ones(self.num_envs, dtype=torch.bool, device=self.device)
+
+    def _window_offsets(self, episode_starts, max_offsets):
+        """Returns how many frames back each frame of a window is read from, with shape (N, H + 1).
+
+        episode_starts (N, H + 1) marks the candidate frames 0, 1, ..., H steps back that begin their episode. Frames
+        before the first such one are replaced by it, and frames more than max_offsets (N,) back by that one.
+        """
+        offsets = torch.arange(self.history_length + 1, device=self.device)
+        first_starts = torch.where(episode_starts.any(dim=1), episode_starts.int().argmax(dim=1), self.history_length)
+        return torch.minimum(offsets, torch.minimum(first_starts, max_offsets).unsqueeze(1))
+
+    @staticmethod
+    def _split_windows(frames):
+        """Splits frames (N, H + 1, frame_dim), newest first, into flattened windows (s, s_next), oldest first."""
+        frames = frames.flip(1)
+        return frames[:, :-1].flatten(1), frames[:, 1:].flatten(1)
+
+    def get_latest_transition(self, states, next_states):
+        """Returns the windows (s, s_next) of the current step of all environments, before it is inserted."""
+        # Candidate frames, newest first: next_states, states, then the stream before states.
+        newest_row = self.step - 1
+        rows = (newest_row - torch.arange(1, self.history_length, device=self.device)) % self.num_rows
+        candidates = torch.cat([next_states.unsqueeze(1), states.unsqueeze(1), self.frames[rows].transpose(0, 1)], 1)
+        # states are the newest stream frame unless they are reset observations.
+        states_starts = self.last_dones | (self.episode_starts[newest_row] if self.num_steps > 0 else True)
+        episode_starts = torch.cat(
+            [
+                torch.zeros(self.num_envs, 1, dtype=torch.bool, device=self.device),
+                states_starts.unsqueeze(1),
+                self.episode_starts[rows].transpose(0, 1),
+            ],
+            dim=1,
+        )[:, : self.history_length + 1]
+        max_offsets = torch.full((self.num_envs,), max(1, self.num_steps), device=self.device)
+        offsets = self._window_offsets(episode_starts, max_offsets)
+        frames = candidates[torch.arange(self.num_envs, device=self.device).unsqueeze(1), offsets]
+        return self._split_windows(frames)
+
+    def sample_idxs(self, num_mini_batch, mini_batch_size):
+        """Draws the (age, env) indices of the last frames of all minibatch transitions at once.
+
+        Ages count steps back from the newest row. Only frames whose previous frame is stored and in the same
+        episode end a transition.
+
+        Returns:
+            A tuple of tensors (ages, envs) of shape (num_mini_batch, mini_batch_size).
+        """
+        ages = torch.arange(max(0, self.num_steps - 1), device=self.device)
+        valid = ~self.episode_starts[(self.step - 1 - ages) % self.num_rows]
+        valid_idxs = valid.flatten().nonzero().squeeze(1)
+        choices = torch.randint(
+            len(valid_idxs), (num_mini_batch, mini_batch_size), device=self.device, generator=self.generator
+        )
+        return torch.div(valid_idxs[choices], self.num_envs, rounding_mode="floor"), valid_idxs[choices] % self.num_envs
+
+    def get_transitions(self, ages, envs):
+        """Returns the windows (s, s_next) of the transitions ending at the frames of the given ages and envs."""
+        ages, envs = ages.flatten(), envs.flatten()
+        offsets = torch.arange(self.history_length + 1, device=self.device)
+        rows = (self.step - 1 - ages.unsqueeze(1) - offsets) % self.num_rows
+        offsets = self._window_offsets(self.episode_starts[rows, envs.unsqueeze(1)], self.num_steps - 1 - ages)
+        frames = self.frames[(self.step - 1 - ages.unsqueeze(1) - offsets) % self.num_rows, envs.unsqueeze(1)]
+        return self._split_windows(frames)
 
     def feed_forward_generator(self, num_mini_batch, mini_batch_size):
-        for _ in range(num_mini_batch):
-            sample_idxs = np.random.choice(self.num_samples, size=mini_batch_size)
-            yield (self.states[sample_idxs].to(self.device), self.next_states[sample_idxs].to(self.device))
+        """Yields minibatches of windows (s, s_next), each with shape (mini_batch_size, history_length * frame_dim).
+
+        The minibatches of an update are gathered at once and yielded as views into the result.
+        """
+        ages, envs = self.sample_idxs(num_mini_batch, mini_batch_size)
+        states, next_states = self.get_transitions(ages, envs)
+        states = states.view(num_mini_batch, mini_batch_size, -1)
+        next_states = next_states.view(num_mini_batch, mini_batch_size, -1)
+        for i in range(num_mini_batch):
+            yield states[i], next_states[i]
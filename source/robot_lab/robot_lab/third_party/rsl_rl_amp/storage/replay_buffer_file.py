@@ -0,0 +1,133 @@
+"""Memory-mapped side files that persist AMP replay buffers across checkpoints.
+
+A side file is a directory with one raw file per ring tensor of the buffer and an ``index.json`` holding their
+layout and the ring position. Saves write only the ring rows inserted since the previous save, and loads copy the
+mapped files into the buffer a chunk at a time, so neither holds a second copy of the buffer in memory.
+"""
+
+import json
+import numpy as np
+import os
+import torch
+
+# Bump when the layout of the side files changes.
+FILE_VERSION = 1
+
+# Number of bytes copied at once between a mapped file and a buffer tensor.
+_CHUNK_BYTES = 2**26
+
+
+class ReplayBufferFile:
+    """Side file of a replay buffer that exposes ring_tensors, state_dict and load_state_dict.
+
+    The file holds the buffer as of its latest save. It remembers the number of transitions of the buffer it last
+    saved or loaded, so the next save of the same buffer only writes the ring rows inserted since then, in at most two
+    contiguous segments. The index is marked incomplete while rows are written, so a save interrupted halfway is never
+    loaded.
+    """
+
+    def __init__(self, path):
+        """
+        path: Directory of the side file.
+        """
+        self.path = path
+        # num_inserted of the buffer when its ring matched the file, None until the first save or load.
+        self.synced_num_inserted = None
+
+    def exists(self):
+        return os.path.isfile(os.path.join(self.path, "index.json"))
+
+    def _read_index(self):
+        with open(os.path.join(self.path, "index.json")) as f:
+            return json.load(f)
+
+    def _write_index(self, index):
+        tmp_path = os.path.join(self.path, f"index.json.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(self.path, "index.json"))
+
+    @staticmethod
+    def _layout(buffer):
+        return {
+            name: {"dtype": str(tensor.dtype).removeprefix("torch."), "shape": list(tensor.shape), "offset": offset}
+            for name, (tensor, offset) in buffer.ring_tensors().items()
+        }
+
+    def _map(self, name, tensor, mode):
+        """Maps the file of a ring tensor as bytes, with one row per ring row."""
+        return np.memmap(
+            os.path.join(self.path, f"{name}.bin"),
+            dtype=np.uint8,
+            mode=mode,
+            shape=(len(tensor), tensor[0].numel() * tensor.element_size()),
+        )
+
+    def save(self, buffer):
+        """Writes the ring rows of the buffer inserted since the last save or load, or the whole ring if the file does
+        not hold an earlier state of this buffer."""
+        layout = self._layout(buffer)
+        num_rows = max(entry["offset"] + entry["shape"][0] for entry in layout.values())
+        state = buffer.state_dict()
+        num_new_rows = None if self.synced_num_inserted is None else state["num_inserted"] - self.synced_num_inserted
+        if num_new_rows is not None:
+            index = self._read_index() if self.exists() else None
+            if index is None or index["version"] != FILE_VERSION or index["layout"] != layout or not index["complete"]:
+                num_new_rows = None
+        if num_new_rows is None or not 0 <= num_new_rows < num_rows:
+            # Rewrite the whole ring into fresh files.
+            os.makedirs(self.path, exist_ok=True)
+            self._write_index({"version": FILE_VERSION, "layout": layout, "state": state, "complete": False})
+            for name, (tensor, _) in buffer.ring_tensors().items():
+                with open(os.path.join(self.path, f"{name}.bin"), "wb") as f:
+                    f.truncate(tensor.numel() * tensor.element_size())
+            segments = [(0, num_rows)]
+        else:
+            self._write_index({"version": FILE_VERSION, "layout": layout, "state": state, "complete": False})
+            start = (state["step"] - num_new_rows) % num_rows
+            end = start + num_new_rows
+            segments = [(start, min(end, num_rows)), (0, max(0, end - num_rows))]
+
+        for name, (tensor, offset) in buffer.ring_tensors().items():
+            if tensor.numel() == 0:
+                continue
+            data = self._map(name, tensor, "r+")
+            chunk_rows = max(1, _CHUNK_BYTES // data.shape[1])
+            for start, end in segments:
+                # Rows of the segment that belong to this tensor, in its own row indices.
+                start, end = max(start - offset, 0), min(end - offset, len(tensor))
+                for chunk_start in range(start, end, chunk_rows):
+                    chunk = tensor[chunk_start : min(chunk_start + chunk_rows, end)]
+                    data[chunk_start : chunk_start + len(chunk)] = (
+                        chunk.view(torch.uint8).reshape(len(chunk), -1).cpu().numpy()
+                    )
+            data.flush()
+            del data
+        self._write_index({"version": FILE_VERSION, "layout": layout, "state": state, "complete": True})
+        self.synced_num_inserted = state["num_inserted"]
+
+    def load(self, buffer):
+        """Copies the mapped ring tensors of the file into the buffer and restores its ring position.
+
+        Returns:
+            The restored state dict of the buffer.
+        """
+        index = self._read_index()
+        if index["version"] != FILE_VERSION or not index["complete"]:
+            raise ValueError(f"The replay buffer file {self.path} is incomplete or has an unsupported version.")
+        if index["layout"] != self._layout(buffer):
+            raise ValueError(
+                f"The replay buffer file {self.path} has layout {index['layout']}, expected {self._layout(buffer)}."
+            )
+        for name, (tensor, _) in buffer.ring_tensors().items():
+            if tensor.numel() == 0:
+                continue
+            data = self._map(name, tensor, "r")
+            rows = tensor.view(torch.uint8).view(len(tensor), -1)
+            chunk_rows = max(1, _CHUNK_BYTES // data.shape[1])
+            for start in range(0, len(tensor), chunk_rows):
+                rows[start : start + chunk_rows] = torch.from_numpy(np.array(data[start : start + chunk_rows]))
+            del data
+        buffer.load_state_dict(index["state"])
+        self.synced_num_inserted = index["state"]["num_inserted"]
+        return index["state"]
@@ -2,8 +2,6 @@ import numpy as np
 import torch
 from typing import Tuple
 
-_EPS = np.finfo(float).eps * 4.0
-
 
 class RunningMeanStd:
     def __init__(self, epsilon: float = 1e-4, shape: Tuple[int, ...] = ()):
@@ -52,7 +50,9 @@ class Normalizer(RunningMeanStd):
     def normalize_torch(self, input, device):
         mean_torch = torch.tensor(self.mean, device=device, dtype=torch.float32)
         std_torch = torch.sqrt(torch.tensor(self.var + self.epsilon, device=device, dtype=torch.float32))
-        return torch.clamp((input - mean_torch) / std_torch, -self.clip_obs, self.clip_obs)
+        # The last dimension may stack several observations, e.g. the frames of a history window.
+        frames = input.reshape(*input.shape[:-1], -1, mean_torch.shape[-1])
+        return torch.clamp((frames - mean_torch) / std_torch, -self.clip_obs, self.clip_obs).reshape(input.shape)
 
     def update_normalizer(self, rollouts, expert_loader):
         policy_data_generator = rollouts.feed_forward_generator_amp(None, mini_batch_size=expert_loader.batch_size)
@@ -62,37 +62,55 @@ class Normalizer(RunningMeanStd):
             self.update(torch.vstack(tuple(policy_batch) + tuple(expert_batch)).cpu().numpy())
 
 
-def quaternion_slerp(q0, q1, fraction, spin=0, shortestpath=True):
-    """Batch quaternion spherical linear interpolation."""
+def quaternion_slerp(
+    q0: torch.Tensor, q1: torch.Tensor, fraction: torch.Tensor, spin: int = 0, shortestpath: bool = True
+) -> torch.Tensor:
+    """Batch quaternion spherical linear interpolation.
 
-    out = torch.zeros_like(q0)
+    Branchless and free of in-place writes to the inputs, so it can be scripted or compiled. The result does not
+    depend on the component order, so both xyzw and wxyz quaternions are supported.
 
-    zero_mask = torch.isclose(fraction, torch.zeros_like(fraction)).squeeze()
-    ones_mask = torch.isclose(fraction, torch.ones_like(fraction)).squeeze()
-    out[zero_mask] = q0[zero_mask]
-    out[ones_mask] = q1[ones_mask]
+    Args:
+        q0: Quaternions at fraction 0, shape (..., 4).
+        q1: Quaternions at fraction 1, shape (..., 4).
+        fraction: Interpolation coefficients, broadcastable to (..., 1).
+        spin: Number of extra half turns.
+        shortestpath: Interpolate along the shortest arc, flipping q1 where q0 . q1 < 0.
 
+    Returns:
+        Interpolated quaternions, shape (..., 4).
+    """
     d = torch.sum(q0 * q1, dim=-1, keepdim=True)
-    dist_mask = (torch.abs(torch.abs(d) - 1.0) < _EPS).squeeze()
-    out[dist_mask] = q0[dist_mask]
-
     if shortestpath:
-        d_old = torch.clone(d)
-        d = torch.where(d_old < 0, -d, d)
-        q1 = torch.where(d_old < 0, -q1, q1)
-
-    angle = torch.acos(d) + spin * torch.pi
-    angle_mask = (torch.abs(angle) < _EPS).squeeze()
-    out[angle_mask] = q0[angle_mask]
-
-    final_mask = torch.logical_or(zero_mask, ones_mask)
-    final_mask = torch.logical_or(final_mask, dist_mask)
-    final_mask = torch.logical_or(final_mask, angle_mask)
-    final_mask = torch.logical_not(final_mask)
-
-    isin = 1.0 / angle
-    q0 *= torch.sin((1.0 - fraction) * angle) * isin
-    q1 *= torch.sin(fraction * angle) * isin
-    q0 += q1
-    out[final_mask] = q0[final_mask]
-    return out
+        q1 = torch.where(d < 0, -q1, q1)
+        d = torch.abs(d)
+    # Unnormalized (e.g. reduced-precision) inputs can push |d| slightly above 1.
+    angle = torch.acos(torch.clamp(d, -1.0, 1.0))
+    # Below this angle slerp loses precision (acos saturates) and normalized lerp is accurate to ~1e-8.
+    small_angle = angle < 1e-2
+    if spin != 0:
+        small_angle = torch.zeros_like(small_angle)
+        angle = angle + spin * torch.pi
+    isin = 1.0 / torch.where(small_angle, torch.ones_like(angle), torch.sin(angle))
+    w0 = torch.where(small_angle, 1.0 - fraction, torch.sin((1.0 - fraction) * angle) * isin)
+    w1 = torch.where(small_angle, fraction, torch.sin(fraction * angle) * isin)
+    out = w0 * q0 + w1 * q1
+    return torch.where(small_angle, out / torch.norm(out, dim=-1, keepdim=True), out)
+
+
+def quat_rotate(q: torch.Tensor, v: torch.Tensor) -> torch.Tensor:
+    """Rotates vectors by wxyz quaternions, as ``isaaclab.utils.math.quat_rotate``.
+
+    Args:
+        q: Quaternions (wxyz), shape (..., 4).
+        v: Vectors, shape (..., 3).
+
+    Returns:
+        Rotated vectors, shape (..., 3).
+    """
+    q_w = q[..., 0:1]
+    q_vec = q[..., 1:]
+    a = v * (2.0 * q_w**2 - 1.0)
+    b = torch.cross(q_vec, v, dim=-1) * q_w * 2.0
+    c = q_vec * torch.sum(q_vec * v, dim=-1, keepdim=True) * 2.0
+    return a + b + c
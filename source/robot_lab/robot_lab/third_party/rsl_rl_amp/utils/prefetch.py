@@ -0,0 +1,98 @@
+"""Background prefetching of minibatch generators."""
+
+import queue
+import threading
+import time
+
+# Marks the end of the wrapped generator in the queue.
+_END = object()
+
+
+class Prefetcher:
+    """Iterates over a generator whose items are produced ahead of time on a worker thread.
+
+    Up to ``max_prefetch`` items are kept in a bounded queue, so the worker builds the next minibatches while the
+    consumer runs its step. Items are yielded in the order of the wrapped generator. An exception raised by the
+    generator is re-raised by the consumer.
+
+    CUDA work issued by the worker goes to the default stream, which is shared with the consumer, so the items need no
+    extra synchronization.
+    """
+
+    def __init__(self, generator, max_prefetch):
+        if max_prefetch < 1:
+            raise ValueError(f"max_prefetch must be at least 1, got {max_prefetch}.")
+        self.generator = generator
+        self.max_prefetch = max_prefetch
+        self.queue = queue.Queue(maxsize=max_prefetch)
+        self.closed = threading.Event()
+        self.num_batches = 0
+        self.total_queue_depth = 0
+        self.stall_time = 0.0
+        self.max_stall_time = 0.0
+        self.worker = threading.Thread(target=self._produce, daemon=True)
+        self.worker.start()
+
+    def _produce(self):
+        try:
+            for item in self.generator:
+                if not self._put(item):
+                    return
+        except BaseException as e:
+            self._put(e)
+            return
+        self._put(_END)
+
+    def _put(self, item):
+        """Puts an item in the queue unless the prefetcher is closed. Returns whether the item was put."""
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed.is_set():
+            raise StopIteration
+        queue_depth = self.queue.qsize()
+        start = time.perf_counter()
+        item = self.queue.get()
+        stall_time = time.perf_counter() - start
+        if item is _END:
+            self.close()
+            raise StopIteration
+        if isinstance(item, BaseException):
+            self.close()
+            raise item
+        self.num_batches += 1
+        self.total_queue_depth += queue_depth
+        self.stall_time += stall_time
+        self.max_stall_time = max(self.max_stall_time, stall_time)
+        return item
+
+    def close(self):
+        """Stops the worker. Items that were prefetched but not consumed are dropped."""
+        self.closed.set()
+        self.worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def stats(self):
+        """Dict with the number of consumed batches, the mean queue depth seen before each batch and the total and
+        maximum time in seconds the consumer waited for a batch."""
+        return {
+            "num_batches": self.num_batches,
+            "mean_queue_depth": self.total_queue_depth / self.num_batches if self.num_batches > 0 else 0.0,
+            "stall_time": self.stall_time,
+            "max_stall_time": self.max_stall_time,
+        }
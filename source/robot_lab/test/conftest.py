@@ -0,0 +1,44 @@
+# Copyright (c) 2024-2025 Ziqi Fan
+# SPDX-License-Identifier: Apache-2.0
+
+"""Test setup that imports robot_lab modules without launching the simulator.
+
+Importing the robot_lab package registers its tasks and UI extensions, which needs the running Isaac Sim app. The
+tests only use modules that do not depend on them, so the package is replaced by an empty one with the same path.
+"""
+
+import json
+import numpy as np
+import os
+import sys
+import types
+
+import pytest
+
+ROBOT_LAB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "robot_lab")
+
+if "robot_lab" not in sys.modules:
+    robot_lab = types.ModuleType("robot_lab")
+    robot_lab.__path__ = [ROBOT_LAB_DIR]
+    sys.modules["robot_lab"] = robot_lab
+
+
+def write_motion_file(path, num_frames, frame_duration=0.02, weight=1.0, seed=0):
+    """Writes a JSON motion file of random frames in the A1 layout of AMPLoader.FRAME_SCHEMA."""
+    rng = np.random.default_rng(seed)
+    frames = rng.normal(size=(num_frames, 61))
+    # Root quaternions that are neither unit length nor standardized, as in recorded clips.
+    frames[:, 3:7] *= rng.uniform(0.5, 2.0, size=(num_frames, 1))
+    with open(path, "w") as f:
+        json.dump({"Frames": frames.tolist(), "MotionWeight": weight, "FrameDuration": frame_duration}, f)
+    return str(path)
+
+
+@pytest.fixture
+def motion_files(tmp_path):
+    """Motion files of clips with different lengths, frame durations and weights."""
+    return [
+        write_motion_file(tmp_path / "trot.txt", 40, frame_duration=0.02, weight=1.0, seed=0),
+        write_motion_file(tmp_path / "pace.txt", 25, frame_duration=0.03, weight=0.5, seed=1),
+        write_motion_file(tmp_path / "walk.txt", 60, frame_duration=0.0166, weight=2.0, seed=2),
+    ]
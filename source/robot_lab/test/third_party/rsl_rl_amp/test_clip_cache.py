@@ -0,0 +1,39 @@
+# Copyright (c) 2024-2025 Ziqi Fan
+# SPDX-License-Identifier: Apache-2.0
+
+import torch
+
+from robot_lab.third_party.rsl_rl_amp.datasets.clip_cache import ClipCache
+
+
+def test_lru_eviction_under_byte_budget():
+    # Clips of 10, 20, 30 and 80 float32 values.
+    clip_lens = [10, 20, 30, 80]
+    loaded = []
+
+    def load_clip(clip_idx):
+        loaded.append(clip_idx)
+        return torch.full((clip_lens[clip_idx],), float(clip_idx))
+
+    cache = ClipCache(load_clip, len(clip_lens), max_bytes=200)
+    assert len(cache) == 4
+    for clip_idx in (0, 1, 0, 2):
+        assert torch.all(cache[clip_idx] == clip_idx)
+    # Clip 2 needs 120 bytes of the 200 and evicts the least recently used clip 1, not clip 0.
+    assert list(cache.clips) == [0, 2]
+    assert cache[0] is not None and loaded == [0, 1, 2]
+    # Clip 1 evicts clip 2, which is now the least recently used one.
+    assert torch.all(cache[1] == 1)
+    assert loaded == [0, 1, 2, 1]
+    assert list(cache.clips) == [0, 1] and cache.cached_bytes == 120
+    # A clip larger than the whole budget is returned without evicting anything.
+    assert torch.all(cache[3] == 3)
+    assert list(cache.clips) == [0, 1]
+    assert cache.stats == {
+        "hits": 2,
+        "misses": 5,
+        "evictions": 2,
+        "hit_rate": 2 / 7,
+        "cached_clips": 2,
+        "cached_bytes": 120,
+    }
@@ -0,0 +1,61 @@
+# Copyright (c) 2024-2025 Ziqi Fan
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+import torch
+
+import pytest
+
+from robot_lab.third_party.rsl_rl_amp.datasets import motion_stream
+from robot_lab.third_party.rsl_rl_amp.datasets.motion_loader import AMPLoader
+
+
+@pytest.fixture
+def unimportable_robot_lab(tmp_path, monkeypatch):
+    """Puts a robot_lab package on sys.path that fails to import, like the real one outside of the simulator.
+
+    Worker processes inherit sys.path, so they fail if they import robot_lab. This process keeps the stub package of
+    conftest.
+    """
+    package_dir = tmp_path / "site" / "robot_lab"
+    package_dir.mkdir(parents=True)
+    (package_dir / "__init__.py").write_text("import omni.ext  # noqa: F401\n")
+    monkeypatch.syspath_prepend(str(tmp_path / "site"))
+
+
+@pytest.mark.parametrize("reorder_from_pybullet", [False, True])
+def test_ingest_workers_match_serial_ingest(motion_files, tmp_path, unimportable_robot_lab, reorder_from_pybullet):
+    serial = AMPLoader("cpu", 0.02, motion_files=motion_files, reorder_from_pybullet=reorder_from_pybullet)
+    cache_dir = str(tmp_path / "cache")
+    # Files are parsed by the workers first, then loaded from the cache they filled.
+    for _ in range(2):
+        pooled = AMPLoader(
+            "cpu",
+            0.02,
+            motion_files=motion_files,
+            motion_cache_dir=cache_dir,
+            reorder_from_pybullet=reorder_from_pybullet,
+            num_ingest_workers=2,
+        )
+        torch.testing.assert_close(pooled.all_trajectories_full, serial.all_trajectories_full, rtol=0, atol=0)
+        np.testing.assert_array_equal(pooled.trajectory_lens, serial.trajectory_lens)
+        np.testing.assert_array_equal(pooled.trajectory_weights, serial.trajectory_weights)
+
+
+def test_ingest_normalizes_root_quaternions(motion_files):
+    loader = AMPLoader("cpu", 0.02, motion_files=motion_files)
+    root_rot = loader.get_feature_batch(loader.all_trajectories_full, "root_rot")
+    torch.testing.assert_close(root_rot.norm(dim=-1), torch.ones(len(root_rot)))
+    assert torch.all(root_rot[:, -1] >= 0)
+
+
+def test_npz_shard_round_trip(motion_files, tmp_path):
+    shard_path = str(tmp_path / "shard.npz")
+    motion_stream.write_npz_shard(shard_path, motion_files)
+    clips = motion_stream.read_shard(shard_path)
+    assert [name for name, *_ in clips] == [f"{shard_path}:{name}" for name in ("trot", "pace", "walk")]
+    source_columns = AMPLoader.FRAME_SCHEMA.select(AMPLoader.DEFAULT_FEATURE_GROUPS).source_columns
+    for motion_file, (_, frames, motion_weight, frame_duration) in zip(motion_files, clips):
+        expected_frames, expected_weight, expected_frame_duration = AMPLoader.ingest_motion_file(motion_file)
+        np.testing.assert_allclose(frames, expected_frames[:, source_columns], rtol=1e-6)
+        assert (motion_weight, frame_duration) == (expected_weight, expected_frame_duration)
@@ -0,0 +1,84 @@
+# Copyright (c) 2024-2025 Ziqi Fan
+# SPDX-License-Identifier: Apache-2.0
+
+import torch
+
+import pytest
+from conftest import write_motion_file
+
+from robot_lab.third_party.rsl_rl_amp.datasets.motion_loader import AMPLoader
+
+
+def test_feature_groups_must_cover_amp_observations(motion_files):
+    with pytest.raises(ValueError, match="foot_pos"):
+        AMPLoader("cpu", 0.02, motion_files=motion_files, feature_groups=AMPLoader.RESET_STATE_GROUPS)
+
+
+def test_reset_only_loader(motion_files):
+    loader = AMPLoader(
+        "cpu",
+        0.02,
+        motion_files=motion_files,
+        build_reset_table=True,
+        feature_groups=AMPLoader.RESET_STATE_GROUPS,
+        reset_only=True,
+    )
+    root_pose, root_velocity, joint_pos, joint_vel = loader.get_reset_state_batch(8)
+    assert root_pose.shape == (8, 7) and root_velocity.shape == (8, 6)
+    with pytest.raises(ValueError, match="reset-only"):
+        loader.observation_dim
+    with pytest.raises(ValueError, match="reset-only"):
+        next(loader.feed_forward_generator(1, 8))
+    with pytest.raises(ValueError, match="Lazy mirroring"):
+        AMPLoader("cpu", 0.02, motion_files=motion_files, mirror_motions="lazy", reset_only=True)
+
+
+def test_precomputed_table_stays_within_short_clips(tmp_path):
+    # The middle clip is shorter than frame_duration + time_between_frames.
+    motion_files = [
+        write_motion_file(tmp_path / "long.txt", 30, seed=0),
+        write_motion_file(tmp_path / "short.txt", 2, seed=1),
+        write_motion_file(tmp_path / "next.txt", 30, seed=2),
+    ]
+    loader = AMPLoader("cpu", 0.02, motion_files=motion_files, precompute_amp_observations=True)
+    row_offset = loader.amp_observation_row_offsets[1]
+    assert loader.amp_observation_num_transitions[1] == 1
+    short_clip = loader.trajectories_full[1][:, loader.amp_observation_columns].float()
+    torch.testing.assert_close(loader.amp_observation_table[row_offset].float(), short_clip[0])
+    torch.testing.assert_close(loader.amp_observation_table[row_offset + 1].float(), short_clip[-1])
+
+
+def test_packed_frames_match_per_trajectory_frames(motion_files):
+    loader = AMPLoader("cpu", 0.02, motion_files=motion_files, seed=0)
+    traj_idxs = loader.weighted_traj_idx_sample_batch(64)
+    times = loader.traj_time_sample_batch(traj_idxs)
+    frames = loader.get_full_frame_at_time_batch(traj_idxs, times)
+    expected = torch.stack(
+        [loader.get_full_frame_at_time(traj_idx, time) for traj_idx, time in zip(traj_idxs.tolist(), times.tolist())]
+    )
+    # The per-trajectory reference also standardizes the root quaternion to w >= 0.
+    root_rot = loader.get_feature_batch(frames, "root_rot")
+    root_rot[:] = torch.where(root_rot[:, -1:] < 0, -root_rot, root_rot)
+    torch.testing.assert_close(frames, expected)
+
+
+def test_compact_preload_matches_dense_preload(motion_files):
+    options = dict(motion_files=motion_files, preload_transitions=True, num_preload_transitions=500, seed=0)
+    dense = AMPLoader("cpu", 0.02, **options)
+    compact = AMPLoader("cpu", 0.02, compact_preload=True, **options)
+    idx_low, idx_high, blend = compact.get_preloaded_frame_idx_batch(torch.arange(500))
+    preloaded_s = compact.get_full_frame_at_packed_idx_batch(idx_low[0], idx_high[0], blend[0])
+    preloaded_s_next = compact.get_full_frame_at_packed_idx_batch(idx_low[1], idx_high[1], blend[1])
+    torch.testing.assert_close(preloaded_s, dense.preloaded_s)
+    torch.testing.assert_close(preloaded_s_next, dense.preloaded_s_next)
+    torch.testing.assert_close(
+        compact.get_feature_batch(preloaded_s, "joint_pos").mean(dim=0),
+        dense.get_feature_batch(dense.preloaded_s, "joint_pos").mean(dim=0),
+    )
+    # Both draw the same preloaded transitions from their generators.
+    torch.testing.assert_close(compact.get_full_frame_batch(32), dense.get_full_frame_batch(32))
+    for (s, s_next), (dense_s, dense_s_next) in zip(
+        compact.feed_forward_generator(2, 16), dense.feed_forward_generator(2, 16)
+    ):
+        torch.testing.assert_close(s, dense_s)
+        torch.testing.assert_close(s_next, dense_s_next)
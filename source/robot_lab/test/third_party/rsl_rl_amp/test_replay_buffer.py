@@ -0,0 +1,58 @@
+# Copyright (c) 2024-2025 Ziqi Fan
+# SPDX-License-Identifier: Apache-2.0
+
+import torch
+
+from robot_lab.third_party.rsl_rl_amp.storage import FrameStreamReplayBuffer, PairReplayBuffer, ReplayBuffer
+
+
+def test_pair_buffer_host_tier_matches_ring():
+    # Four pairs on the device and six in the host tier, filled past one wrap of the ring.
+    buffer = PairReplayBuffer(3, 4, "cpu", host_buffer_size=6)
+    reference = ReplayBuffer(3, 10, "cpu")
+    for num_states in (3, 5, 4, 1):
+        states, next_states = torch.randn(num_states, 3), torch.randn(num_states, 3)
+        buffer.insert(states, next_states)
+        reference.insert(states, next_states)
+    assert (buffer.step, buffer.num_samples) == (reference.step, reference.num_samples) == (3, 10)
+
+    idxs = torch.tensor([[9, 0, 4], [3, 7, 4]])
+    pairs = buffer.get_pairs(idxs)
+    assert pairs.shape == (2, 3, 2, 3)
+    torch.testing.assert_close(pairs[..., 0, :], reference.states[idxs])
+    torch.testing.assert_close(pairs[..., 1, :], reference.next_states[idxs])
+    for batch in buffer.feed_forward_generator(2, 5):
+        assert batch.shape == (5, 2, 3)
+
+
+def insert_steps(buffer, values, dones):
+    """Inserts one step per value, with frames value and value + 10 for the two environments."""
+    for value, done in zip(values, dones):
+        next_states = torch.tensor([[float(value)], [value + 10.0]])
+        buffer.insert(next_states - 1.0, next_states, torch.tensor(done))
+
+
+def test_frame_stream_windows_stop_at_episode_starts_and_oldest_row():
+    buffer = FrameStreamReplayBuffer(1, 2, 8, "cpu", history_length=2)
+    assert buffer.num_rows == 4
+    # Environment 0 starts an episode at frame 4, environment 1 runs through. Frames 1 and 2 are overwritten.
+    insert_steps(buffer, range(1, 7), [[value == 3, False] for value in range(1, 7)])
+
+    ages, envs = buffer.sample_idxs(8, 32)
+    # The transition into frame 4 of environment 0 starts from a reset observation, so it is never sampled.
+    assert set(zip(ages.flatten().tolist(), envs.flatten().tolist())) == {(0, 0), (1, 0), (0, 1), (1, 1), (2, 1)}
+
+    states, next_states = buffer.get_transitions(torch.tensor([0, 1, 1, 2]), torch.tensor([0, 0, 1, 1]))
+    # Windows are padded with the first frame of the episode, or with the oldest stored frame.
+    torch.testing.assert_close(states, torch.tensor([[4.0, 5.0], [4.0, 4.0], [13.0, 14.0], [13.0, 13.0]]))
+    torch.testing.assert_close(next_states, torch.tensor([[5.0, 6.0], [4.0, 5.0], [14.0, 15.0], [13.0, 14.0]]))
+
+
+def test_frame_stream_latest_transition_starts_at_reset_observations():
+    buffer = FrameStreamReplayBuffer(1, 2, 8, "cpu", history_length=2)
+    # Environment 1 ends its episode at the last step, so its current observation is a reset observation.
+    insert_steps(buffer, range(1, 5), [[False, value == 4] for value in range(1, 5)])
+
+    states, next_states = buffer.get_latest_transition(torch.tensor([[4.0], [100.0]]), torch.tensor([[5.0], [101.0]]))
+    torch.testing.assert_close(states, torch.tensor([[3.0, 4.0], [100.0, 100.0]]))
+    torch.testing.assert_close(next_states, torch.tensor([[4.0, 5.0], [100.0, 101.0]]))
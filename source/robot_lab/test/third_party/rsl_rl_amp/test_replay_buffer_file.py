@@ -0,0 +1,52 @@
+# Copyright (c) 2024-2025 Ziqi Fan
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+import torch
+
+import pytest
+
+from robot_lab.third_party.rsl_rl_amp.storage import PairReplayBuffer, ReplayBufferFile
+
+
+def test_round_trip_across_ring_wrap(tmp_path):
+    # A ring of ten pairs, split between the device and the host tier.
+    buffer = PairReplayBuffer(3, 4, "cpu", host_buffer_size=6)
+    buffer_file = ReplayBufferFile(str(tmp_path / "replay"))
+    buffer.insert(torch.randn(7, 3), torch.randn(7, 3))
+    buffer_file.save(buffer)
+    # The next save only writes the six new rows, which wrap around the end of the ring.
+    buffer.insert(torch.randn(6, 3), torch.randn(6, 3))
+    buffer_file.save(buffer)
+
+    loaded = PairReplayBuffer(3, 4, "cpu", host_buffer_size=6)
+    state = ReplayBufferFile(str(tmp_path / "replay")).load(loaded)
+    assert state == buffer.state_dict() == {"step": 3, "num_samples": 10, "num_inserted": 13}
+    torch.testing.assert_close(loaded.pairs, buffer.pairs)
+    torch.testing.assert_close(loaded.host_pairs, buffer.host_pairs)
+
+
+def test_interrupted_save_is_not_loaded(tmp_path, monkeypatch):
+    buffer = PairReplayBuffer(3, 4, "cpu", host_buffer_size=6)
+    buffer_file = ReplayBufferFile(str(tmp_path / "replay"))
+    buffer.insert(torch.randn(5, 3), torch.randn(5, 3))
+    buffer_file.save(buffer)
+
+    buffer.insert(torch.randn(4, 3), torch.randn(4, 3))
+    with monkeypatch.context() as patch:
+
+        def interrupt(self):
+            raise KeyboardInterrupt
+
+        patch.setattr(np.memmap, "flush", interrupt)
+        with pytest.raises(KeyboardInterrupt):
+            buffer_file.save(buffer)
+    with pytest.raises(ValueError, match="incomplete"):
+        ReplayBufferFile(str(tmp_path / "replay")).load(PairReplayBuffer(3, 4, "cpu", host_buffer_size=6))
+
+    # The next save rewrites the whole ring, as the file may hold some of the interrupted rows.
+    buffer_file.save(buffer)
+    loaded = PairReplayBuffer(3, 4, "cpu", host_buffer_size=6)
+    ReplayBufferFile(str(tmp_path / "replay")).load(loaded)
+    torch.testing.assert_close(loaded.pairs, buffer.pairs)
+    torch.testing.assert_close(loaded.host_pairs, buffer.host_pairs)
@@ -0,0 +1,43 @@
+# Copyright (c) 2024-2025 Ziqi Fan
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import torch
+
+from robot_lab.third_party.rsl_rl_amp.datasets import shared_library
+from robot_lab.third_party.rsl_rl_amp.datasets.motion_loader import AMPLoader
+
+
+def test_library_is_removed_by_the_last_loader(motion_files, tmp_path):
+    library_dir = str(tmp_path / "library")
+    options = dict(motion_files=motion_files, shared_library_dir=library_dir, precompute_amp_observations=True)
+    # Loaders hold the library through their own lock files, like separate processes.
+    publisher = AMPLoader("cpu", 0.02, **options)
+    subscriber = AMPLoader("cpu", 0.02, **options)
+    key = publisher.shared_library_key
+    assert subscriber.shared_library_key == key
+    torch.testing.assert_close(subscriber.all_trajectories_full, publisher.all_trajectories_full)
+    torch.testing.assert_close(subscriber.amp_observation_table, publisher.amp_observation_table)
+
+    publisher.close()
+    assert sorted(os.listdir(library_dir)) == [key, f"{key}.hold", f"{key}.lock"]
+    subscriber.close()
+    assert os.listdir(library_dir) == []
+    # The mapped tensors outlive the files.
+    assert torch.isfinite(subscriber.all_trajectories_full).all()
+
+
+def test_purge_removes_unheld_libraries(motion_files, tmp_path):
+    library_dir = str(tmp_path / "library")
+    held = AMPLoader("cpu", 0.02, motion_files=motion_files, shared_library_dir=library_dir)
+    # A library left by a process that exited without closing its loader.
+    stale_key = "0" * 64
+    with shared_library.lock(library_dir, stale_key):
+        shared_library.publish(library_dir, stale_key, {"frames": torch.zeros(3, 2)})
+    (tmp_path / "library" / "notes.txt").write_text("not a library")
+
+    assert shared_library.purge(library_dir) == [stale_key]
+    assert sorted(os.listdir(library_dir)) == sorted(
+        [held.shared_library_key, f"{held.shared_library_key}.hold", f"{held.shared_library_key}.lock", "notes.txt"]
+    )
+    held.close()